@@ -0,0 +1,180 @@
+"""
+Run latency benchmark for ytm2lfm.database.SQLite.
+
+Simulates the database side of a scrobble run (schema init, fetch of the latest scrobbles, batched inserts
+and cleanup) on a large database, comparing:
+
+- legacy: a new connection per operation, rollback journal, synchronous=FULL, one commit per operation
+- managed: one persistent connection, WAL, synchronous=NORMAL, tuned cache/mmap, one transaction per run
+
+Commits are counted with a trace callback. The fsync and fdatasync calls of the runs are counted by attaching
+`strace -c -e trace=fsync,fdatasync` to the benchmark process, populating the database is not counted. Without
+strace, or when it cannot attach (ptrace restricted), the count is estimated from the commits and marked with
+a ~: a rollback journal commit with synchronous=FULL syncs the journal, the database and the directory
+(~3 fsyncs), while WAL with synchronous=NORMAL only syncs on checkpoints.
+
+The synced window is sized to the populated rows, each run overwrites the oldest ones in place and moves them
+to the archive, so the file only grows by the archived rows.
+
+Usage:
+    PYTHONPATH=src python benchmarks/bench_database.py [--rows 1000000] [--runs 20] [--tracks 200]
+"""
+
+import argparse
+import os
+import shutil
+import signal
+import statistics
+import subprocess
+import tempfile
+import time
+
+from ytm2lfm.database import SQLite
+from ytm2lfm.track import Track
+
+LEGACY = dict(persistent=False, journal_mode="DELETE", synchronous="FULL", cache_size=-2000, mmap_size=0)
+MANAGED = dict(persistent=True)
+
+
+class CommitCounter:
+    def __init__(self):
+        self.commits = 0
+
+    def __call__(self, statement):
+        if statement.startswith("COMMIT"):
+            self.commits += 1
+
+
+def instrument(db, counter):
+    connect = db.connect
+
+    def traced_connect(**kwargs):
+        conn = connect(**kwargs)
+        conn.set_trace_callback(counter)
+        return conn
+
+    db.connect = traced_connect
+
+
+def start_fsync_trace(output_path):
+    """Attach strace to this process to count its fsync and fdatasync calls, None if it cannot."""
+    strace = shutil.which("strace")
+    if strace is None:
+        return None
+    command = [strace, "-f", "-c", "-e", "trace=fsync,fdatasync", "-o", output_path, "-p", str(os.getpid())]
+    proc = subprocess.Popen(command, stderr=subprocess.PIPE, text=True)
+    # the syscalls are only traced once strace reports it attached
+    for line in proc.stderr:
+        if "attached" in line:
+            return proc
+    proc.wait()
+    return None
+
+
+def stop_fsync_trace(proc, output_path):
+    """Detach strace and read the number of fsync and fdatasync calls from its summary."""
+    proc.send_signal(signal.SIGINT)
+    proc.communicate()
+    calls = 0
+    with open(output_path) as f:
+        for line in f:
+            fields = line.split()
+            # % time, seconds, usecs/call, calls, [errors,] syscall
+            if fields and fields[-1] in ("fsync", "fdatasync"):
+                calls += int(fields[3])
+    return calls
+
+
+def make_tracks(start, n):
+    return [Track(f"vid{i:011d}", f"title {i}", f"artist {i % 997}", "", 0) for i in range(start, start + n)]
+
+
+def populate(db_path, rows):
+    db = SQLite(db_path, window_size=rows)
+    chunk = 50_000
+    with db.transaction():
+        for start in range(0, rows, chunk):
+            db.insert_tracks(make_tracks(start, min(chunk, rows - start)))
+    db.close()
+
+
+def run_once(db_path, options, counter, start, tracks, batch_size, keep_latest, single_transaction):
+    db = SQLite(db_path, window_size=keep_latest, **options)
+    instrument(db, counter)
+    if db.persistent:
+        # the connection opened in __init__ is not traced, reopen it through the traced connect
+        db.close()
+
+    db.fetch_latest_scrobbles()
+    batches = make_tracks(start, tracks)
+
+    def write():
+        for i in range(0, len(batches), batch_size):
+            db.insert_tracks(batches[i : i + batch_size])
+        db.delete_except_latest_n(keep_latest)
+
+    t0 = time.perf_counter()
+    if single_transaction:
+        with db.transaction():
+            write()
+    else:
+        write()
+    write_latency = time.perf_counter() - t0
+    db.close()
+    return write_latency
+
+
+def bench(label, options, single_transaction, args):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db_path = os.path.join(tmpdir, "bench.db")
+        populate(db_path, args.rows)
+        counter = CommitCounter()
+        latencies, write_latencies = [], []
+        trace_path = os.path.join(tmpdir, "fsyncs.strace")
+        trace = start_fsync_trace(trace_path)
+        for run in range(args.runs):
+            t0 = time.perf_counter()
+            write_latency = run_once(
+                db_path,
+                options,
+                counter,
+                args.rows + run * args.tracks,
+                args.tracks,
+                args.batch_size,
+                args.rows,
+                single_transaction,
+            )
+            latencies.append(time.perf_counter() - t0)
+            write_latencies.append(write_latency)
+        fsync_calls = None if trace is None else stop_fsync_trace(trace, trace_path)
+        size = os.path.getsize(db_path)
+
+    commits = counter.commits / args.runs
+    if fsync_calls is None:
+        fsyncs = f"~{commits * (3 if options.get('journal_mode') == 'DELETE' else 0):.1f}"
+    else:
+        fsyncs = f"{fsync_calls / args.runs:.1f}"
+    print(
+        f"{label:>8} {statistics.median(latencies) * 1e3:>12.2f} {statistics.median(write_latencies) * 1e3:>14.2f} "
+        f"{commits:>12.1f} {fsyncs:>12} {size / 2**20:>10.1f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000, help="rows in the database before the runs")
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--tracks", type=int, default=200, help="tracks inserted per run")
+    parser.add_argument("--batch-size", type=int, default=50)
+    args = parser.parse_args()
+
+    print(
+        f"{'mode':>8} {'run p50 (ms)':>12} {'write p50 (ms)':>14} {'commits/run':>12} {'fsyncs/run':>12}"
+        f" {'size (MiB)':>10}"
+    )
+    bench("legacy", LEGACY, False, args)
+    bench("managed", MANAGED, True, args)
+
+
+if __name__ == "__main__":
+    main()
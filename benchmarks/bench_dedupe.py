@@ -0,0 +1,244 @@
+"""
+Memory and lookup benchmark of the duplicate filter of stored plays (ytm2lfm.dedupe).
+
+For each size, the plays are added to a Bloom filter sized for them, then the filter is probed with plays that
+are not stored, the common case of an import: every "definitely absent" answer is a database probe saved.
+Compared against:
+
+- set: the (video_id, bucket) keys in a Python set, exact but held in memory, measured with tracemalloc
+- sqlite: SQLite.has_play on a database of the same number of archived plays, the indexed probe the filter
+  only runs on possible hits (--sqlite, populating the database takes a while at 10^7)
+
+With --paths, the filters are also measured where runs use them, on a database holding that many archived plays
+and as many scrobbles seeded from Last.fm: loading the persisted filters, SQLite.insert_tracks of a history of new
+plays with and without the filter of the stored plays, and Scrobbler.enqueue_tracks, which records the plays
+through that filter and checks the seeded scrobbles through the Last.fm one. Queries counts the SELECT statements
+run against the scrobbles and lastfm_history tables per call.
+
+Usage:
+    PYTHONPATH=src python benchmarks/bench_dedupe.py [--entries 1000000,10000000] [--lookups 100000]
+                                                     [--no-set] [--sqlite] [--paths] [--runs 20]
+"""
+
+import argparse
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+from ytm2lfm.database import SQLite
+from ytm2lfm.dedupe import DuplicateFilter, LastFMDuplicateFilter
+from ytm2lfm.scrobbler import Scrobbler
+from ytm2lfm.track import Track
+
+BUCKET = 30
+ERROR_RATE = 0.01
+DEDUPE_WINDOW = 1800
+# plays of a YouTube Music history
+HISTORY = 200
+# 2020-01-01, plays are spread a few minutes apart from there
+START = 1577836800
+
+
+def stored_play(i):
+    return f"vid{i % 50_000:08d}", START + 300 * i
+
+
+def absent_play(i):
+    return f"new{i % 50_000:08d}", START + 300 * i
+
+
+def key(video_id, timestamp):
+    return f"{video_id}\0{timestamp // BUCKET}"
+
+
+def bench_bloom(entries, lookups):
+    duplicates = DuplicateFilter(None, bucket=BUCKET, capacity=entries, error_rate=ERROR_RATE)
+    t0 = time.perf_counter()
+    bloom = duplicates._new_bloom()
+    for i in range(entries):
+        bloom.add(key(*stored_play(i)))
+    build = time.perf_counter() - t0
+
+    duplicates._bloom = bloom
+    t0 = time.perf_counter()
+    hits = sum(duplicates.might_contain(*absent_play(i)) for i in range(lookups))
+    lookup = time.perf_counter() - t0
+    return len(bloom.bits), build, lookup / lookups, hits / lookups
+
+
+def bench_set(entries, lookups):
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    keys = {key(*stored_play(i)) for i in range(entries)}
+    memory = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+
+    t0 = time.perf_counter()
+    for i in range(lookups):
+        video_id, timestamp = absent_play(i)
+        bucket = timestamp // BUCKET
+        any(f"{video_id}\0{bucket + offset}" in keys for offset in (-1, 0, 1))
+    return memory, (time.perf_counter() - t0) / lookups
+
+
+def bench_sqlite(entries, lookups):
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        db = SQLite(os.path.join(tmpdirname, "scrobbles.db"))
+        chunk = 50_000
+        for start in range(0, entries, chunk):
+            db.archive_tracks(
+                [
+                    Track(*stored_play(i)[:1], "title", "artist", "", "", stored_play(i)[1])
+                    for i in range(start, min(entries, start + chunk))
+                ]
+            )
+        t0 = time.perf_counter()
+        for i in range(lookups):
+            video_id, timestamp = absent_play(i)
+            db.has_play(video_id, timestamp - BUCKET + 1, timestamp + BUCKET - 1)
+        lookup = (time.perf_counter() - t0) / lookups
+        db.close()
+        return os.path.getsize(os.path.join(tmpdirname, "scrobbles.db")), lookup
+
+
+def populate(db, entries):
+    chunk = 50_000
+    for start in range(0, entries, chunk):
+        plays = [stored_play(i) for i in range(start, min(entries, start + chunk))]
+        db.archive_tracks([Track(video_id, "title", "artist", "", "", timestamp) for video_id, timestamp in plays])
+        db.insert_lastfm_history(("artist", video_id, timestamp) for video_id, timestamp in plays)
+
+
+def new_plays(run):
+    """A history of plays never stored, stamped like the plays of a run."""
+    now = int(time.time())
+    return [
+        Track(f"run{run:04d}-{i:03d}", f"run{run:04d}-{i:03d}", "artist", "", "", now - 200 * i) for i in range(HISTORY)
+    ]
+
+
+def counted_queries(db, fn):
+    statements = []
+    with db.transaction() as conn:
+        conn.set_trace_callback(statements.append)
+        try:
+            fn()
+        finally:
+            conn.set_trace_callback(None)
+    return sum(
+        statement.lstrip().startswith("SELECT") and ("FROM scrobbles" in statement or "lastfm_history" in statement)
+        for statement in statements
+    )
+
+
+def bench_paths(entries, runs):
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        db = SQLite(os.path.join(tmpdirname, "scrobbles.db"))
+        populate(db, entries)
+
+        # sized with room for the plays the runs store, a full filter is rebuilt twice as large
+        capacity = 2 * entries
+
+        def filters():
+            return (
+                DuplicateFilter(db, bucket=BUCKET, capacity=capacity, error_rate=ERROR_RATE),
+                LastFMDuplicateFilter(db, bucket=DEDUPE_WINDOW + 1, capacity=capacity, error_rate=ERROR_RATE),
+            )
+
+        results = []
+        t0 = time.perf_counter()
+        for duplicates in filters():
+            duplicates.load()
+            duplicates.save()
+        results.append(("load", "build", time.perf_counter() - t0, 0))
+
+        timings = []
+        for _ in range(runs):
+            t0 = time.perf_counter()
+            duplicates, lastfm_duplicates = filters()
+            duplicates.load()
+            lastfm_duplicates.load()
+            timings.append(time.perf_counter() - t0)
+        results.append(("load", "persisted", statistics.median(timings), 0))
+
+        run = 0
+        for variant, filter_of_plays in (("select", None), ("filter", duplicates)):
+            timings, queries = [], []
+            for _ in range(runs):
+                run += 1
+                tracks = new_plays(run)[::-1]
+                t0 = time.perf_counter()
+                queries.append(counted_queries(db, lambda: db.insert_tracks(tracks, duplicates=filter_of_plays)))
+                timings.append(time.perf_counter() - t0)
+            results.append(("insert", variant, statistics.median(timings), statistics.median(queries)))
+
+        scrobbler = Scrobbler(
+            None,
+            None,
+            db,
+            dedupe_window=DEDUPE_WINDOW,
+            duplicate_filter=duplicates,
+            lastfm_duplicate_filter=lastfm_duplicates,
+        )
+        timings, queries = [], []
+        for _ in range(runs):
+            run += 1
+            tracks = new_plays(run)
+            t0 = time.perf_counter()
+            queries.append(counted_queries(db, lambda: scrobbler.enqueue_tracks(tracks)))
+            timings.append(time.perf_counter() - t0)
+        results.append(("scrobble", "filters", statistics.median(timings), statistics.median(queries)))
+
+        memory = len(duplicates._bloom.bits) + len(lastfm_duplicates._bloom.bits)
+        db.close()
+        return memory, os.path.getsize(os.path.join(tmpdirname, "scrobbles.db")), results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", default="1000000,10000000", help="Comma-separated numbers of stored plays")
+    parser.add_argument("--lookups", type=int, default=100_000)
+    parser.add_argument("--no-set", action="store_true", help="Skip the set, it takes ~1 GiB at 10^7 entries")
+    parser.add_argument("--sqlite", action="store_true", help="Also time SQLite.has_play probes")
+    parser.add_argument("--paths", action="store_true", help="Also time the insert and scrobble paths")
+    parser.add_argument("--runs", type=int, default=20, help="Calls of each path timed with --paths")
+    args = parser.parse_args()
+
+    print(
+        f"bucket {BUCKET}s, target false positive rate {ERROR_RATE:.0%} per play,"
+        f" {args.lookups} lookups of absent plays"
+    )
+    print(
+        f"{'entries':>10} {'variant':>8} {'memory (MiB)':>13} {'build (s)':>10} {'lookup (us)':>12}"
+        f" {'false positives':>16}"
+    )
+    for entries in map(int, args.entries.split(",")):
+        memory, build, lookup, false_positives = bench_bloom(entries, args.lookups)
+        print(
+            f"{entries:>10} {'bloom':>8} {memory / 2**20:>13.1f} {build:>10.1f} {lookup * 1e6:>12.2f}"
+            f" {false_positives:>16.2%}"
+        )
+        if not args.no_set:
+            memory, lookup = bench_set(entries, args.lookups)
+            print(f"{entries:>10} {'set':>8} {memory / 2**20:>13.1f} {'':>10} {lookup * 1e6:>12.2f} {0:>16.2%}")
+        if args.sqlite:
+            size, lookup = bench_sqlite(entries, args.lookups)
+            print(f"{entries:>10} {'sqlite':>8} {size / 2**20:>13.1f} {'':>10} {lookup * 1e6:>12.2f} {0:>16.2%}")
+
+    if args.paths:
+        print(
+            f"\n{HISTORY} new plays per call, database of as many archived plays as seeded Last.fm scrobbles,"
+            f" p50 of {args.runs} calls"
+        )
+        print(f"{'entries':>10} {'path':>9} {'variant':>10} {'p50 (ms)':>9} {'queries':>8}")
+        for entries in map(int, args.entries.split(",")):
+            memory, size, results = bench_paths(entries, args.runs)
+            for path, variant, median, queries in results:
+                print(f"{entries:>10} {path:>9} {variant:>10} {median * 1e3:>9.1f} {queries:>8.0f}")
+            print(f"{entries:>10} filters {memory / 2**20:.1f} MiB in memory, database {size / 2**20:.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+"""
+End-to-end benchmark harness: scrobble runs of 1 to 1000 accounts replaying synthetic listening traces (see
+traces.py) against the local stand-in YouTube Music and Last.fm servers (see standins.py), offline.
+
+For each number of accounts, the accounts are first synced with their initial history (not measured), then
+every measured run lets each listener play some tracks and runs either cli.run_scrobble (--mode cli) or
+Daemon.run_once (--mode daemon). Reported per scenario:
+
+- p50 and p99 run latency (with few runs, p99 is close to the slowest run)
+- requests per run, all endpoints and Last.fm only, and tracks scrobbled per run
+- bytes written to the database per run, measured as the size of its write-ahead log, which is truncated
+  before each run and never checkpointed during one
+
+Requests and bytes are deterministic for a given trace seed, so --check compares them with a baseline file
+and exits with an error on a regression; CI runs it with benchmarks/baseline.json. Latencies depend on the
+machine and are only compared with --latency-tolerance.
+
+Usage:
+    PYTHONPATH=src python benchmarks/bench_harness.py [--accounts 1,10,100] [--runs 10] [--mode cli]
+        [--latency-ms 2] [--error-rate 0] [--lastfm-rate-limit RPS] [--json results.json]
+        [--check benchmarks/baseline.json] [--tolerance 0.25]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import ExitStack
+from typing import Dict, List
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from standins import StandinServer, make_standin_clients  # noqa: E402
+from traces import ListeningTrace, make_catalogue  # noqa: E402
+
+CHECKED_METRICS = ("requests_per_run", "db_bytes_per_run")
+
+
+class WalMeter:
+    """Bytes written to a WAL-mode database, read from its write-ahead log before it is checkpointed."""
+
+    def __init__(self, db_path: str):
+        self.wal_path = db_path + "-wal"
+        self.db_path = db_path
+        self.written = 0
+
+    def reset(self) -> None:
+        """Checkpoint and truncate the log, only the writes that follow are counted."""
+        if os.path.exists(self.db_path):
+            conn = sqlite3.connect(self.db_path)
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            conn.close()
+
+    def collect(self) -> None:
+        """Count the bytes currently in the log."""
+        if os.path.exists(self.wal_path):
+            self.written += os.path.getsize(self.wal_path)
+
+    def patches(self, sqlite_cls):
+        """Patches of SQLite disabling automatic checkpoints and counting the log before it is closed."""
+        connect, close = sqlite_cls.connect, sqlite_cls.close
+        meter = self
+
+        def metered_connect(self, **kwargs):
+            conn = connect(self, **kwargs)
+            conn.execute("PRAGMA wal_autocheckpoint = 0")
+            return conn
+
+        def metered_close(self):
+            if self._conn is not None:
+                meter.collect()
+            close(self)
+
+        return (
+            mock.patch.object(sqlite_cls, "connect", metered_connect),
+            mock.patch.object(sqlite_cls, "close", metered_close),
+        )
+
+
+def configure(tmpdir: str, n_accounts: int, client_rate_limit: float) -> List[str]:
+    """Point the settings at a fresh database and n accounts, returns the auth file name of each account."""
+    from ytm2lfm.config import get_settings
+
+    auth_files = []
+    accounts = []
+    for i in range(n_accounts):
+        auth_file = os.path.join(tmpdir, f"oauth-{i}.json")
+        open(auth_file, "w").close()
+        auth_files.append(os.path.basename(auth_file))
+        accounts.append(
+            {
+                "name": f"account{i}",
+                "lastfm": {"api_key": "key", "shared_secret": "secret", "registered_to": f"user{i}", "password": "pw"},
+                "ytmusic": {"auth_file": auth_file, "client_id": "id", "client_secret": "secret"},
+            }
+        )
+    os.environ.update(
+        {
+            "SQLITE__DB_PATH": os.path.join(tmpdir, "scrobbles.db"),
+            "SQLITE__JOURNAL_MODE": "WAL",
+            "ACCOUNTS": json.dumps(accounts),
+            "SCROBBLER__RATE_LIMIT": str(client_rate_limit),
+            "SCROBBLER__RATE_LIMIT_BURST": str(max(1, int(client_rate_limit))),
+        }
+    )
+    for name in [name for name in os.environ if name.startswith(("LASTFM__", "YTMUSIC__"))]:
+        del os.environ[name]
+    get_settings.cache_clear()
+    return auth_files
+
+
+def percentile(values: List[float], q: int) -> float:
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1]
+
+
+def run_scenario(args, n_accounts: int) -> Dict[str, float]:
+    import cli
+    from ytm2lfm.config import get_settings
+    from ytm2lfm.daemon import Daemon
+    from ytm2lfm.database import SQLite
+
+    latency = args.latency_ms / 1e3
+    latencies = {
+        path: latency
+        for path in ("/ytmusic/auth", "/ytmusic/history", "/ytmusic/song", "/lastfm/auth", "/lastfm/scrobble")
+    }
+    error_rates = {"/lastfm/scrobble": args.error_rate, "/ytmusic/history": args.error_rate}
+    catalogue = make_catalogue(args.catalogue)
+    traces = [ListeningTrace(catalogue, seed=args.seed + i) for i in range(n_accounts)]
+
+    with (
+        tempfile.TemporaryDirectory() as tmpdir,
+        StandinServer(latencies, error_rates=error_rates, lastfm_rate_limit=args.lastfm_rate_limit) as server,
+        ExitStack() as stack,
+    ):
+        auth_files = configure(tmpdir, n_accounts, args.client_rate_limit)
+        lastfm_cls, ytmusic_cls = make_standin_clients(server.url)
+        meter = WalMeter(os.environ["SQLITE__DB_PATH"])
+        for patch in (
+            mock.patch("ytm2lfm.lastfm.LastFMClient", lastfm_cls),
+            mock.patch("ytm2lfm.ytmusic.YTMusicClient", ytmusic_cls),
+            mock.patch("ytm2lfm.daemon.LastFMClient", lastfm_cls),
+            mock.patch("ytm2lfm.daemon.YTMusicClient", ytmusic_cls),
+            *meter.patches(SQLite),
+        ):
+            stack.enter_context(patch)
+
+        def publish_histories():
+            for auth_file, trace in zip(auth_files, traces):
+                server.histories[auth_file] = list(trace.history)
+
+        publish_histories()
+        cli.run_scrobble(sync=True)
+
+        if args.mode == "daemon":
+            settings = get_settings()
+            db = cli.create_database()
+            stack.callback(db.close)
+            daemon = Daemon(
+                db, settings.get_accounts(), settings.scrobbler, max_in_flight=settings.daemon.max_in_flight
+            )
+            stack.callback(daemon.close)
+            asyncio.run(daemon.run_once())
+
+            def run():
+                asyncio.run(daemon.run_once())
+                meter.collect()
+
+        else:
+
+            def run():
+                try:
+                    cli.run_scrobble()
+                except RuntimeError as e:
+                    # failed accounts are retried by the next run, as in production
+                    logging.getLogger(__name__).debug(str(e))
+
+        timings = []
+        requests_before = server.total_requests()
+        lastfm_before = sum(count for path, count in server.requests.items() if path.startswith("/lastfm/"))
+        scrobbles_before = sum(server.scrobbles.values())
+        for _ in range(args.runs):
+            for trace in traces:
+                trace.advance()
+            publish_histories()
+            meter.reset()
+            t0 = time.perf_counter()
+            run()
+            timings.append(time.perf_counter() - t0)
+
+        lastfm_requests = sum(count for path, count in server.requests.items() if path.startswith("/lastfm/"))
+        return {
+            "p50_ms": percentile(timings, 50) * 1e3,
+            "p99_ms": percentile(timings, 99) * 1e3,
+            "requests_per_run": (server.total_requests() - requests_before) / args.runs,
+            "lastfm_requests_per_run": (lastfm_requests - lastfm_before) / args.runs,
+            "scrobbles_per_run": (sum(server.scrobbles.values()) - scrobbles_before) / args.runs,
+            "db_bytes_per_run": meter.written / args.runs,
+        }
+
+
+def check(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]], args) -> List[str]:
+    """Regressions of the results against a baseline, as messages."""
+    regressions = []
+    for scenario, expected in baseline.items():
+        if scenario not in results:
+            continue
+        metrics = list(CHECKED_METRICS)
+        tolerances = {metric: args.tolerance for metric in metrics}
+        if args.latency_tolerance is not None:
+            metrics.append("p50_ms")
+            tolerances["p50_ms"] = args.latency_tolerance
+        for metric in metrics:
+            limit = expected[metric] * (1 + tolerances[metric])
+            if results[scenario][metric] > limit:
+                regressions.append(
+                    f"{scenario}: {metric} {results[scenario][metric]:.1f} exceeds {limit:.1f} "
+                    f"(baseline {expected[metric]:.1f})"
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--accounts", default="1,10,100", help="Comma-separated numbers of accounts, up to 1000")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--mode", choices=("cli", "daemon"), default="cli")
+    parser.add_argument("--latency-ms", type=float, default=2, help="Latency of every stand-in endpoint")
+    parser.add_argument("--error-rate", type=float, default=0, help="Probability of a transient error per request")
+    parser.add_argument("--lastfm-rate-limit", type=float, default=None, help="Last.fm requests/s before error 29")
+    parser.add_argument("--client-rate-limit", type=float, default=1000, help="SCROBBLER__RATE_LIMIT of the runs")
+    parser.add_argument("--catalogue", type=int, default=20_000, help="Number of distinct tracks")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Write the results to this file")
+    parser.add_argument("--check", help="Baseline results to compare with, exits with 1 on a regression")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed increase of requests and bytes")
+    parser.add_argument("--latency-tolerance", type=float, default=None, help="Allowed increase of the p50 latency")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+
+    results = {}
+    print(
+        f"{'scenario':>12} {'p50 (ms)':>9} {'p99 (ms)':>9} {'req/run':>8} {'lfm/run':>8}"
+        f" {'scrob/run':>9} {'DB KiB/run':>10}"
+    )
+    for n_accounts in (int(n) for n in args.accounts.split(",")):
+        scenario = f"{args.mode}/{n_accounts}"
+        result = results[scenario] = run_scenario(args, n_accounts)
+        print(
+            f"{scenario:>12} {result['p50_ms']:>9.1f} {result['p99_ms']:>9.1f} {result['requests_per_run']:>8.1f}"
+            f" {result['lastfm_requests_per_run']:>8.1f} {result['scrobbles_per_run']:>9.1f}"
+            f" {result['db_bytes_per_run'] / 1024:>10.1f}"
+        )
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.check:
+        with open(args.check) as f:
+            regressions = check(results, json.load(f), args)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regression against {args.check}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Scaling benchmark for ytm2lfm.utils.find_overlap_start_index.
+
+Compares the single-pass overlap engine against the previous OrderedDict based implementation
+for history/database sizes from 10^2 to 10^6, with string video IDs and integer-interned IDs.
+
+Usage:
+    PYTHONPATH=src python benchmarks/bench_overlap.py [--max-exponent 6] [--min-overlap 50]
+"""
+
+import argparse
+import random
+import string
+import timeit
+from collections import OrderedDict
+
+from ytm2lfm.utils import find_overlap_start_index
+
+
+def legacy_find_overlap_start_index(history_list, scrobbled_list, min_overlap_length):
+    """Previous implementation, kept here as the baseline."""
+    if not scrobbled_list or not history_list or min_overlap_length <= 0:
+        return None
+
+    count = 0
+    start_idx = None
+    scrobbled_od = OrderedDict.fromkeys(scrobbled_list)
+    for idx in range(len(history_list)):
+        if history_list[idx] == next(iter(scrobbled_od)):
+            if start_idx is None:
+                start_idx = idx
+            count += 1
+        else:
+            count, start_idx = 0, None
+        if count >= min_overlap_length:
+            return start_idx
+        scrobbled_od.pop(history_list[idx], None)
+    return None
+
+
+def make_video_ids(n, rng):
+    alphabet = string.ascii_letters + string.digits + "-_"
+    return ["".join(rng.choices(alphabet, k=11)) for _ in range(n)]
+
+
+def make_scenario(size, min_overlap, rng):
+    """
+    History made of `new` unseen tracks, a few replays moved to the top, then the scrobbled list.
+    Half of the history is new, so the overlap is only found in the middle of the list.
+    """
+    ids = make_video_ids(size + size // 2, rng)
+    scrobbled = ids[:size]
+    new = ids[size:]
+    replays = rng.sample(scrobbled[: max(min_overlap, 1) * 2], k=min(10, size // 10))
+    replayed = set(replays)
+    history = new + replays + [i for i in scrobbled if i not in replayed][: size - len(new)]
+    return history, scrobbled
+
+
+def intern_ids(history, scrobbled):
+    mapping = {}
+    as_int = lambda seq: [mapping.setdefault(i, len(mapping)) for i in seq]  # noqa: E731
+    return as_int(history), as_int(scrobbled)
+
+
+def bench(func, history, scrobbled, min_overlap):
+    timer = timeit.Timer(lambda: func(history, scrobbled, min_overlap))
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=3, number=number)) / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--max-exponent", type=int, default=6)
+    parser.add_argument("--min-overlap", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"{'size':>9} {'ids':>4} {'legacy (ms)':>12} {'engine (ms)':>12} {'speedup':>8}")
+    for exponent in range(2, args.max_exponent + 1):
+        size = 10**exponent
+        history, scrobbled = make_scenario(size, args.min_overlap, rng)
+        for label, (h, s) in (("str", (history, scrobbled)), ("int", intern_ids(history, scrobbled))):
+            expected = legacy_find_overlap_start_index(h, s, args.min_overlap)
+            assert find_overlap_start_index(h, s, args.min_overlap) == expected
+
+            legacy = bench(legacy_find_overlap_start_index, h, s, args.min_overlap)
+            engine = bench(find_overlap_start_index, h, s, args.min_overlap)
+            print(f"{size:>9} {label:>4} {legacy * 1e3:>12.3f} {engine * 1e3:>12.3f} {legacy / engine:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
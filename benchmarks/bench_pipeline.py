@@ -0,0 +1,133 @@
+"""
+Wall-clock benchmark of a scrobble run over several accounts: sequential stages, account by account, against
+cli.run_scrobble, both on a changed history, where each account's database read and Last.fm authentication
+overlap with each other and with the history fetches of the other accounts, and on an unchanged history,
+where the database and Last.fm are skipped entirely.
+
+All variants run against local stand-in YouTube Music and Last.fm servers (see standins.py) with
+configurable latencies, on the common "nothing new" run: the database is synced with the histories first.
+
+Usage:
+    PYTHONPATH=src python benchmarks/bench_pipeline.py [--runs 10] [--accounts 4] [--lastfm-auth-ms 300]
+"""
+
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from standins import StandinServer, make_history, make_standin_clients  # noqa: E402
+
+
+def run_sequential(cli, db, account):
+    """The stages one after another, as cli.run_scrobble used to run them before pipelining and lazy auth."""
+    from ytm2lfm import ytmusic as ytmusic_module
+    from ytm2lfm.scrobbler import Scrobbler
+
+    lastfm = cli.create_lastfm_client(account)
+    lastfm.authenticate()  # LastFMClient used to authenticate when created
+    ytmusic = ytmusic_module.YTMusicClient(
+        auth_file=account.ytmusic.auth_file,
+        client_id=account.ytmusic.client_id,
+        client_secret=account.ytmusic.client_secret,
+    )
+    scrobbler = Scrobbler(lastfm, ytmusic, db, account_id=db.get_or_create_account(account.name))
+    tracks = scrobbler.get_tracks_to_scrobble()
+    with db.transaction():
+        scrobbler.enqueue_tracks(tracks)
+        scrobbler.cleanup_database()
+    scrobbler.deliver_pending()
+    return tracks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--accounts", type=int, default=4)
+    parser.add_argument("--lastfm-auth-ms", type=float, default=300)
+    parser.add_argument("--ytmusic-auth-ms", type=float, default=150)
+    parser.add_argument("--history-ms", type=float, default=400)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        accounts = []
+        for i in range(args.accounts):
+            auth_file = os.path.join(tmpdir, f"oauth{i}.json")
+            open(auth_file, "w").close()
+            accounts.append(
+                {
+                    "name": f"user{i}",
+                    "lastfm": {
+                        "api_key": "key",
+                        "shared_secret": "secret",
+                        "registered_to": f"user{i}",
+                        "password": "password",
+                    },
+                    "ytmusic": {"auth_file": auth_file, "client_id": "id", "client_secret": "secret"},
+                }
+            )
+        os.environ.update(
+            {
+                "SQLITE__DB_PATH": os.path.join(tmpdir, "scrobbles.db"),
+                "ACCOUNTS": json.dumps(accounts),
+            }
+        )
+        import cli
+        from ytm2lfm.config import get_settings
+        from ytm2lfm.database import SQLite
+
+        logging.getLogger("ytm2lfm").setLevel(logging.WARNING)
+
+        latencies = {
+            "/lastfm/auth": args.lastfm_auth_ms / 1e3,
+            "/ytmusic/auth": args.ytmusic_auth_ms / 1e3,
+            "/ytmusic/history": args.history_ms / 1e3,
+        }
+        with StandinServer(latencies) as server:
+            histories = [make_history(200, offset=i * 1000) for i in range(args.accounts)]
+            for account, history in zip(accounts, histories):
+                server.histories[os.path.basename(account["ytmusic"]["auth_file"])] = history
+            lastfm_cls, ytmusic_cls = make_standin_clients(server.url)
+            db = SQLite(os.environ["SQLITE__DB_PATH"])
+
+            def change_histories():
+                # a new play period for every track: the fingerprints change, but there is nothing new to scrobble
+                for history in histories:
+                    played = "Yesterday" if history[0]["played"] == "Today" else "Today"
+                    for track in history:
+                        track["played"] = played
+                return cli.run_scrobble()
+
+            with (
+                mock.patch("ytm2lfm.lastfm.LastFMClient", lastfm_cls),
+                mock.patch("ytm2lfm.ytmusic.YTMusicClient", ytmusic_cls),
+            ):
+                cli.run_scrobble(sync=True)
+
+                results = {}
+                for label, run in (
+                    ("sequential", lambda: [run_sequential(cli, db, a) for a in get_settings().get_accounts()]),
+                    ("pipelined", change_histories),
+                    ("fast path", lambda: cli.run_scrobble()),
+                ):
+                    timings = []
+                    for _ in range(args.runs):
+                        t0 = time.perf_counter()
+                        assert not any(run())
+                        timings.append(time.perf_counter() - t0)
+                    results[label] = statistics.median(timings)
+
+        print(f"{'mode':>10} {'p50 (ms)':>10} {'speedup':>8}")
+        for label, median in results.items():
+            print(f"{label:>10} {median * 1e3:>10.1f} {results['sequential'] / median:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""
+Memory and throughput benchmark of the track records moving through a scrobble run: plain dicts versus Track.
+
+Both variants parse a synthetic raw YouTube Music history, stamp every track with a timestamp and bind the
+tracks to an INSERT into an in-memory SQLite table:
+
+- dict: the previous pipeline, one dict per parsed track, copied by `track | {"timestamp": ...}`,
+  inserted with named parameters
+- track: Track named tuples with interned video IDs, stamped with `Track.stamped`, inserted positionally
+
+Memory is the peak traced by tracemalloc while the stamped tracks are alive, on top of the raw history.
+Tuples are tracked by the cyclic garbage collector while dicts of strings are not, so with 10^5 tracks the
+collections triggered by the tuple allocations rescan the whole heap; --disable-gc measures without them.
+
+Usage:
+    PYTHONPATH=src python benchmarks/bench_track.py [--tracks 100000] [--runs 5] [--disable-gc]
+"""
+
+import argparse
+import gc
+import sqlite3
+import statistics
+import time
+import tracemalloc
+
+from ytm2lfm.track import Track
+
+CREATE_TABLE = """
+CREATE TABLE scrobbles (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    video_id TEXT NOT NULL,
+    title TEXT NOT NULL,
+    artist TEXT NOT NULL,
+    album TEXT,
+    played INTEGER NOT NULL,
+    timestamp INTEGER
+)
+"""
+
+
+def make_raw_history(n):
+    """Synthetic raw history, latest first, where each video shows up about 4 times."""
+    return [
+        {
+            "videoId": f"vid{i % (n // 4 or 1):08d}",
+            "title": f"title {i}",
+            "artists": [{"name": f"artist {i % 97}"}, {"name": "1.2M views"}],
+            "album": {"name": f"album {i % 31}"},
+            "played": "Today",
+            "duration": "3:25",
+        }
+        for i in range(n, 0, -1)
+    ]
+
+
+def parse_dicts(history):
+    processed = []
+    for track in history:
+        for k in list(track.keys()):
+            if track[k] is None:
+                track.pop(k)
+        if "title" not in track or "artists" not in track:
+            continue
+        processed.append(
+            {
+                "video_id": track["videoId"],
+                "title": track["title"],
+                "artist": ", ".join(
+                    [artist["name"] for artist in track["artists"] if not artist["name"].endswith(" views")]
+                ),
+                "album": track.get("album", {}).get("name", ""),
+                "played": track["played"],
+            }
+        )
+    return processed
+
+
+def stamp_dicts(tracks, timestamp):
+    stamped = [track | {"timestamp": timestamp} for track in tracks]
+    stamped.reverse()
+    return stamped
+
+
+def insert_dicts(conn, tracks):
+    conn.executemany(
+        "INSERT INTO scrobbles (video_id, title, artist, album, played, timestamp) "
+        "VALUES (:video_id, :title, :artist, :album, :played, :timestamp)",
+        tracks,
+    )
+
+
+def parse_tracks(history):
+    return [track for track in map(Track.from_history, history) if track is not None]
+
+
+def stamp_tracks(tracks, timestamp):
+    stamped = [track.stamped(timestamp) for track in tracks]
+    stamped.reverse()
+    return stamped
+
+
+def insert_tracks(conn, tracks):
+    conn.executemany(
+        "INSERT INTO scrobbles (video_id, title, artist, album, played, timestamp) VALUES (?, ?, ?, ?, ?, ?)",
+        tracks,
+    )
+
+
+VARIANTS = {
+    "dict": (parse_dicts, stamp_dicts, insert_dicts),
+    "track": (parse_tracks, stamp_tracks, insert_tracks),
+}
+
+
+def measure_memory(n, parse, stamp):
+    history = make_raw_history(n)
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    tracks = parse(history)
+    stamped = stamp(tracks, 0)
+    current = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del tracks, stamped
+    return current - base
+
+
+def measure_time(n, runs, parse, stamp, insert):
+    timings = {"parse": [], "stamp": [], "insert": []}
+    for _ in range(runs):
+        history = make_raw_history(n)
+        conn = sqlite3.connect(":memory:")
+        conn.execute(CREATE_TABLE)
+
+        t0 = time.perf_counter()
+        tracks = parse(history)
+        t1 = time.perf_counter()
+        stamped = stamp(tracks, int(time.time()))
+        t2 = time.perf_counter()
+        insert(conn, stamped)
+        t3 = time.perf_counter()
+        conn.close()
+
+        timings["parse"].append(t1 - t0)
+        timings["stamp"].append(t2 - t1)
+        timings["insert"].append(t3 - t2)
+    return {stage: statistics.median(values) for stage, values in timings.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tracks", type=int, default=100_000)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--disable-gc", action="store_true", help="Disable the cyclic garbage collector")
+    args = parser.parse_args()
+    if args.disable_gc:
+        gc.disable()
+
+    print(f"{args.tracks} tracks, median of {args.runs} runs")
+    print(
+        f"{'variant':>8} {'memory (MiB)':>13} {'parse (ms)':>11} {'stamp (ms)':>11}"
+        f" {'insert (ms)':>12} {'tracks/s':>10}"
+    )
+    for label, (parse, stamp, insert) in VARIANTS.items():
+        memory = measure_memory(args.tracks, parse, stamp)
+        timings = measure_time(args.tracks, args.runs, parse, stamp, insert)
+        total = sum(timings.values())
+        print(
+            f"{label:>8} {memory / 2**20:>13.1f} {timings['parse'] * 1e3:>11.1f} {timings['stamp'] * 1e3:>11.1f} "
+            f"{timings['insert'] * 1e3:>12.1f} {args.tracks / total:>10.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
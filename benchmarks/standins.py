@@ -0,0 +1,206 @@
+"""
+Local stand-in servers for the YouTube Music and Last.fm APIs, and clients talking to them.
+
+The clients mirror the parts of YTMusicClient and LastFMClient used by the scrobbler, so they can replace
+them in benchmarks without network access or credentials. Every endpoint sleeps for a configurable latency,
+can fail with a configurable probability, and the Last.fm endpoints can be rate limited like the real API
+(error 29). Histories are served per account, keyed by the name of the account's auth file.
+"""
+
+import json
+import os
+import random
+import threading
+import time
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+import pylast
+
+# Last.fm error codes returned by the stand-in
+LASTFM_OFFLINE = 11
+LASTFM_RATE_LIMIT_EXCEEDED = 29
+
+
+class StandinServer:
+    """Threaded HTTP server answering the stand-in endpoints with a fixed latency per endpoint."""
+
+    def __init__(
+        self,
+        latencies: Optional[Dict[str, float]] = None,
+        history: Optional[List[Dict[str, Any]]] = None,
+        error_rates: Optional[Dict[str, float]] = None,
+        lastfm_rate_limit: Optional[float] = None,
+        seed: int = 0,
+    ):
+        """
+        Args:
+            latencies: Seconds slept by each endpoint path
+            history: History served to the accounts missing from histories
+            error_rates: Probability of each endpoint path to fail with a transient error
+            lastfm_rate_limit: Last.fm requests per second accepted over all clients, rejected with error 29 above
+            seed: Seed of the injected errors
+        """
+        self.latencies = latencies or {}
+        self.history = history or []
+        self.histories: Dict[str, List[Dict[str, Any]]] = {}
+        self.error_rates = error_rates or {}
+        self.lastfm_rate_limit = lastfm_rate_limit
+        self.requests: Dict[str, int] = {}
+        self.scrobbles: Dict[str, int] = {}
+        self._random = random.Random(seed)
+        self._tokens = lastfm_rate_limit or 0.0
+        self._refilled = time.monotonic()
+        self._lock = threading.Lock()
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self._handle()
+
+            def do_POST(self):
+                self._handle()
+
+            def _handle(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                payload = json.loads(self.rfile.read(length)) if length else None
+                url = urllib.parse.urlsplit(self.path)
+                body = json.dumps(server.respond(url.path, dict(urllib.parse.parse_qsl(url.query)), payload)).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def respond(self, path: str, query: Optional[Dict[str, str]] = None, payload: Any = None) -> Any:
+        query = query or {}
+        with self._lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+            failed = self._random.random() < self.error_rates.get(path, 0.0)
+            limited = path.startswith("/lastfm/") and not self._take_token()
+        time.sleep(self.latencies.get(path, 0.0))
+
+        if limited:
+            return {"error": LASTFM_RATE_LIMIT_EXCEEDED, "message": "Rate limit exceeded"}
+        if failed:
+            return {"error": LASTFM_OFFLINE, "message": "Service offline"}
+        if path == "/ytmusic/history":
+            return self.histories.get(query.get("auth", ""), self.history)
+        if path == "/ytmusic/song":
+            return {"lengthSeconds": 205}
+        if path == "/lastfm/auth":
+            return {"session": "standin-session-key"}
+        if path == "/lastfm/scrobble" and payload is not None:
+            with self._lock:
+                self.scrobbles[payload["user"]] = self.scrobbles.get(payload["user"], 0) + len(payload["tracks"])
+        return {"status": "ok"}
+
+    def total_requests(self) -> int:
+        with self._lock:
+            return sum(self.requests.values())
+
+    def _take_token(self) -> bool:
+        if self.lastfm_rate_limit is None:
+            return True
+        now = time.monotonic()
+        self._tokens = min(self.lastfm_rate_limit, self._tokens + (now - self._refilled) * self.lastfm_rate_limit)
+        self._refilled = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def _request(url: str, method: str = "GET", payload: Any = None) -> Any:
+    data = json.dumps(payload).encode() if payload is not None else None
+    with urllib.request.urlopen(urllib.request.Request(url, data=data, method=method)) as response:
+        return json.loads(response.read())
+
+
+def _lastfm_request(url: str, payload: Any) -> Any:
+    """Stand-in Last.fm request, errors are raised as the pylast.WSError the real client raises."""
+    response = _request(url, "POST", payload)
+    if isinstance(response, dict) and "error" in response:
+        raise pylast.WSError(None, str(response["error"]), response["message"])
+    return response
+
+
+def make_standin_clients(server_url: str):
+    """Build stand-in client classes with the same constructor signatures as the real clients."""
+
+    class StandinLastFMClient:
+        def __init__(self, api_key: str, api_secret: str, username: str, password: str, **kwargs):
+            self.username = username
+            self.session_key = None
+
+        def authenticate(self):
+            response = _lastfm_request(f"{server_url}/lastfm/auth", {"username": self.username})
+            self.session_key = response["session"]
+
+        def scrobble_many(self, tracks):
+            if self.session_key is None:
+                self.authenticate()
+            _lastfm_request(
+                f"{server_url}/lastfm/scrobble", {"user": self.username, "tracks": [dict(track) for track in tracks]}
+            )
+
+        def get_correction(self, artist: str, title: str):
+            _lastfm_request(f"{server_url}/lastfm/correction", {"artist": artist, "title": title})
+            return artist, title
+
+    class StandinYTMusicClient:
+        def __init__(self, auth_file: str, client_id: str, client_secret: str, **kwargs):
+            self.account = os.path.basename(auth_file)
+            self.authenticated = False
+
+        def _authenticate(self):
+            # the OAuth access token is refreshed with the first request, as with the real client
+            if not self.authenticated:
+                _request(f"{server_url}/ytmusic/auth", "POST", {})
+                self.authenticated = True
+
+        def get_history(self) -> List[Dict[str, Any]]:
+            self._authenticate()
+            history = _request(f"{server_url}/ytmusic/history?auth={urllib.parse.quote(self.account)}")
+            if isinstance(history, dict) and "error" in history:
+                raise RuntimeError(f"YouTube Music stand-in error: {history['message']}")
+            return history
+
+        def get_durations(self, video_ids: List[str]) -> Dict[str, int]:
+            self._authenticate()
+            return {video_id: _request(f"{server_url}/ytmusic/song")["lengthSeconds"] for video_id in video_ids}
+
+    return StandinLastFMClient, StandinYTMusicClient
+
+
+def make_history(n: int, offset: int = 0) -> List[Dict[str, Any]]:
+    """Synthetic YouTube Music history, latest first."""
+    return [
+        {
+            "videoId": f"vid{i:08d}",
+            "title": f"title {i}",
+            "artists": [{"name": f"artist {i % 97}"}],
+            "album": {"name": f"album {i % 31}"},
+            "played": "Today",
+            "duration": "3:25",
+        }
+        for i in range(offset + n, offset, -1)
+    ]
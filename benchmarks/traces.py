@@ -0,0 +1,83 @@
+"""
+Synthetic listening traces: how the YouTube Music history of an account evolves between two runs.
+
+A trace plays tracks from a catalogue shared by all accounts, with a Zipf-like popularity so that accounts
+overlap on the popular tracks. Between two runs a listener is either idle or plays a burst of tracks, some
+of them replays of tracks already in the history. As on YouTube Music, a replayed track moves to the top
+of the history instead of showing up twice, and the history only keeps the latest 200 tracks.
+"""
+
+import itertools
+import random
+from typing import Any, Dict, List
+
+HISTORY_SIZE = 200
+
+
+def make_catalogue(size: int) -> List[Dict[str, Any]]:
+    """Tracks as they show up in a raw YouTube Music history, without the play date."""
+    catalogue = []
+    for i in range(size):
+        artist = f"artist {i % 997}"
+        catalogue.append(
+            {
+                "videoId": f"v{i:010d}",
+                # a few titles and artists carry the decorations canonicalisation strips
+                "title": f"title {i}" + (" (Official Video)" if i % 7 == 0 else ""),
+                "artists": [{"name": artist + (" - Topic" if i % 5 == 0 else "")}, {"name": f"{i * 31 % 9000}K views"}],
+                "album": {"name": f"album {i % 331}"},
+                "duration": f"{2 + i % 4}:{i % 60:02d}",
+            }
+        )
+    return catalogue
+
+
+class ListeningTrace:
+    """The evolving history of one account."""
+
+    def __init__(
+        self,
+        catalogue: List[Dict[str, Any]],
+        seed: int,
+        idle_probability: float = 0.5,
+        max_burst: int = 20,
+        replay_probability: float = 0.15,
+    ):
+        """
+        Args:
+            catalogue: Tracks to play, the first ones are the most popular
+            seed: Seed of the listener, traces with the same seed are identical
+            idle_probability: Probability of playing nothing between two runs
+            max_burst: Maximum number of tracks played between two runs
+            replay_probability: Probability of a play to replay a track of the history
+        """
+        self.catalogue = catalogue
+        self.idle_probability = idle_probability
+        self.max_burst = max_burst
+        self.replay_probability = replay_probability
+        self._random = random.Random(seed)
+        self._cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(catalogue))))
+        self.history: List[Dict[str, Any]] = []
+        self.plays = 0
+
+        # a full history to start with, as for a user who listened before installing the scrobbler
+        while len(self.history) < HISTORY_SIZE:
+            self.play()
+
+    def play(self) -> None:
+        """Play one track, a replay of the history or a track picked by popularity."""
+        if self.history and self._random.random() < self.replay_probability:
+            track = self.history.pop(self._random.randrange(len(self.history)))
+        else:
+            track = self._random.choices(self.catalogue, cum_weights=self._cum_weights)[0]
+            self.history = [item for item in self.history if item["videoId"] != track["videoId"]]
+        self.history.insert(0, {**track, "played": "Today"})
+        del self.history[HISTORY_SIZE:]
+        self.plays += 1
+
+    def advance(self) -> List[Dict[str, Any]]:
+        """Listen until the next run, returns the history as of that run."""
+        if self._random.random() >= self.idle_probability:
+            for _ in range(self._random.randint(1, self.max_burst)):
+                self.play()
+        return self.history
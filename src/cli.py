@@ -3,54 +3,705 @@ import logging
 import os
 import sys
 import textwrap
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
 
-from ytm2lfm.config import settings
-from ytm2lfm.database import SQLite
-from ytm2lfm.lastfm import LastFMClient
-from ytm2lfm.logger import setup_logging
-from ytm2lfm.scrobbler import Scrobbler
-from ytm2lfm.ytmusic import YTMusicClient
+# Heavy modules (pydantic, pylast, ytmusicapi, sqlite3, asyncio) are imported where they are used,
+# so that startup and --help stay fast. tests/test_startup.py keeps an eye on it.
+if TYPE_CHECKING:
+    from ytm2lfm.canonical import Canonicalizer
+    from ytm2lfm.config import AccountSettings
+    from ytm2lfm.database import SQLite
+    from ytm2lfm.lastfm import LastFMClient, SessionKeyCache
+    from ytm2lfm.metadata import TrackMetadataCache
+    from ytm2lfm.plan import AccountPlan
+    from ytm2lfm.ratelimit import TokenBucket
+    from ytm2lfm.scrobbler import Scrobbler
+    from ytm2lfm.snapshots import HistorySnapshots
+    from ytm2lfm.track import Track
+    from ytm2lfm.ytmusic import YTMusicClient
 
-setup_logging()
 logger = logging.getLogger(__name__)
 
+# Consecutive plays matching the Last.fm scrobbles needed to tell where the already scrobbled plays start
+SEED_MIN_OVERLAP = 5
+# No account has this ID, the ones created in the database start at 1
+UNCREATED_ACCOUNT_ID = 0
 
-def run_scrobble(sync=False, dry_run=False):
-    # Initialize components
-    db = SQLite(settings.sqlite.db_path)
 
-    lastfm = LastFMClient(
-        api_key=settings.lastfm.api_key,
-        api_secret=settings.lastfm.shared_secret,
-        username=settings.lastfm.registered_to,
-        password=settings.lastfm.password,
+def create_database() -> "SQLite":
+    from ytm2lfm.config import get_settings
+    from ytm2lfm.database import SQLite
+
+    settings = get_settings()
+    return SQLite(
+        settings.sqlite.db_path,
+        persistent=settings.sqlite.persistent_connection,
+        journal_mode=settings.sqlite.journal_mode,
+        synchronous=settings.sqlite.synchronous,
+        cache_size=settings.sqlite.cache_size,
+        mmap_size=settings.sqlite.mmap_size,
+        archive_path=settings.sqlite.archive_path,
+        window_size=settings.scrobbler.max_synced_tracks,
     )
 
-    ytmusic = YTMusicClient(
-        auth_file=settings.ytmusic.auth_file,
-        client_id=settings.ytmusic.client_id,
-        client_secret=settings.ytmusic.client_secret,
+
+def create_session_cache() -> "SessionKeyCache":
+    from ytm2lfm.config import get_settings
+    from ytm2lfm.lastfm import SessionKeyCache
+
+    settings = get_settings()
+    path = settings.lastfm_session_cache
+    if path is None:
+        path = os.path.join(os.path.dirname(os.path.abspath(settings.sqlite.db_path)), "lastfm_sessions.json")
+    return SessionKeyCache(path)
+
+
+def create_metadata_cache(db: "SQLite") -> "TrackMetadataCache":
+    from ytm2lfm.config import get_settings
+    from ytm2lfm.metadata import TrackMetadataCache
+
+    settings = get_settings()
+    return TrackMetadataCache(
+        db, capacity=settings.metadata_cache.capacity, ttl=settings.metadata_cache.ttl_days * 24 * 3600
+    )
+
+
+def create_canonicalizer(
+    db: "SQLite", rate_limiter: "TokenBucket", account: Optional["AccountSettings"] = None
+) -> "Canonicalizer":
+    """Canonicalizer shared by all accounts, looking up Last.fm corrections with the API key of an account."""
+    from ytm2lfm.canonical import DEFAULT_RULES, NO_RULES, Canonicalizer, paced_corrector
+    from ytm2lfm.config import get_settings
+
+    settings = get_settings()
+    corrector = None
+    if settings.canonical.enabled and settings.canonical.lastfm_corrections and account is not None:
+        corrector = paced_corrector(create_lastfm_client(account), rate_limiter, settings.scrobbler.max_retries)
+    return Canonicalizer(
+        db,
+        rules=DEFAULT_RULES if settings.canonical.enabled else NO_RULES,
+        corrector=corrector,
+        capacity=settings.canonical.capacity,
+    )
+
+
+def create_snapshots() -> "HistorySnapshots":
+    from ytm2lfm.config import get_settings
+    from ytm2lfm.snapshots import HistorySnapshots
+
+    settings = get_settings()
+    directory = settings.snapshots.directory
+    if directory is None:
+        directory = os.path.join(os.path.dirname(os.path.abspath(settings.sqlite.db_path)), "snapshots")
+    return HistorySnapshots(directory, keep=settings.snapshots.keep)
+
+
+def create_scrobbler(
+    db: "SQLite",
+    account: "AccountSettings",
+    lastfm_client: Optional["LastFMClient"],
+    ytmusic_client: Optional["YTMusicClient"],
+    rate_limiter: Optional["TokenBucket"] = None,
+    metadata_cache: Optional["TrackMetadataCache"] = None,
+    canonicalizer: Optional["Canonicalizer"] = None,
+    account_id: Optional[int] = None,
+) -> "Scrobbler":
+    """Scrobbler of an account configured from the settings, created in the database unless account_id is given."""
+    from ytm2lfm.config import get_settings
+    from ytm2lfm.scrobbler import Scrobbler
+
+    settings = get_settings()
+    return Scrobbler.from_settings(
+        db,
+        settings.scrobbler,
+        db.get_or_create_account(account.name) if account_id is None else account_id,
+        lastfm_client,
+        ytmusic_client,
+        rate_limiter=rate_limiter,
+        metadata_cache=metadata_cache,
+        canonicalizer=canonicalizer,
+        dedupe_settings=settings.dedupe,
     )
 
-    # Create and run the scrobbler
-    scrobbler = Scrobbler(lastfm, ytmusic, db)
 
+def run_scrobble(sync=False, dry_run=False, replay=False):
+    from ytm2lfm.config import get_settings
+    from ytm2lfm.metrics import metrics
+
+    settings = get_settings()
+    metrics.enabled = settings.metrics.enabled
+    try:
+        with metrics.span("run"):
+            return _run_scrobble(sync=sync, dry_run=dry_run, replay=replay)
+    finally:
+        write_metrics()
+
+
+def _run_scrobble(sync=False, dry_run=False, replay=False):
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    from ytm2lfm.config import get_settings
+    from ytm2lfm.logger import log_context
+    from ytm2lfm.metrics import metrics
+    from ytm2lfm.ratelimit import TokenBucket
+
+    settings = get_settings()
+    accounts = settings.get_accounts()
+    snapshots = create_snapshots()
+    tracks_to_scrobble = []
+    failed_accounts = []
+    db = None
+
+    # The histories of all accounts are fetched concurrently, and each account is processed on this thread,
+    # which owns the database connection, as soon as its history arrives while the others are still fetched.
+    # Accounts whose history did not change since their last successful run have nothing to do, and if none
+    # changed the run ends without opening the database or authenticating to Last.fm
+    with ThreadPoolExecutor(max_workers=min(len(accounts), 8), thread_name_prefix="ytm2lfm") as pool:
+        history_futures = {
+            pool.submit(load_history, snapshots, account, replay, dry_run): account for account in accounts
+        }
+        try:
+            for history_future in as_completed(history_futures):
+                account = history_futures[history_future]
+                try:
+                    fingerprint, history = history_future.result()
+                except Exception as e:
+                    logger.error("Failed to get the history of account %s: %s", account.name, e, exc_info=True)
+                    metrics.inc("run_failures")
+                    failed_accounts.append(account.name)
+                    continue
+
+                if fingerprint == snapshots.last_processed(account.name):
+                    logger.info("History of account %s unchanged since the last run, nothing to do", account.name)
+                    continue
+
+                if db is None:
+                    # All accounts share a single database connection, the Last.fm rate limit of the API key,
+                    # the session key cache and the track durations
+                    db = create_database()
+                    rate_limiter = TokenBucket(
+                        rate=settings.scrobbler.rate_limit, burst=settings.scrobbler.rate_limit_burst
+                    )
+                    session_cache = create_session_cache()
+                    metadata_cache = create_metadata_cache(db)
+                    canonicalizer = create_canonicalizer(db, rate_limiter, account)
+
+                try:
+                    with log_context(account=account.name), metrics.span("account_run"):
+                        tracks_to_scrobble += run_account_scrobble(
+                            db,
+                            account,
+                            history,
+                            rate_limiter=rate_limiter,
+                            session_cache=session_cache,
+                            metadata_cache=metadata_cache,
+                            canonicalizer=canonicalizer,
+                            sync=sync,
+                            dry_run=dry_run,
+                            replay=replay,
+                        )
+                except Exception as e:
+                    logger.error("Scrobbling process failed for account %s: %s", account.name, e, exc_info=True)
+                    metrics.inc("run_failures")
+                    failed_accounts.append(account.name)
+                    continue
+
+                if not dry_run:
+                    snapshots.mark_processed(account.name, fingerprint)
+        finally:
+            if db is not None:
+                db.close()
+
+    metrics.inc("runs")
+    if failed_accounts:
+        raise RuntimeError(f"Scrobbling process failed for accounts: {', '.join(failed_accounts)}")
+
+    return tracks_to_scrobble
+
+
+def load_history(
+    snapshots: "HistorySnapshots", account: "AccountSettings", replay=False, dry_run=False
+) -> Tuple[str, List[Dict[str, Any]]]:
+    """
+    Fetch the history of an account and store its snapshot, or replay the latest stored snapshot.
+
+    Returns:
+        Fingerprint and raw history
+    """
+    from ytm2lfm.logger import log_context
+
+    with log_context(account=account.name):
+        return _load_history(snapshots, account, replay, dry_run)
+
+
+def _load_history(
+    snapshots: "HistorySnapshots", account: "AccountSettings", replay=False, dry_run=False
+) -> Tuple[str, List[Dict[str, Any]]]:
+    if replay:
+        snapshot = snapshots.load_latest(account.name)
+        if snapshot is None:
+            raise RuntimeError(f"No history snapshot to replay for account {account.name}")
+        logger.info("Replaying the latest history snapshot of account %s", account.name)
+        return snapshot
+
+    from ytm2lfm.metrics import metrics
+    from ytm2lfm.utils import history_fingerprint
+
+    with metrics.span("get_history"):
+        history = fetch_ytmusic_history(account)
+    logger.info("Fetched %s recent tracks from YouTube Music for account %s", len(history), account.name)
+    fingerprint = history_fingerprint(history)
+    if not dry_run:
+        snapshots.save(account.name, fingerprint, history)
+    return fingerprint, history
+
+
+def run_import_takeout(
+    path: str, account_name: Optional[str] = None, restart=False, scrobble=True, dry_run=False
+) -> int:
+    """
+    Backfill an account from a Google Takeout watch history, then deliver the scrobbles of its recent plays.
+
+    Returns:
+        Number of plays imported
+    """
+    from ytm2lfm.config import get_settings
+    from ytm2lfm.dedupe import DuplicateFilter
+    from ytm2lfm.ratelimit import TokenBucket
+    from ytm2lfm.takeout import TakeoutImporter
+
+    settings = get_settings()
+    account = select_account(account_name)
+    db = create_database()
+    try:
+        rate_limiter = TokenBucket(rate=settings.scrobbler.rate_limit, burst=settings.scrobbler.rate_limit_burst)
+        account_id = db.get_or_create_account(account.name)
+        duplicate_filter = DuplicateFilter(
+            db,
+            account_id,
+            bucket=settings.dedupe.bucket,
+            capacity=settings.dedupe.capacity,
+            error_rate=settings.dedupe.error_rate,
+        )
+        importer = TakeoutImporter(
+            db,
+            create_canonicalizer(db, rate_limiter, account),
+            account_id=account_id,
+            duplicate_filter=duplicate_filter,
+        )
+        result = importer.import_file(path, restart=restart, scrobble=scrobble, dry_run=dry_run)
+        logger.info(
+            "Parsed %s YouTube Music plays, archived %s and planned %s scrobbles for account %s",
+            result.parsed,
+            result.archived,
+            result.enqueued,
+            account.name,
+        )
+
+        scrobbler = create_scrobbler(
+            db, account, create_lastfm_client(account, create_session_cache()), None, rate_limiter=rate_limiter
+        )
+        scrobbler.deliver_pending(batch_size=settings.scrobbler.batch_size, dry_run=dry_run)
+    finally:
+        db.close()
+
+    return result.archived
+
+
+def run_seed_from_lastfm(account_name: Optional[str] = None, days: Optional[float] = None, dry_run=False) -> int:
+    """
+    Sync the history of an account with what Last.fm already has: load the account's Last.fm scrobbles,
+    save the plays of the YouTube Music history already scrobbled and plan the scrobbles of the others.
+
+    Unlike sync, which saves the whole history as if it was scrobbled, the plays missing from Last.fm
+    are not lost, and unlike scrobble, the plays already on Last.fm are not scrobbled twice.
+
+    Returns:
+        Number of scrobbles delivered
+    """
+    import time
+
+    from ytm2lfm.config import get_settings
+    from ytm2lfm.ratelimit import TokenBucket
+    from ytm2lfm.seed import LastFMSeeder
+
+    settings = get_settings()
+    account = select_account(account_name)
+    snapshots = create_snapshots()
+    fingerprint, history = load_history(snapshots, account, dry_run=dry_run)
+
+    db = create_database()
+    try:
+        rate_limiter = TokenBucket(rate=settings.scrobbler.rate_limit, burst=settings.scrobbler.rate_limit_burst)
+        account_id = db.get_or_create_account(account.name)
+        lastfm = create_lastfm_client(account, create_session_cache())
+        seeder = LastFMSeeder(
+            lastfm,
+            db,
+            account_id=account_id,
+            rate_limiter=rate_limiter,
+            max_in_flight=settings.daemon.max_in_flight,
+            max_retries=settings.scrobbler.max_retries,
+        )
+        seeder.seed(since=None if days is None else int(time.time() - days * 24 * 3600))
+
+        canonicalizer = create_canonicalizer(db, rate_limiter, account)
+        scrobbler = create_scrobbler(
+            db,
+            account,
+            lastfm,
+            None,
+            rate_limiter=rate_limiter,
+            metadata_cache=create_metadata_cache(db),
+            canonicalizer=canonicalizer,
+        )
+        tracks = scrobbler.get_tracks_to_scrobble(history=history)
+        unscrobbled = seeder.count_unscrobbled(canonicalizer.canonicalize(tracks), SEED_MIN_OVERLAP)
+        logger.info("%s of %s new plays are not on Last.fm yet", unscrobbled, len(tracks))
+        looked_up = {} if dry_run else lookup_missing_durations(scrobbler, account, tracks)
+
+        with db.transaction():
+            scrobbler.enqueue_tracks(tracks, dry_run=dry_run, looked_up=looked_up, scrobble_latest=unscrobbled)
+            scrobbler.cleanup_database(dry_run=dry_run)
+        delivered = scrobbler.deliver_pending(batch_size=settings.scrobbler.batch_size, dry_run=dry_run)
+    finally:
+        db.close()
+
+    if not dry_run:
+        snapshots.mark_processed(account.name, fingerprint)
+    return delivered
+
+
+def run_plan(path: str, replay=False) -> List["AccountPlan"]:
+    """
+    Work out what a scrobble run would submit and save it in a plan file, to review it before run_apply
+    submits it without fetching the histories, durations and Last.fm corrections again.
+
+    Only the history snapshots are stored, nothing is written to the database: the caches are read but not
+    filled, and an account never run is planned against an empty synced window without being created.
+
+    Returns:
+        Plans of the accounts whose history changed since their last run
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    from ytm2lfm.config import get_settings
+    from ytm2lfm.logger import log_context
+    from ytm2lfm.plan import AccountPlan, write_plan
+    from ytm2lfm.ratelimit import TokenBucket
+
+    settings = get_settings()
+    accounts = settings.get_accounts()
+    snapshots = create_snapshots()
+    with ThreadPoolExecutor(max_workers=min(len(accounts), 8), thread_name_prefix="ytm2lfm") as pool:
+        history_futures = [pool.submit(load_history, snapshots, account, replay) for account in accounts]
+    histories = [future.result() for future in history_futures]
+
+    plans = []
+    db = create_database()
+    try:
+        rate_limiter = TokenBucket(rate=settings.scrobbler.rate_limit, burst=settings.scrobbler.rate_limit_burst)
+        metadata_cache = create_metadata_cache(db)
+        canonicalizer = create_canonicalizer(db, rate_limiter, accounts[0])
+        for account, (fingerprint, history) in zip(accounts, histories):
+            last_processed = snapshots.last_processed(account.name)
+            if fingerprint == last_processed:
+                logger.info("History of account %s unchanged since the last run, nothing to plan", account.name)
+                continue
+
+            account_id = db.get_account_id(account.name)
+            with log_context(account=account.name):
+                scrobbler = create_scrobbler(
+                    db,
+                    account,
+                    None,
+                    None,
+                    rate_limiter=rate_limiter,
+                    metadata_cache=metadata_cache,
+                    canonicalizer=canonicalizer,
+                    account_id=UNCREATED_ACCOUNT_ID if account_id is None else account_id,
+                )
+                tracks = scrobbler.get_tracks_to_scrobble(history=history)
+                durations = scrobbler.history_durations(tracks)
+                durations.update(lookup_missing_durations(scrobbler, account, tracks))
+                plans.append(
+                    AccountPlan(
+                        account=account.name,
+                        fingerprint=fingerprint,
+                        last_processed=last_processed,
+                        high_water_mark=db.get_high_water_mark(scrobbler.account_id),
+                        tracks=tracks,
+                        durations=durations,
+                        names=canonicalizer.resolve(canonicalizer.pending(tracks)),
+                    )
+                )
+                for track in reversed(tracks):
+                    logger.info("Planned scrobble of %s - %s", track.artist, track.title)
+    finally:
+        db.close()
+
+    write_plan(path, plans)
+    return plans
+
+
+def run_apply(path: str) -> int:
+    """
+    Submit the scrobbles of a plan file written by run_plan.
+
+    An account processed since it was planned is skipped, its new tracks may have been scrobbled already.
+    An account whose plan was already applied is skipped too, only its pending scrobbles are delivered, so
+    applying a plan again after a failure resumes it. The histories are not fetched again.
+
+    Returns:
+        Number of scrobbles delivered
+    """
+    from ytm2lfm.config import get_settings
+    from ytm2lfm.logger import log_context
+    from ytm2lfm.plan import read_plan
+    from ytm2lfm.ratelimit import TokenBucket
+
+    settings = get_settings()
+    snapshots = create_snapshots()
+    plans = read_plan(path)
+    if not plans:
+        logger.info("Nothing to apply in %s", path)
+        return 0
+
+    delivered = 0
+    stale_accounts = []
+    db = create_database()
+    try:
+        accounts = [select_account(plan.account) for plan in plans]
+        rate_limiter = TokenBucket(rate=settings.scrobbler.rate_limit, burst=settings.scrobbler.rate_limit_burst)
+        session_cache = create_session_cache()
+        metadata_cache = create_metadata_cache(db)
+        canonicalizer = create_canonicalizer(db, rate_limiter, accounts[0])
+        for plan, account in zip(plans, accounts):
+            with log_context(account=account.name):
+                last_processed = snapshots.last_processed(account.name)
+                applied = last_processed == plan.fingerprint
+                account_id = db.get_or_create_account(account.name)
+                if not applied and (last_processed, db.get_high_water_mark(account_id)) != (
+                    plan.last_processed,
+                    plan.high_water_mark,
+                ):
+                    logger.error("Account %s was processed since %s was planned, plan it again", account.name, path)
+                    stale_accounts.append(account.name)
+                    continue
+
+                scrobbler = create_scrobbler(
+                    db,
+                    account,
+                    create_lastfm_client(account, session_cache),
+                    None,
+                    rate_limiter=rate_limiter,
+                    metadata_cache=metadata_cache,
+                    canonicalizer=canonicalizer,
+                    account_id=account_id,
+                )
+                if applied:
+                    logger.info("Plan of account %s already applied, delivering its pending scrobbles", account.name)
+                else:
+                    with db.transaction():
+                        scrobbler.enqueue_tracks(plan.tracks, looked_up=plan.durations, names=plan.names)
+                        scrobbler.cleanup_database()
+                    # the scrobbles are in the outbox: if their delivery fails, applying the plan again
+                    # delivers them instead of finding the account stale
+                    snapshots.mark_processed(account.name, plan.fingerprint)
+                delivered += scrobbler.deliver_pending(batch_size=settings.scrobbler.batch_size)
+    finally:
+        db.close()
+
+    if stale_accounts:
+        raise RuntimeError(f"Accounts processed since {path} was planned, plan them again: {', '.join(stale_accounts)}")
+    return delivered
+
+
+def select_account(name: Optional[str]) -> "AccountSettings":
+    """The account with this name, or the only configured account if no name is given."""
+    from ytm2lfm.config import get_settings
+
+    accounts = get_settings().get_accounts()
+    if name is None:
+        if len(accounts) != 1:
+            raise ValueError("Several accounts are configured, select one with --account")
+        return accounts[0]
+    for account in accounts:
+        if account.name == name:
+            return account
+    raise ValueError(f"Unknown account: {name}")
+
+
+def write_metrics() -> None:
+    """Export the metrics collected so far to the configured Prometheus textfile and JSON summary."""
+    from ytm2lfm.config import get_settings
+    from ytm2lfm.metrics import metrics
+
+    settings = get_settings()
+    if not metrics.enabled:
+        return
+    try:
+        if os.path.exists(settings.sqlite.db_path):
+            metrics.set_gauge("database_bytes", os.path.getsize(settings.sqlite.db_path))
+        if settings.metrics.textfile:
+            metrics.write_textfile(settings.metrics.textfile)
+        if settings.metrics.summary_file:
+            metrics.write_summary(settings.metrics.summary_file)
+    except OSError as e:
+        logger.error("Failed to write the metrics: %s", e)
+
+
+def run_daemon(watch=False):
+    import asyncio
+
+    from ytm2lfm.config import get_settings
+    from ytm2lfm.daemon import Daemon
+    from ytm2lfm.metrics import metrics
+    from ytm2lfm.ratelimit import TokenBucket
+
+    settings = get_settings()
+    metrics.enabled = settings.metrics.enabled
+    metrics_server = None
+    if settings.metrics.http_port is not None:
+        metrics_server = metrics.serve_http(settings.metrics.http_port, settings.metrics.http_host)
+    db = create_database()
+    accounts = settings.get_accounts()
+    rate_limiter = TokenBucket(rate=settings.scrobbler.rate_limit, burst=settings.scrobbler.rate_limit_burst)
+    if watch:
+        intervals = dict(
+            interval=settings.watch.min_interval,
+            max_interval=settings.watch.max_interval,
+            backoff=settings.watch.backoff,
+        )
+    else:
+        intervals = dict(interval=settings.daemon.interval)
+    daemon = Daemon(
+        db,
+        accounts,
+        settings.scrobbler,
+        dedupe_settings=settings.dedupe,
+        max_in_flight=settings.daemon.max_in_flight,
+        rate_limiter=rate_limiter,
+        session_cache=create_session_cache(),
+        metadata_cache=create_metadata_cache(db),
+        canonicalizer=create_canonicalizer(db, rate_limiter, accounts[0] if accounts else None),
+        on_run=write_metrics,
+        **intervals,
+    )
     try:
+        asyncio.run(daemon.run())
+    finally:
+        daemon.close()
+        db.close()
+        if metrics_server is not None:
+            metrics_server.shutdown()
+
+
+def create_lastfm_client(
+    account: "AccountSettings", session_cache: Optional["SessionKeyCache"] = None
+) -> "LastFMClient":
+    from ytm2lfm.lastfm import LastFMClient
+
+    return LastFMClient(
+        api_key=account.lastfm.api_key,
+        api_secret=account.lastfm.shared_secret,
+        username=account.lastfm.registered_to,
+        password=account.lastfm.password,
+        session_cache=session_cache,
+    )
+
+
+def create_ytmusic_client(account: "AccountSettings") -> "YTMusicClient":
+    from ytm2lfm.ytmusic import YTMusicClient
+
+    return YTMusicClient(
+        auth_file=account.ytmusic.auth_file,
+        client_id=account.ytmusic.client_id,
+        client_secret=account.ytmusic.client_secret,
+    )
+
+
+def fetch_ytmusic_history(account: "AccountSettings") -> List[Dict[str, Any]]:
+    return create_ytmusic_client(account).get_history()
+
+
+def lookup_missing_durations(
+    scrobbler: "Scrobbler", account: "AccountSettings", tracks: List["Track"]
+) -> Dict[str, int]:
+    """
+    Look up the durations of the tracks neither cached nor carried by the history. The YouTube Music client
+    is only created, and authenticated, when some are missing.
+
+    Returns:
+        Duration in seconds per video ID
+    """
+    missing = scrobbler.missing_durations(tracks)
+    if not missing:
+        return {}
+    if scrobbler.ytmusic is None:
+        scrobbler.ytmusic = create_ytmusic_client(account)
+    return scrobbler.lookup_durations(missing)
+
+
+def run_account_scrobble(
+    db: "SQLite",
+    account: "AccountSettings",
+    history: List[Dict[str, Any]],
+    rate_limiter: Optional["TokenBucket"] = None,
+    session_cache: Optional["SessionKeyCache"] = None,
+    metadata_cache: Optional["TrackMetadataCache"] = None,
+    canonicalizer: Optional["Canonicalizer"] = None,
+    sync=False,
+    dry_run=False,
+    replay=False,
+):
+    from concurrent.futures import ThreadPoolExecutor
+
+    from ytm2lfm.config import get_settings
+
+    settings = get_settings()
+
+    lastfm = None if sync else create_lastfm_client(account, session_cache)
+    scrobbler = create_scrobbler(
+        db,
+        account,
+        lastfm,
+        None,
+        rate_limiter=rate_limiter,
+        metadata_cache=metadata_cache,
+        canonicalizer=canonicalizer,
+    )
+
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="ytm2lfm") as pool:
+        # The history changed, so there is likely something to deliver: unless a session key is cached,
+        # authenticate with Last.fm while the synced window is streamed from the database into the diff
+        auth_future = None
+        if lastfm is not None and not dry_run and not lastfm.session_key:
+            auth_future = pool.submit(lastfm.authenticate)
+
         # Get tracks that need to be scrobbled
-        tracks_to_scrobble = scrobbler.get_tracks_to_scrobble()
+        tracks_to_scrobble = scrobbler.get_tracks_to_scrobble(history=history)
+
+        # A replayed history is processed without YouTube Music and assumes the default duration for the
+        # tracks whose duration is missing
+        looked_up = {} if dry_run or replay else lookup_missing_durations(scrobbler, account, tracks_to_scrobble)
 
-        # Scrobble the tracks
-        scrobbler.scrobble_tracks(tracks_to_scrobble, sync=sync, dry_run=dry_run)
+        # Record the tracks, plan their scrobbles and clean up the database in one transaction
+        with db.transaction():
+            scrobbler.enqueue_tracks(tracks_to_scrobble, sync=sync, dry_run=dry_run, looked_up=looked_up)
 
-        # Clean up database to keep it from growing too large
-        scrobbler.cleanup_database(dry_run=dry_run)
+            # Clean up database to keep it from growing too large
+            scrobbler.cleanup_database(dry_run=dry_run)
 
-        logger.info("Scrobbling process completed successfully")
+        # Scrobble the tracks, starting with the ones left pending by an interrupted run
+        if not sync:
+            if auth_future is not None:
+                auth_future.result()
+            scrobbler.deliver_pending(batch_size=settings.scrobbler.batch_size, dry_run=dry_run)
 
-        return tracks_to_scrobble
-    except Exception as e:
-        logger.error(f"Scrobbling process failed: {str(e)}", exc_info=True)
-        raise
+    logger.info("Scrobbling process completed successfully for account %s", account.name)
+
+    return tracks_to_scrobble
 
 
 def setup_cli():
@@ -62,6 +713,13 @@ def setup_cli():
                 python {cli_relative_path} scrobble    # Normal scrobbling operation
                 python {cli_relative_path} sync        # Sync tracks without scrobbling
                 python {cli_relative_path} dry-run     # Dry-run
+                python {cli_relative_path} scrobble --replay  # Retry with the last fetched history
+                python {cli_relative_path} daemon      # Keep scrobbling all accounts periodically
+                python {cli_relative_path} watch       # Keep scrobbling, polling active listeners more often
+                python {cli_relative_path} import-takeout watch-history.json  # Backfill from Google Takeout
+                python {cli_relative_path} seed-from-lastfm  # Sync with the scrobbles already on Last.fm
+                python {cli_relative_path} plan run.plan   # Save what a scrobble run would submit, to review it
+                python {cli_relative_path} apply run.plan  # Submit it, without fetching the histories again
         """
     )
     parser = argparse.ArgumentParser(
@@ -73,13 +731,55 @@ def setup_cli():
     subparsers = parser.add_subparsers(dest="command", help="Command to execute")
 
     # Scrobble command
-    subparsers.add_parser("scrobble", help="Scrobble tracks from YTMusic to Last.fm")
+    scrobble_parser = subparsers.add_parser("scrobble", help="Scrobble tracks from YTMusic to Last.fm")
 
     # Sync command
-    subparsers.add_parser("sync", help="Sync tracks in database without scrobbling")
+    sync_parser = subparsers.add_parser("sync", help="Sync tracks in database without scrobbling")
 
     # Dry-run command
-    subparsers.add_parser("dry-run", help="Dry-run")
+    dry_run_parser = subparsers.add_parser("dry-run", help="Dry-run")
+
+    # Plan command
+    plan_parser = subparsers.add_parser("plan", help="Save the scrobbles a run would submit in a plan file")
+    plan_parser.add_argument("path", help="Path of the plan file to write")
+
+    # Apply command
+    apply_parser = subparsers.add_parser("apply", help="Submit the scrobbles of a plan file, if still up to date")
+    apply_parser.add_argument("path", help="Path of a plan file written by plan")
+
+    for subparser in (scrobble_parser, sync_parser, dry_run_parser, plan_parser):
+        subparser.add_argument(
+            "--replay",
+            action="store_true",
+            help="Use the latest stored history snapshot instead of fetching it from YouTube Music",
+        )
+
+    # Daemon command
+    subparsers.add_parser("daemon", help="Keep running and scrobble all accounts periodically")
+
+    # Watch command
+    subparsers.add_parser("watch", help="Keep running and poll each account more often while it is listening")
+
+    # Import command
+    import_parser = subparsers.add_parser(
+        "import-takeout", help="Backfill the history from a Google Takeout watch-history.json, resumable"
+    )
+    import_parser.add_argument("path", help="Path of watch-history.json")
+    import_parser.add_argument("--account", help="Account to import into, required with several accounts")
+    import_parser.add_argument("--restart", action="store_true", help="Import the file from the start")
+    import_parser.add_argument(
+        "--no-scrobble", action="store_true", help="Only archive the plays, do not scrobble the recent ones"
+    )
+    import_parser.add_argument("--dry-run", action="store_true", help="Parse the file without storing anything")
+
+    # Seed command
+    seed_parser = subparsers.add_parser(
+        "seed-from-lastfm",
+        help="Load the scrobbles already on Last.fm, then sync the history without scrobbling them twice",
+    )
+    seed_parser.add_argument("--account", help="Account to seed, required with several accounts")
+    seed_parser.add_argument("--days", type=float, help="Only load the scrobbles of the last days, all by default")
+    seed_parser.add_argument("--dry-run", action="store_true", help="Load the scrobbles without syncing the history")
 
     return parser
 
@@ -87,21 +787,54 @@ def setup_cli():
 def main():
     parser = setup_cli()
     args = parser.parse_args()
+    if args.command is None:
+        parser.print_help()
+        sys.exit(1)
+
+    from ytm2lfm.config import get_settings
+    from ytm2lfm.logger import setup_logging
+
+    settings = get_settings()
+    setup_logging(json_format=settings.logging.json_format, queue=settings.logging.queue)
 
     if args.command == "scrobble":
-        tracks = run_scrobble(sync=False, dry_run=False)
-        logger.info(f"Scrobbled {len(tracks) if tracks else 0} tracks to Last.fm")
+        tracks = run_scrobble(sync=False, dry_run=False, replay=args.replay)
+        logger.info("Scrobbled %s tracks to Last.fm", len(tracks) if tracks else 0)
 
     elif args.command == "sync":
-        tracks = run_scrobble(sync=True, dry_run=False)
-        logger.info(f"Synced {len(tracks) if tracks else 0} tracks in database without scrobbling")
+        tracks = run_scrobble(sync=True, dry_run=False, replay=args.replay)
+        logger.info("Synced %s tracks in database without scrobbling", len(tracks) if tracks else 0)
 
     elif args.command == "dry-run":
-        tracks = run_scrobble(sync=False, dry_run=True)
-        logger.info(f"Dry-run finished. Would scrobble {len(tracks) if tracks else 0} tracks to Last.fm")
-    else:
-        parser.print_help()
-        sys.exit(1)
+        tracks = run_scrobble(sync=False, dry_run=True, replay=args.replay)
+        logger.info("Dry-run finished. Would scrobble %s tracks to Last.fm", len(tracks) if tracks else 0)
+
+    elif args.command == "plan":
+        plans = run_plan(args.path, replay=args.replay)
+        logger.info("Planned %s scrobbles in %s", sum(len(plan.tracks) for plan in plans), args.path)
+
+    elif args.command == "apply":
+        delivered = run_apply(args.path)
+        logger.info("Applied %s, scrobbled %s tracks to Last.fm", args.path, delivered)
+
+    elif args.command == "daemon":
+        run_daemon()
+
+    elif args.command == "watch":
+        run_daemon(watch=True)
+
+    elif args.command == "seed-from-lastfm":
+        delivered = run_seed_from_lastfm(account_name=args.account, days=args.days, dry_run=args.dry_run)
+        logger.info("Seeded from Last.fm and scrobbled %s missing tracks", delivered)
+
+    elif args.command == "import-takeout":
+        run_import_takeout(
+            args.path,
+            account_name=args.account,
+            restart=args.restart,
+            scrobble=not args.no_scrobble,
+            dry_run=args.dry_run,
+        )
 
 
 if __name__ == "__main__":
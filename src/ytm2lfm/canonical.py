@@ -0,0 +1,225 @@
+import hashlib
+import logging
+import re
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, NamedTuple, Optional, Pattern, Sequence, Tuple
+
+from ytm2lfm.database import SQLite
+from ytm2lfm.lastfm import LastFMClient, is_rate_limit_error, is_transient_error
+from ytm2lfm.ratelimit import TokenBucket, call_with_retries
+from ytm2lfm.track import Track
+
+logger = logging.getLogger(__name__)
+
+# Raw (artist, title, album) of a track, the memo key
+Names = Tuple[str, str, str]
+
+# Looks up the Last.fm correction of an (artist, title), returns the corrected (artist, title)
+Corrector = Callable[[str, str], Tuple[str, str]]
+
+Rule = Tuple[Pattern[str], str]
+
+
+class RuleSet(NamedTuple):
+    """Compiled substitutions applied in order to the artist, title and album of a track."""
+
+    artist: Sequence[Rule]
+    title: Sequence[Rule]
+    album: Sequence[Rule]
+
+
+_WHITESPACE = re.compile(r"\s+")
+
+DEFAULT_RULES = RuleSet(
+    artist=(
+        # auto-generated "Artist - Topic" channels of YouTube Music
+        (re.compile(r"\s+-\s+Topic$"), ""),
+        # featuring credits, Last.fm keeps the main artist
+        (re.compile(r"\s+(?:feat\.?|ft\.?|featuring)\s.*$", re.IGNORECASE), ""),
+    ),
+    title=(
+        # video suffixes such as "(Official Video)", "[Official Music Video]", "(Lyric Video)" or "(Visualizer)"
+        (
+            re.compile(
+                r"\s*[(\[](?:official\s+)?(?:music\s+|lyrics?\s+)?(?:video|audio|visuali[sz]er|lyrics?)"
+                r"(?:\s+video)?[)\]]",
+                re.IGNORECASE,
+            ),
+            "",
+        ),
+        (re.compile(r"\s*[(\[](?:hd|hq|4k)[)\]]", re.IGNORECASE), ""),
+    ),
+    album=(),
+)
+
+# Keeps the names as they are
+NO_RULES = RuleSet(artist=(), title=(), album=())
+
+
+class Canonicalizer:
+    """
+    Normalise the artist, title and album of tracks before they are stored and scrobbled.
+
+    Each distinct raw (artist, title, album) goes through the rule set, and the optional Last.fm correction
+    lookup, only once: the result is memoised in memory and in the canonical_names table, so repeated plays
+    only cost a cache lookup. Memo entries are tied to a version of the rules and of the correction setting,
+    changing either normalises every track again.
+
+    Network lookups are kept out of the methods touching the database, so that a caller owning the database
+    on one thread can resolve the new names on another: pending() -> resolve() -> apply().
+    """
+
+    def __init__(
+        self,
+        db: SQLite,
+        rules: RuleSet = DEFAULT_RULES,
+        corrector: Optional[Corrector] = None,
+        capacity: int = 4096,
+    ):
+        """
+        Args:
+            db: Database holding the canonical_names memo table
+            rules: Compiled substitutions to apply
+            corrector: Last.fm correction lookup, see LastFMClient.get_correction, disabled if None
+            capacity: Maximum number of names kept in memory
+        """
+        self.db = db
+        self.rules = rules
+        self.corrector = corrector
+        self.capacity = capacity
+        self.version = _rules_version(rules, corrected=corrector is not None)
+        self._memo: "OrderedDict[Names, Names]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def canonicalize(self, tracks: List[Track]) -> List[Track]:
+        """Canonical version of tracks, normalising the names seen for the first time."""
+        return self.apply(self.resolve(self.pending(tracks)), tracks)
+
+    def pending(self, tracks: List[Track]) -> List[Names]:
+        """Distinct raw names of the tracks that were never normalised, loading the others in memory."""
+        with self._lock:
+            missing = [names for names in dict.fromkeys(_names(track) for track in tracks) if names not in self._memo]
+        if not missing:
+            return []
+
+        loaded = {}
+        with self.db.transaction() as conn:
+            for names in missing:
+                row = conn.execute(
+                    """
+                    SELECT artist, title, album
+                    FROM canonical_names
+                    WHERE version = ? AND raw_artist = ? AND raw_title = ? AND raw_album = ?
+                    """,
+                    (self.version, *names),
+                ).fetchone()
+                if row is not None:
+                    loaded[names] = tuple(row)
+        self._remember(loaded)
+        return [names for names in missing if names not in loaded]
+
+    def resolve(self, pending: List[Names]) -> Dict[Names, Names]:
+        """
+        Normalise raw names, with the Last.fm correction lookup if enabled. Does not touch the database,
+        so it can run on another thread.
+
+        Returns:
+            Canonical names per raw names, the names whose correction failed are left out
+        """
+        resolved = {}
+        for raw in pending:
+            artist, title, album = self.normalize(*raw)
+            if self.corrector is not None:
+                try:
+                    artist, title = self.corrector(artist, title)
+                except Exception as e:
+                    logger.warning("Failed to look up the Last.fm correction of %s - %s: %s", artist, title, e)
+                    continue
+            resolved[raw] = (artist, title, album)
+        return resolved
+
+    def apply(self, resolved: Dict[Names, Names], tracks: List[Track]) -> List[Track]:
+        """
+        Memoise resolved names, then return the canonical version of tracks.
+
+        Tracks whose names are not memoised (e.g. their correction failed) are only normalised by the rules.
+        """
+        if resolved:
+            with self.db.transaction() as conn:
+                conn.executemany(
+                    """
+                    INSERT OR REPLACE INTO canonical_names
+                    (version, raw_artist, raw_title, raw_album, artist, title, album)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    ((self.version, *raw, *names) for raw, names in resolved.items()),
+                )
+            self._remember(resolved)
+
+        canonical = []
+        for track in tracks:
+            raw = _names(track)
+            with self._lock:
+                names = self._memo.get(raw)
+            if names is None:
+                names = self.normalize(*raw)
+            canonical.append(track if names == raw else track._replace(artist=names[0], title=names[1], album=names[2]))
+        return canonical
+
+    def normalize(self, artist: str, title: str, album: str) -> Names:
+        """Apply the rule set to raw names."""
+        return (
+            _substitute(artist, self.rules.artist),
+            _substitute(title, self.rules.title),
+            _substitute(album, self.rules.album),
+        )
+
+    def _remember(self, entries: Dict[Names, Names]) -> None:
+        with self._lock:
+            for raw, names in entries.items():
+                self._memo[raw] = names
+                self._memo.move_to_end(raw)
+            while len(self._memo) > self.capacity:
+                self._memo.popitem(last=False)
+
+
+def match_key(name: str) -> str:
+    """Key comparing names as Last.fm does, ignoring case and repeated whitespace."""
+    return " ".join(name.casefold().split())
+
+
+def paced_corrector(client: LastFMClient, rate_limiter: TokenBucket, max_retries: int = 5) -> Corrector:
+    """Last.fm correction lookup of a client, paced by a rate limiter and retried like scrobble batches."""
+
+    def correct(artist: str, title: str) -> Tuple[str, str]:
+        return call_with_retries(
+            lambda: client.get_correction(artist, title),
+            rate_limiter,
+            is_rate_limited=is_rate_limit_error,
+            is_transient=is_transient_error,
+            max_retries=max_retries,
+        )
+
+    return correct
+
+
+def _names(track: Track) -> Names:
+    return track.artist, track.title, track.album or ""
+
+
+def _substitute(value: str, rules: Sequence[Rule]) -> str:
+    for pattern, replacement in rules:
+        value = pattern.sub(replacement, value)
+    return _WHITESPACE.sub(" ", value).strip() or value
+
+
+def _rules_version(rules: RuleSet, corrected: bool) -> str:
+    """Fingerprint of a rule set, memo entries of other versions are ignored."""
+    digest = hashlib.blake2b(digest_size=8)
+    for field_rules in rules:
+        for pattern, replacement in field_rules:
+            digest.update(f"{pattern.pattern}\0{pattern.flags}\0{replacement}\n".encode())
+        digest.update(b"\1")
+    digest.update(b"corrected" if corrected else b"rules")
+    return digest.hexdigest()
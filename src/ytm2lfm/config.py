@@ -1,12 +1,21 @@
 import os
-from typing import Optional
+from functools import lru_cache
+from typing import List, Literal, Optional
 
-from pydantic import BaseModel, Field, field_validator
+from pydantic import BaseModel, Field, field_validator, model_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
 class SQLiteSettings(BaseModel):
     db_path: str = Field(..., description="Path to the SQLite database file")
+    persistent_connection: bool = Field(True, description="Reuse a single connection for the whole process")
+    journal_mode: str = Field("WAL", description="SQLite journal mode (PRAGMA journal_mode)")
+    synchronous: str = Field("NORMAL", description="SQLite synchronous flag (PRAGMA synchronous)")
+    cache_size: int = Field(-16000, description="SQLite page cache size (PRAGMA cache_size), negative values in KiB")
+    mmap_size: int = Field(64 * 1024 * 1024, description="SQLite memory-mapped I/O size in bytes (PRAGMA mmap_size)")
+    archive_path: Optional[str] = Field(
+        None, description="Optional separate SQLite file for the monthly scrobble archive, defaults to db_path"
+    )
 
 
 class LastFMSettings(BaseModel):
@@ -28,6 +37,12 @@ class YTMusicSettings(BaseModel):
         return v
 
 
+class AccountSettings(BaseModel):
+    name: str = Field(..., description="Unique account name, used to partition the scrobbles in the database")
+    lastfm: LastFMSettings
+    ytmusic: YTMusicSettings
+
+
 class ScrobblerSettings(BaseModel):
     sequence_match_length: int = Field(
         50,
@@ -36,7 +51,34 @@ class ScrobblerSettings(BaseModel):
             "and YouTube Music history used to identify new tracks starting after this overlap."
         ),
     )
+    reconcile_mode: Literal["overlap", "diff"] = Field(
+        "overlap",
+        description=(
+            "How new tracks are detected: 'overlap' scrobbles the history before the first overlap with the database, "
+            "'diff' diffs the history against the database and also scrobbles tracks replayed from further down."
+        ),
+    )
+    max_diff_cost: int = Field(
+        400,
+        description="Maximum number of insertions plus deletions explored by the 'diff' mode before falling back",
+    )
     batch_size: int = Field(50, description="Maximum number of tracks to scrobble per batch")
+    rate_limit: float = Field(5.0, description="Maximum Last.fm requests per second, shared by all accounts")
+    rate_limit_burst: int = Field(5, description="Number of Last.fm requests that can be sent without waiting")
+    max_retries: int = Field(5, description="Maximum retries of a batch on Last.fm rate-limit or transient errors")
+    default_duration: int = Field(
+        180, description="Duration in seconds assumed for tracks of unknown length when spacing scrobble timestamps"
+    )
+    max_duration_lookups: int = Field(
+        20, description="Maximum number of track durations looked up on YouTube Music per run"
+    )
+    dedupe_window: int = Field(
+        1800,
+        description=(
+            "Seconds around a planned scrobble in which a scrobble of the same track seeded from Last.fm "
+            "(seed-from-lastfm) marks it as a duplicate, 0 disables the check"
+        ),
+    )
     max_synced_tracks: int = Field(
         200,
         description=(
@@ -47,11 +89,91 @@ class ScrobblerSettings(BaseModel):
     )
 
 
+class SnapshotSettings(BaseModel):
+    directory: Optional[str] = Field(
+        None, description="Directory of the raw history snapshots, defaults to a 'snapshots' directory next to db_path"
+    )
+    keep: int = Field(10, description="Number of history snapshots kept per account")
+
+
+class MetadataCacheSettings(BaseModel):
+    capacity: int = Field(4096, description="Number of track durations kept in memory")
+    ttl_days: float = Field(30, description="Days after which a cached track duration is looked up again")
+
+
+class CanonicalSettings(BaseModel):
+    enabled: bool = Field(
+        True, description="Normalise track names (e.g. '- Topic' channels, '(Official Video)') before scrobbling"
+    )
+    lastfm_corrections: bool = Field(
+        False, description="Also apply the Last.fm corrections of artist and track names, looked up once per track"
+    )
+    capacity: int = Field(4096, description="Number of canonical track names kept in memory")
+
+
+class DedupeSettings(BaseModel):
+    bucket: int = Field(
+        30, description="Imported plays of the same video less than this many seconds from a stored one are skipped"
+    )
+    capacity: int = Field(
+        10_000,
+        description="Minimum number of rows a duplicate filter is sized for, it is built for twice the rows stored",
+    )
+    error_rate: float = Field(0.01, description="False positive rate of the duplicate filter")
+
+
+class DaemonSettings(BaseModel):
+    interval: float = Field(60, description="Seconds between two runs for the same account")
+    max_in_flight: int = Field(8, description="Maximum number of concurrent YouTube Music and Last.fm requests")
+
+
+class WatchSettings(BaseModel):
+    min_interval: float = Field(30, description="Seconds between two polls while the history keeps changing")
+    max_interval: float = Field(900, description="Maximum seconds between two polls of an idle history")
+    backoff: float = Field(2.0, description="Factor applied to the polling interval after each unchanged poll")
+
+
+class MetricsSettings(BaseModel):
+    textfile: Optional[str] = Field(
+        None, description="Prometheus textfile (node exporter textfile collector) written after each run"
+    )
+    summary_file: Optional[str] = Field(None, description="JSON summary of the stage timings and counters of a run")
+    http_port: Optional[int] = Field(None, description="Port of a Prometheus /metrics endpoint served by the daemon")
+    http_host: str = Field("127.0.0.1", description="Address the /metrics endpoint listens on")
+
+    @property
+    def enabled(self) -> bool:
+        """Metrics are only collected when they are exported somewhere."""
+        return self.textfile is not None or self.summary_file is not None or self.http_port is not None
+
+
+class LoggingSettings(BaseModel):
+    json_format: bool = Field(False, description="Write logs as single-line JSON objects instead of plain text")
+    queue: bool = Field(True, description="Write logs from a background thread, so logging never blocks a run")
+
+
 class Settings(BaseSettings):
-    lastfm: LastFMSettings
-    ytmusic: YTMusicSettings
+    lastfm: Optional[LastFMSettings] = None
+    ytmusic: Optional[YTMusicSettings] = None
+    accounts: List[AccountSettings] = Field(
+        default_factory=list,
+        description="Accounts served by this process, as a JSON list. Defaults to a single 'default' account "
+        "built from the lastfm and ytmusic settings.",
+    )
     sqlite: SQLiteSettings
-    scrobbler: Optional[ScrobblerSettings] = Field(default_factory=ScrobblerSettings)
+    snapshots: SnapshotSettings = Field(default_factory=SnapshotSettings)
+    lastfm_session_cache: Optional[str] = Field(
+        None,
+        description="JSON file caching the Last.fm session keys, defaults to 'lastfm_sessions.json' next to db_path",
+    )
+    scrobbler: ScrobblerSettings = Field(default_factory=ScrobblerSettings)
+    metadata_cache: MetadataCacheSettings = Field(default_factory=MetadataCacheSettings)
+    canonical: CanonicalSettings = Field(default_factory=CanonicalSettings)
+    dedupe: DedupeSettings = Field(default_factory=DedupeSettings)
+    daemon: DaemonSettings = Field(default_factory=DaemonSettings)
+    watch: WatchSettings = Field(default_factory=WatchSettings)
+    metrics: MetricsSettings = Field(default_factory=MetricsSettings)
+    logging: LoggingSettings = Field(default_factory=LoggingSettings)
 
     # if both a .env file and environment variables are present, environment variables take precedence
     model_config = SettingsConfigDict(
@@ -59,5 +181,24 @@ class Settings(BaseSettings):
         env_nested_delimiter="__",  # Enables nested loading from env
     )
 
+    @model_validator(mode="after")
+    def validate_accounts(self):
+        if not self.accounts and (self.lastfm is None or self.ytmusic is None):
+            raise ValueError("Either lastfm and ytmusic settings or a list of accounts must be provided")
+        names = [account.name for account in self.get_accounts()]
+        if len(names) != len(set(names)):
+            raise ValueError("Account names must be unique")
+        return self
+
+    def get_accounts(self) -> List[AccountSettings]:
+        """Accounts to serve: the configured list, followed by the 'default' account if lastfm/ytmusic are set."""
+        accounts = list(self.accounts)
+        if self.lastfm is not None and self.ytmusic is not None:
+            accounts.append(AccountSettings(name="default", lastfm=self.lastfm, ytmusic=self.ytmusic))
+        return accounts
+
 
-settings = Settings()
+@lru_cache(maxsize=None)
+def get_settings() -> Settings:
+    """Load and validate the settings on first use, they are shared by the whole process."""
+    return Settings()
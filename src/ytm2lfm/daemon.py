@@ -0,0 +1,309 @@
+import asyncio
+import contextvars
+import logging
+import signal
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, TypeVar
+
+from ytm2lfm.canonical import Canonicalizer
+from ytm2lfm.config import AccountSettings, DedupeSettings, ScrobblerSettings
+from ytm2lfm.database import SQLite
+from ytm2lfm.http_pool import HTTPPool
+from ytm2lfm.lastfm import LastFMClient, SessionKeyCache
+from ytm2lfm.logger import log_context
+from ytm2lfm.metadata import TrackMetadataCache
+from ytm2lfm.metrics import metrics
+from ytm2lfm.ratelimit import TokenBucket
+from ytm2lfm.scrobbler import Scrobbler
+from ytm2lfm.utils import history_fingerprint
+from ytm2lfm.ytmusic import YTMusicClient
+
+logger = logging.getLogger(__name__)
+
+R = TypeVar("R")
+
+
+class AdaptiveInterval:
+    """Polling interval that resets to its minimum on activity and backs off exponentially otherwise."""
+
+    def __init__(self, min_interval: float, max_interval: float, backoff: float = 2.0):
+        if not 0 < min_interval <= max_interval or backoff < 1:
+            raise ValueError("Intervals must satisfy 0 < min_interval <= max_interval and backoff must be at least 1")
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.current = min_interval
+
+    def update(self, changed: bool) -> float:
+        """Return the delay until the next poll, given whether the last poll saw any change."""
+        if changed:
+            self.current = self.min_interval
+        else:
+            self.current = min(self.max_interval, self.current * self.backoff)
+        return self.current
+
+
+class AccountJob:
+    """An account served by the daemon, its scrobbler, clients and last history stay warm between runs."""
+
+    def __init__(self, account: AccountSettings, scrobbler: Scrobbler, interval: Optional[AdaptiveInterval] = None):
+        self.account = account
+        self.scrobbler = scrobbler
+        self.interval = interval
+        self.fingerprint: Optional[str] = None
+        self.history_changed = False
+        self.runs = 0
+        self.failures = 0
+
+    def reset(self) -> None:
+        """Drop the clients and the last history so the next run authenticates again and does the full work."""
+        self.scrobbler.lastfm = None
+        self.scrobbler.ytmusic = None
+        self.fingerprint = None
+
+
+class Daemon:
+    """
+    Serve many accounts from a single asyncio event loop.
+
+    Each account runs periodically as its own job, either on a fixed interval or, in watch mode, on an
+    adaptive interval that stays short while the user is listening and backs off while the history is
+    unchanged. A run whose history is unchanged since the previous one stops after the history request.
+    Network calls (authentication, history fetch,
+    scrobble submission) run on a thread pool bounded by max_in_flight and share one HTTP connection
+    pool, while all database work stays on the event loop thread, which owns the SQLite connection.
+    """
+
+    def __init__(
+        self,
+        db: SQLite,
+        accounts: List[AccountSettings],
+        scrobbler_settings: ScrobblerSettings,
+        interval: float = 60,
+        max_interval: Optional[float] = None,
+        backoff: float = 2.0,
+        max_in_flight: int = 8,
+        rate_limiter: Optional[TokenBucket] = None,
+        http_pool: Optional[HTTPPool] = None,
+        session_cache: Optional[SessionKeyCache] = None,
+        metadata_cache: Optional[TrackMetadataCache] = None,
+        canonicalizer: Optional[Canonicalizer] = None,
+        dedupe_settings: Optional[DedupeSettings] = None,
+        on_run: Optional[Callable[[], None]] = None,
+    ):
+        """
+        Args:
+            db: Database shared by all accounts, only used from the event loop thread
+            accounts: Accounts to serve
+            scrobbler_settings: Scrobbler configuration applied to every account
+            interval: Seconds between two runs for the same account, the minimum interval in watch mode
+            max_interval: Enables watch mode, maximum seconds between two runs of an idle account
+            backoff: Factor applied to the interval of an account after each run with an unchanged history
+            max_in_flight: Maximum number of concurrent network calls
+            rate_limiter: Token bucket pacing Last.fm requests of all accounts
+            http_pool: Keep-alive connections shared by all clients, created by default
+            session_cache: Cache of Last.fm session keys reused across restarts
+            metadata_cache: Cache of track durations shared by all accounts, backed by the database by default
+            canonicalizer: Normalisation of the track names shared by all accounts, the default rules by default
+            dedupe_settings: Settings of the duplicate filters of each account, the default ones by default
+            on_run: Called on the event loop thread after each run of an account, e.g. to export the metrics
+        """
+        self.db = db
+        self.scrobbler_settings = scrobbler_settings
+        self.interval = interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.max_in_flight = max_in_flight
+        self.rate_limiter = rate_limiter or TokenBucket(
+            rate=scrobbler_settings.rate_limit, burst=scrobbler_settings.rate_limit_burst
+        )
+        self.http_pool = http_pool or HTTPPool(max_connections=max_in_flight)
+        self.session_cache = session_cache
+        self.metadata_cache = metadata_cache or TrackMetadataCache(db)
+        self.canonicalizer = canonicalizer or Canonicalizer(db)
+        self.dedupe_settings = dedupe_settings
+        self.on_run = on_run
+
+        self.jobs = [
+            AccountJob(
+                account,
+                self._create_scrobbler(account),
+                interval=None if max_interval is None else AdaptiveInterval(interval, max_interval, backoff),
+            )
+            for account in accounts
+        ]
+
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="ytm2lfm")
+        self._in_flight: Optional[asyncio.Semaphore] = None
+        self._stop: Optional[asyncio.Event] = None
+
+    def _create_scrobbler(self, account: AccountSettings) -> Scrobbler:
+        return Scrobbler.from_settings(
+            self.db,
+            self.scrobbler_settings,
+            self.db.get_or_create_account(account.name),
+            rate_limiter=self.rate_limiter,
+            metadata_cache=self.metadata_cache,
+            canonicalizer=self.canonicalizer,
+            dedupe_settings=self.dedupe_settings,
+        )
+
+    def create_ytmusic_client(self, account: AccountSettings) -> YTMusicClient:
+        return YTMusicClient(
+            auth_file=account.ytmusic.auth_file,
+            client_id=account.ytmusic.client_id,
+            client_secret=account.ytmusic.client_secret,
+            requests_session=self.http_pool.requests_session,
+            max_in_flight=self.max_in_flight,
+        )
+
+    def create_lastfm_client(self, account: AccountSettings) -> LastFMClient:
+        return LastFMClient(
+            api_key=account.lastfm.api_key,
+            api_secret=account.lastfm.shared_secret,
+            username=account.lastfm.registered_to,
+            password=account.lastfm.password,
+            mounts=self.http_pool.lastfm_mounts,
+            session_cache=self.session_cache,
+        )
+
+    async def run(self) -> None:
+        """Run every account periodically until stop() is called or SIGINT/SIGTERM is received."""
+        loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self.stop)
+
+        if self.max_interval is None:
+            logger.info("Daemon started for %s accounts, running each every %ss", len(self.jobs), self.interval)
+        else:
+            logger.info(
+                "Watching %s accounts, polling each every %ss to %ss", len(self.jobs), self.interval, self.max_interval
+            )
+        try:
+            # Spread the accounts over the interval to smooth the load
+            await asyncio.gather(
+                *(self._schedule(job, delay=i * self.interval / len(self.jobs)) for i, job in enumerate(self.jobs))
+            )
+        finally:
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                loop.remove_signal_handler(sig)
+            logger.info("Daemon stopped")
+
+    def stop(self) -> None:
+        """Stop scheduling new runs, the runs in progress are completed."""
+        if self._stop is not None:
+            self._stop.set()
+
+    async def run_once(self) -> List[Optional[int]]:
+        """
+        Run every account once, concurrently.
+
+        Returns:
+            Number of scrobbles delivered per account, None for the accounts that failed
+        """
+        return list(await asyncio.gather(*(self._run_job(job) for job in self.jobs)))
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+        self.http_pool.close()
+
+    async def _schedule(self, job: AccountJob, delay: float) -> None:
+        if await self._sleep(delay):
+            return
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await self._run_job(job)
+            interval = self.interval if job.interval is None else job.interval.update(job.history_changed)
+            if await self._sleep(interval - (loop.time() - started)):
+                return
+
+    async def _sleep(self, delay: float) -> bool:
+        """Wait for delay seconds, returns True if the daemon was stopped meanwhile."""
+        assert self._stop is not None
+        try:
+            await asyncio.wait_for(self._stop.wait(), timeout=max(0.0, delay))
+        except asyncio.TimeoutError:
+            pass
+        return self._stop.is_set()
+
+    async def _run_job(self, job: AccountJob) -> Optional[int]:
+        with log_context(account=job.account.name):
+            try:
+                with metrics.span("account_run"):
+                    delivered = await self.run_account(job)
+            except Exception as e:
+                job.failures += 1
+                job.history_changed = False
+                job.reset()
+                metrics.inc("run_failures")
+                logger.error("Run failed for account %s: %s", job.account.name, e, exc_info=True)
+                return None
+            finally:
+                metrics.inc("runs")
+                if self.on_run is not None:
+                    self.on_run()
+            job.runs += 1
+            return delivered
+
+    async def run_account(self, job: AccountJob) -> int:
+        """
+        Fetch the history of an account, plan its new scrobbles and deliver the pending ones.
+
+        Returns:
+            Number of scrobbles delivered
+        """
+        scrobbler = job.scrobbler
+        if scrobbler.ytmusic is None:
+            scrobbler.ytmusic = await self._call(self.create_ytmusic_client, job.account)
+
+        with metrics.span("get_history"):
+            history = await self._call(scrobbler.ytmusic.get_history)
+        fingerprint = history_fingerprint(history)
+        job.history_changed = fingerprint != job.fingerprint
+        if not job.history_changed:
+            logger.debug("History unchanged for account %s", job.account.name)
+            return 0
+
+        logger.debug("Fetched %s recent tracks from YouTube Music for account %s", len(history), job.account.name)
+        tracks_to_scrobble = scrobbler.get_tracks_to_scrobble(history=history)
+
+        # Durations neither cached nor in the history, and names never canonicalised (which may need a
+        # Last.fm correction lookup) are resolved off the event loop
+        looked_up = {}
+        if missing := scrobbler.missing_durations(tracks_to_scrobble):
+            looked_up = await self._call(scrobbler.lookup_durations, missing)
+        names = {}
+        if pending := self.canonicalizer.pending(tracks_to_scrobble):
+            names = await self._call(self.canonicalizer.resolve, pending)
+
+        with self.db.transaction():
+            scrobbler.enqueue_tracks(tracks_to_scrobble, looked_up=looked_up, names=names)
+            scrobbler.cleanup_database()
+
+        # Last.fm is only contacted, and authenticated, when there is something to deliver
+        delivered = 0
+        while batch := self.db.fetch_pending_scrobbles(self.scrobbler_settings.batch_size, scrobbler.account_id):
+            if scrobbler.lastfm is None:
+                scrobbler.lastfm = self.create_lastfm_client(job.account)
+            await self._call(scrobbler.submit_batch, batch)
+            self.db.ack_scrobbles([pending.id for pending in batch])
+            delivered += len(batch)
+
+        # Only remembered once everything was delivered, a failed run is fully retried
+        job.fingerprint = fingerprint
+        if delivered:
+            logger.info("Scrobbled %s tracks for account %s", delivered, job.account.name)
+        return delivered
+
+    async def _call(self, func: Callable[..., R], *args) -> R:
+        """
+        Run a blocking network call on the thread pool, bounded by max_in_flight. The call runs in a copy of the
+        caller's context, so its log records carry the fields of the account.
+        """
+        if self._in_flight is None:
+            self._in_flight = asyncio.Semaphore(self.max_in_flight)
+        context = contextvars.copy_context()
+        async with self._in_flight:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, context.run, func, *args)
@@ -1,61 +1,196 @@
 import logging
 import sqlite3
+import time
+from collections import defaultdict
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from ytm2lfm.metrics import metrics
+from ytm2lfm.migrations import migrate
+from ytm2lfm.track import PendingScrobble, Track
+
+if TYPE_CHECKING:
+    from ytm2lfm.dedupe import DuplicateFilter
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_ACCOUNT_ID = 1
 
-class SQLite:
-    SCHEMA = """
-        CREATE TABLE IF NOT EXISTS scrobbles (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            video_id TEXT NOT NULL,
-            title TEXT NOT NULL,
-            artist TEXT NOT NULL,
-            album TEXT,
-            played INTEGER NOT NULL
-        )
-    """
+SCROBBLE_COLUMNS = Track._fields
 
-    def __init__(self, db_path: str):
+ARCHIVE_TABLE_PREFIX = "archive_scrobbles_"
+
+
+class SQLite:
+    def __init__(
+        self,
+        db_path: str,
+        persistent: bool = True,
+        journal_mode: str = "WAL",
+        synchronous: str = "NORMAL",
+        cache_size: int = -16000,
+        mmap_size: int = 64 * 1024 * 1024,
+        archive_path: Optional[str] = None,
+        window_size: int = 200,
+    ):
+        """
+        Args:
+            db_path: Path to the SQLite database file
+            persistent: Reuse a single connection for the lifetime of this instance
+                        instead of opening a new one for every operation
+            journal_mode: Value for PRAGMA journal_mode (e.g. WAL, DELETE)
+            synchronous: Value for PRAGMA synchronous (e.g. NORMAL, FULL)
+            cache_size: Value for PRAGMA cache_size (negative values are in KiB)
+            mmap_size: Value for PRAGMA mmap_size in bytes (0 disables memory-mapped I/O)
+            archive_path: Optional separate database file for the monthly archive tables,
+                          attached to every connection. Defaults to the main database file.
+            window_size: Number of latest scrobbles kept per account in the scrobbles table (the synced window),
+                         older ones are moved to the archive as new ones are inserted
+        """
         self.db_path = db_path
+        self.persistent = persistent
+        self.pragmas = {
+            "journal_mode": journal_mode,
+            "synchronous": synchronous,
+            "cache_size": cache_size,
+            "mmap_size": mmap_size,
+        }
+        if window_size < 1:
+            raise ValueError("window_size must be a positive integer")
+        self.window_size = window_size
+        self.archive_path = archive_path
+        self.archive_schema = "archive" if archive_path else "main"
+        self._archive_tables: set = set()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._tx_conn: Optional[sqlite3.Connection] = None
+        self._rollback_callbacks: List[Callable[[], None]] = []
 
-        # ensure the directory for the database exists
+        # ensure the directories for the databases exist
         Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+        if self.archive_path:
+            Path(self.archive_path).parent.mkdir(parents=True, exist_ok=True)
 
-        # initialize the database schema if it doesn't exist
-        with self.connect() as conn:
-            conn.execute(self.SCHEMA)
+        # create the schema or upgrade it to the latest version
+        with self.transaction() as conn:
+            migrate(conn)
 
-        logger.info(f"Database initialized at {self.db_path}")
+        logger.info("Database initialized at %s", self.db_path)
 
     def connect(self, **kwargs):
-        """Custom connect function that always sets row_factory to sqlite3.Row"""
+        """Custom connect function that always sets row_factory to sqlite3.Row and applies the pragmas"""
         conn = sqlite3.connect(self.db_path, **kwargs)
         conn.row_factory = sqlite3.Row
+        if self.archive_path:
+            conn.execute("ATTACH DATABASE ? AS archive", (self.archive_path,))
+        for pragma, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {pragma} = {value}")
         return conn
 
-    def delete_all_tracks(self) -> int:
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """
+        Run the enclosed operations in a single transaction, committed on exit and rolled back on error.
+
+        Nested calls join the outermost transaction, so several operations (e.g. all inserts and the
+        cleanup of a run) can be grouped and committed with a single write to disk.
+        """
+        if self._tx_conn is not None:
+            yield self._tx_conn
+            return
+
+        if self.persistent:
+            if self._conn is None:
+                self._conn = self.connect()
+            conn = self._conn
+        else:
+            conn = self.connect()
+
+        self._tx_conn = conn
+        try:
+            with metrics.span("db_transaction"), conn:
+                yield conn
+        except BaseException:
+            # archive tables created in a rolled back transaction are gone
+            self._archive_tables.clear()
+            for callback in self._rollback_callbacks:
+                callback()
+            raise
+        finally:
+            self._tx_conn = None
+            self._rollback_callbacks.clear()
+            if not self.persistent:
+                conn.close()
+
+    def on_rollback(self, callback: Callable[[], None]) -> None:
+        """
+        Call callback if the current transaction is rolled back, e.g. to drop state derived from its writes.
+        Does nothing outside a transaction, and a callback is registered once per transaction.
+        """
+        if self._tx_conn is not None and callback not in self._rollback_callbacks:
+            self._rollback_callbacks.append(callback)
+
+    def close(self) -> None:
+        """Close the persistent connection, if open."""
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def get_or_create_account(self, name: str) -> int:
+        """
+        Get the ID of an account, creating it if needed.
+
+        Args:
+            name: Unique account name
+
+        Returns:
+            Account ID
+        """
+        with self.transaction() as conn:
+            conn.execute("INSERT OR IGNORE INTO accounts (name) VALUES (?)", (name,))
+            return conn.execute("SELECT id FROM accounts WHERE name = ?", (name,)).fetchone()["id"]
+
+    def get_account_id(self, name: str) -> Optional[int]:
+        """ID of an account, None if it was never created: unlike get_or_create_account, nothing is written."""
+        with self.transaction() as conn:
+            row = conn.execute("SELECT id FROM accounts WHERE name = ?", (name,)).fetchone()
+        return None if row is None else row["id"]
+
+    def delete_all_tracks(self, account_id: int = DEFAULT_ACCOUNT_ID) -> int:
         """
-        Delete all rows from the scrobbles table.
+        Delete all rows of an account from the scrobbles table.
+
+        Args:
+            account_id: Account owning the scrobbles
 
         Returns:
             Number of deleted rows
         """
-        with self.connect() as conn:
-            cursor = conn.execute("DELETE FROM scrobbles")
+        with self.transaction() as conn:
+            cursor = conn.execute("DELETE FROM scrobbles WHERE account_id = ?", (account_id,))
             deleted_count = cursor.rowcount
 
-        logger.info(f"Deleted {deleted_count} tracks from scrobbles table")
+        logger.info("Deleted %s tracks from scrobbles table", deleted_count)
         return deleted_count
 
-    def insert_tracks(self, tracks: List[Dict[str, Any]]) -> int:
+    @metrics.timed("db_insert_tracks")
+    def insert_tracks(
+        self, tracks: List[Track], account_id: int = DEFAULT_ACCOUNT_ID, duplicates: Optional["DuplicateFilter"] = None
+    ) -> int:
         """
         Bulk insert multiple scrobbles into the database.
+        Tracks already stored for the account with the same video_id and timestamp are skipped.
+
+        With a filter of the plays of the account, only the tracks it might hold are looked up in the database.
+        The filter catches up with the stored plays before it is probed, and the inserted tracks are added to it.
+
+        The scrobbles table keeps the latest window_size scrobbles of each account in a ring buffer: each
+        track overwrites the slot of the oldest one, which is moved to the monthly archive. Retention is part
+        of the insert, the table never grows past the window and its pages are reused in place.
 
         Args:
-            tracks: List of track dictionaries
+            tracks: List of tracks, oldest first
+            account_id: Account owning the scrobbles
 
         Returns:
             Number of inserted rows
@@ -63,24 +198,110 @@ class SQLite:
         if not tracks:
             return 0
 
-        with self.connect() as conn:
-            cursor = conn.executemany(
+        with self.transaction() as conn:
+            capacity, seq = self._sync_window(conn, account_id)
+
+            if duplicates is not None:
+                duplicates.refresh()
+            new_tracks = []
+            seen = set()
+            for track in tracks:
+                # rows without a timestamp never conflict
+                if track.timestamp is not None:
+                    key = (track.video_id, track.timestamp)
+                    if key in seen or (
+                        (duplicates is None or duplicates.might_contain(*key))
+                        and conn.execute(
+                            "SELECT 1 FROM scrobbles WHERE account_id = ? AND video_id = ? AND timestamp = ?",
+                            (account_id, *key),
+                        ).fetchone()
+                    ):
+                        continue
+                    seen.add(key)
+                new_tracks.append(track)
+            if not new_tracks:
+                return 0
+
+            rows = [
+                (next_id, account_id, *track)
+                for next_id, track in zip(self._reserve_ids(conn, len(new_tracks), account_id), new_tracks)
+            ]
+            # tracks that would be overwritten in the same call go straight to the archive
+            overflow = max(0, len(rows) - capacity)
+            evicted = conn.execute(
+                f"""
+                SELECT id, account_id, {", ".join(SCROBBLE_COLUMNS)}
+                FROM scrobbles
+                WHERE account_id = ? AND {_ring_slots(seq + overflow, len(rows) - overflow, capacity)}
+                """,
+                (account_id,),
+            ).fetchall()
+            self._archive_rows(conn, [tuple(row) for row in evicted] + rows[:overflow])
+
+            conn.executemany(
+                f"""
+                INSERT INTO scrobbles (account_id, slot, id, {", ".join(SCROBBLE_COLUMNS)})
+                VALUES ({", ".join("?" * (len(SCROBBLE_COLUMNS) + 3))})
+                ON CONFLICT (account_id, slot) DO UPDATE SET
+                {", ".join(f"{column} = excluded.{column}" for column in ("id", *SCROBBLE_COLUMNS))}
+                """,
+                (
+                    (account_id, (seq + i) % capacity, row[0], *row[2:])
+                    for i, row in enumerate(rows[overflow:], start=overflow)
+                ),
+            )
+            first = min((row[-1] for row in rows if row[-1] is not None), default=None)
+            conn.execute(
                 """
-                INSERT INTO scrobbles (video_id, title, artist, album, played)
-                VALUES (:video_id, :title, :artist, :album, :played)
+                UPDATE sync_windows SET seq = ?, first_timestamp = COALESCE(MIN(first_timestamp, ?), ?)
+                WHERE account_id = ?
                 """,
-                tracks,
+                (seq + len(rows), first, first, account_id),
             )
-            count = cursor.rowcount
+            if duplicates is not None:
+                duplicates.add((row[0], row[2], row[-1]) for row in rows if row[-1] is not None)
+
+        return len(rows)
+
+    @metrics.timed("db_get_latest_timestamp")
+    def get_latest_timestamp(self, account_id: int = DEFAULT_ACCOUNT_ID) -> Optional[int]:
+        """Timestamp of the latest scrobble stored for an account, None if there is none."""
+        with self.transaction() as conn:
+            return conn.execute("SELECT MAX(timestamp) FROM scrobbles WHERE account_id = ?", (account_id,)).fetchone()[
+                0
+            ]
 
-        return count
+    def get_high_water_mark(self, account_id: int = DEFAULT_ACCOUNT_ID) -> int:
+        """Number of scrobbles ever inserted in the synced window of an account, raised by every insert."""
+        with self.transaction() as conn:
+            row = conn.execute("SELECT seq FROM sync_windows WHERE account_id = ?", (account_id,)).fetchone()
+        return 0 if row is None else row["seq"]
 
-    def delete_except_latest_n(self, n: int) -> int:
+    def get_first_synced_timestamp(self, account_id: int = DEFAULT_ACCOUNT_ID) -> Optional[int]:
         """
-        Deletes all rows except the latest `n` records based on auto-incrementing ID.
+        Timestamp of the earliest scrobble ever inserted in the synced window of an account, by a run or a sync,
+        None if there is none. Plays of the account stored since then were scrobbled or synced by the runs.
+        """
+        with self.transaction() as conn:
+            row = conn.execute(
+                "SELECT first_timestamp FROM sync_windows WHERE account_id = ?", (account_id,)
+            ).fetchone()
+        return None if row is None else row["first_timestamp"]
+
+    def get_earliest_timestamp(self, account_id: int = DEFAULT_ACCOUNT_ID) -> Optional[int]:
+        """Timestamp of the earliest scrobble of the synced window of an account, None if there is none."""
+        with self.transaction() as conn:
+            return conn.execute("SELECT MIN(timestamp) FROM scrobbles WHERE account_id = ?", (account_id,)).fetchone()[
+                0
+            ]
+
+    def delete_except_latest_n(self, n: int, account_id: int = DEFAULT_ACCOUNT_ID) -> int:
+        """
+        Deletes all rows of an account except the latest `n` records.
 
         Args:
             n: Number of latest records to retain
+            account_id: Account owning the scrobbles
 
         Returns:
             Number of deleted rows
@@ -88,34 +309,645 @@ class SQLite:
         if n < 1:
             raise ValueError("n must be a positive integer")
 
-        with self.connect() as conn:
+        with self.transaction() as conn:
+            capacity, seq = self._sync_window(conn, account_id)
+            if n >= capacity:
+                return 0
             cursor = conn.execute(
-                """
-                DELETE FROM scrobbles
-                WHERE id <= (
-                    SELECT id 
-                    FROM scrobbles 
-                    ORDER BY id DESC 
-                    LIMIT 1 OFFSET ?
-                )
-                """,
-                (n,),
+                f"DELETE FROM scrobbles WHERE account_id = ? AND NOT {_ring_slots(seq - n, n, capacity)}",
+                (account_id,),
             )
             deleted_count = cursor.rowcount
 
         return deleted_count
 
-    def fetch_latest_scrobbles(self) -> List[Dict[str, Any]]:
+    @metrics.timed("db_archive_except_latest_n")
+    def archive_except_latest_n(self, n: int, account_id: int = DEFAULT_ACCOUNT_ID) -> int:
         """
-        Fetch all scrobbles from the database, ordered by ID descending.
+        Move all rows of an account except the latest `n` records to the monthly archive tables.
+
+        The synced window never holds more than window_size rows, so this is free unless n is smaller.
+
+        Args:
+            n: Number of latest records to retain in the scrobbles table
+            account_id: Account owning the scrobbles
 
         Returns:
-            List of scrobble dictionaries
+            Number of archived rows
         """
-        with self.connect() as conn:
-            cursor = conn.execute("""
-                SELECT video_id, title, artist, album, played
+        if n < 1:
+            raise ValueError("n must be a positive integer")
+
+        with self.transaction() as conn:
+            capacity, seq = self._sync_window(conn, account_id)
+            if n >= capacity:
+                return 0
+            older = _ring_slots(seq - n, n, capacity)
+            rows = conn.execute(
+                f"""
+                SELECT id, account_id, {", ".join(SCROBBLE_COLUMNS)}
                 FROM scrobbles
-                ORDER BY id DESC
-            """)
-            return [dict(row) for row in cursor.fetchall()]
+                WHERE account_id = ? AND NOT {older}
+                """,
+                (account_id,),
+            ).fetchall()
+            self._archive_rows(conn, [tuple(row) for row in rows])
+            conn.execute(f"DELETE FROM scrobbles WHERE account_id = ? AND NOT {older}", (account_id,))
+
+        return len(rows)
+
+    @metrics.timed("db_archive_tracks")
+    def archive_tracks(self, tracks: List[Track], account_id: int = DEFAULT_ACCOUNT_ID) -> int:
+        """
+        Store tracks played before the synced window (e.g. imported from a Google Takeout) directly in the
+        monthly archive tables, skipping the ones already archived with the same video_id and timestamp.
+
+        The rows get ids reserved from the scrobbles sequence, so they never collide with the rows
+        archived later from the synced window.
+
+        Args:
+            tracks: List of tracks, with a timestamp
+            account_id: Account owning the scrobbles
+
+        Returns:
+            Number of archived rows
+        """
+        if not tracks:
+            return 0
+
+        tracks_by_month = defaultdict(list)
+        for track in tracks:
+            tracks_by_month[_archive_month(track.timestamp)].append(track)
+
+        archived = 0
+        with self.transaction() as conn:
+            ids = iter(self._reserve_ids(conn, len(tracks), account_id))
+
+            for month, month_tracks in tracks_by_month.items():
+                table = self._ensure_archive_table(conn, month)
+                cursor = conn.executemany(
+                    f"""
+                    INSERT INTO {self.archive_schema}.{table} (id, account_id, {", ".join(SCROBBLE_COLUMNS)})
+                    SELECT {", ".join("?" * (len(SCROBBLE_COLUMNS) + 2))}
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM {self.archive_schema}.{table}
+                        WHERE account_id = ? AND video_id = ? AND timestamp = ?
+                    )
+                    """,
+                    (
+                        (next(ids), account_id, *track, account_id, track.video_id, track.timestamp)
+                        for track in month_tracks
+                    ),
+                )
+                archived += cursor.rowcount
+
+        return archived
+
+    @metrics.timed("db_insert_lastfm_history")
+    def insert_lastfm_history(
+        self, scrobbles: Iterable[Tuple[str, str, int]], account_id: int = DEFAULT_ACCOUNT_ID
+    ) -> int:
+        """
+        Bulk load scrobbles seeded from Last.fm, the ones already loaded are skipped.
+
+        Args:
+            scrobbles: Normalised artist and title (see canonical.match_key) and timestamp of each scrobble
+            account_id: Account owning the scrobbles
+
+        Returns:
+            Number of inserted rows
+        """
+        scrobbles = list(scrobbles)
+        if not scrobbles:
+            return 0
+        with self.transaction() as conn:
+            # the ids of the scrobbles already loaded are left unused
+            ids = self._reserve_ids(conn, len(scrobbles), account_id, "lastfm_history")
+            cursor = conn.executemany(
+                """
+                INSERT OR IGNORE INTO lastfm_history (account_id, artist_key, title_key, timestamp, id)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                ((account_id, *scrobble, next_id) for next_id, scrobble in zip(ids, scrobbles)),
+            )
+            return cursor.rowcount
+
+    def fetch_lastfm_history(self, limit: int, account_id: int = DEFAULT_ACCOUNT_ID) -> List[Tuple[str, str, int]]:
+        """Latest scrobbles seeded from Last.fm, latest first, as (artist_key, title_key, timestamp)."""
+        with self.transaction() as conn:
+            rows = conn.execute(
+                """
+                SELECT artist_key, title_key, timestamp
+                FROM lastfm_history
+                WHERE account_id = ?
+                ORDER BY timestamp DESC
+                LIMIT ?
+                """,
+                (account_id, limit),
+            ).fetchall()
+        return [tuple(row) for row in rows]
+
+    def fetch_lastfm_history_between(
+        self, start: int, end: int, account_id: int = DEFAULT_ACCOUNT_ID
+    ) -> List[Tuple[str, str, int]]:
+        """Scrobbles seeded from Last.fm between start and end (inclusive), as (artist_key, title_key, timestamp)."""
+        with self.transaction() as conn:
+            rows = conn.execute(
+                """
+                SELECT artist_key, title_key, timestamp
+                FROM lastfm_history
+                WHERE account_id = ? AND timestamp BETWEEN ? AND ?
+                """,
+                (account_id, start, end),
+            ).fetchall()
+        return [tuple(row) for row in rows]
+
+    def get_import_checkpoint(self, source: str, account_id: int = DEFAULT_ACCOUNT_ID) -> Optional[sqlite3.Row]:
+        """
+        Progress of the import of a source file.
+
+        Returns:
+            Row with the size of the file, the byte offset reached and the cut-off timestamp of the import,
+            None if the file was never imported
+        """
+        with self.transaction() as conn:
+            return conn.execute(
+                "SELECT size, offset, before FROM import_checkpoints WHERE account_id = ? AND source = ?",
+                (account_id, source),
+            ).fetchone()
+
+    def save_import_checkpoint(
+        self, source: str, size: int, offset: int, before: Optional[int], account_id: int = DEFAULT_ACCOUNT_ID
+    ) -> None:
+        """Record the byte offset reached by the import of a source file, call it in the transaction of the import."""
+        with self.transaction() as conn:
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO import_checkpoints (account_id, source, size, offset, before)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                (account_id, source, size, offset, before),
+            )
+
+    def iter_archived_scrobbles(
+        self, start: Optional[int] = None, end: Optional[int] = None, account_id: int = DEFAULT_ACCOUNT_ID
+    ) -> Iterator[Track]:
+        """
+        Stream archived scrobbles of an account, latest first, only reading the monthly tables in range.
+
+        Args:
+            start: Optional lower bound (inclusive) on the scrobble timestamp
+            end: Optional upper bound (inclusive) on the scrobble timestamp
+            account_id: Account owning the scrobbles
+
+        Yields:
+            Archived tracks
+        """
+        for month in self._archive_months(start, end):
+            with self.transaction() as conn:
+                rows = conn.execute(
+                    f"""
+                    SELECT {", ".join(SCROBBLE_COLUMNS)}
+                    FROM {self.archive_schema}.{ARCHIVE_TABLE_PREFIX}{month}
+                    WHERE account_id = :account_id
+                    AND (:start IS NULL OR timestamp >= :start)
+                    AND (:end IS NULL OR timestamp <= :end)
+                    ORDER BY timestamp DESC, id DESC
+                    """,
+                    {"account_id": account_id, "start": start, "end": end},
+                ).fetchall()
+            yield from map(Track._make, rows)
+
+    def has_play(self, video_id: str, start: int, end: int, account_id: int = DEFAULT_ACCOUNT_ID) -> bool:
+        """
+        Whether a play of a video between start and end (inclusive) is stored for an account, in the synced
+        window or in the archive. Each table is probed through its (account_id, video_id, timestamp) index.
+        """
+        with self.transaction() as conn:
+            if conn.execute(
+                "SELECT 1 FROM scrobbles WHERE account_id = ? AND video_id = ? AND timestamp BETWEEN ? AND ?",
+                (account_id, video_id, start, end),
+            ).fetchone():
+                return True
+            return any(
+                conn.execute(
+                    f"""
+                    SELECT 1 FROM {self.archive_schema}.{ARCHIVE_TABLE_PREFIX}{month}
+                    WHERE account_id = ? AND video_id = ? AND timestamp BETWEEN ? AND ?
+                    """,
+                    (account_id, video_id, start, end),
+                ).fetchone()
+                for month in self._archive_months(start, end)
+            )
+
+    def iter_plays_after(self, after_id: int, account_id: int = DEFAULT_ACCOUNT_ID) -> Iterator[Tuple[int, str, int]]:
+        """
+        Stream the plays of an account stored with an id above after_id, in the synced window or in the archive.
+
+        Ids come from a single sequence (see archive_tracks), so the rows stored since a previous call are
+        exactly the ones above the largest id it returned. Rows without a timestamp are skipped.
+
+        Yields:
+            (id, video_id, timestamp) of each play, in no particular order
+        """
+        tables = ["scrobbles"] + [
+            f"{self.archive_schema}.{ARCHIVE_TABLE_PREFIX}{month}" for month in self._archive_months()
+        ]
+        for table in tables:
+            with self.transaction() as conn:
+                # +account_id keeps the planner on the id range instead of scanning every play of the account
+                rows = conn.execute(
+                    f"""
+                    SELECT id, video_id, timestamp
+                    FROM {table}
+                    WHERE id > ? AND +account_id = ? AND timestamp IS NOT NULL
+                    """,
+                    (after_id, account_id),
+                ).fetchall()
+            yield from map(tuple, rows)
+
+    def count_plays(self, account_id: int = DEFAULT_ACCOUNT_ID) -> int:
+        """Number of plays of an account, in the synced window and in the archive."""
+        tables = ["scrobbles"] + [
+            f"{self.archive_schema}.{ARCHIVE_TABLE_PREFIX}{month}" for month in self._archive_months()
+        ]
+        with self.transaction() as conn:
+            return sum(
+                conn.execute(f"SELECT COUNT(*) FROM {table} WHERE account_id = ?", (account_id,)).fetchone()[0]
+                for table in tables
+            )
+
+    def count_lastfm_history(self, account_id: int = DEFAULT_ACCOUNT_ID) -> int:
+        """Number of scrobbles seeded from Last.fm for an account."""
+        with self.transaction() as conn:
+            return conn.execute("SELECT COUNT(*) FROM lastfm_history WHERE account_id = ?", (account_id,)).fetchone()[0]
+
+    def iter_lastfm_history_after(
+        self, after_id: int, account_id: int = DEFAULT_ACCOUNT_ID
+    ) -> Iterator[Tuple[int, str, str, int]]:
+        """
+        Stream the scrobbles seeded from Last.fm for an account with an id above after_id. Ids come from a
+        sequence, so the rows loaded since a previous call are exactly the ones above the largest id it returned.
+
+        Yields:
+            (id, artist_key, title_key, timestamp) of each scrobble
+        """
+        with self.transaction() as conn:
+            rows = conn.execute(
+                """
+                SELECT id, artist_key, title_key, timestamp
+                FROM lastfm_history
+                WHERE account_id = ? AND id > ?
+                """,
+                (account_id, after_id),
+            ).fetchall()
+        yield from map(tuple, rows)
+
+    def load_duplicate_filter(
+        self, account_id: int = DEFAULT_ACCOUNT_ID, source: str = "plays"
+    ) -> Optional[sqlite3.Row]:
+        """
+        Persisted Bloom filter of the rows of a source of an account (see dedupe.DuplicateFilter),
+        None if never saved.
+        """
+        with self.transaction() as conn:
+            return conn.execute(
+                """
+                SELECT bucket, capacity, error_rate, count, watermark, bits
+                FROM duplicate_filters
+                WHERE account_id = ? AND source = ?
+                """,
+                (account_id, source),
+            ).fetchone()
+
+    def save_duplicate_filter(
+        self,
+        bucket: int,
+        capacity: int,
+        error_rate: float,
+        count: int,
+        watermark: int,
+        bits: bytes,
+        account_id: int = DEFAULT_ACCOUNT_ID,
+        source: str = "plays",
+    ) -> None:
+        with self.transaction() as conn:
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO duplicate_filters
+                (account_id, source, bucket, capacity, error_rate, count, watermark, bits)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (account_id, source, bucket, capacity, error_rate, count, watermark, bits),
+            )
+
+    def _sync_window(self, conn: sqlite3.Connection, account_id: int) -> Tuple[int, int]:
+        """
+        Capacity and sequence number of the ring buffer of an account, the next row goes to slot seq % capacity.
+
+        A window of another capacity (window_size changed) is resized first: its latest rows are written
+        back from slot 0 and the ones that no longer fit are archived.
+        """
+        row = conn.execute("SELECT capacity, seq FROM sync_windows WHERE account_id = ?", (account_id,)).fetchone()
+        if row is None:
+            conn.execute(
+                "INSERT INTO sync_windows (account_id, capacity, seq) VALUES (?, ?, 0)", (account_id, self.window_size)
+            )
+            return self.window_size, 0
+        if row["capacity"] == self.window_size:
+            return row["capacity"], row["seq"]
+
+        logger.info("Resizing the synced window of account %s to %s scrobbles", account_id, self.window_size)
+        rows = conn.execute(
+            f"""
+            SELECT id, account_id, {", ".join(SCROBBLE_COLUMNS)}
+            FROM scrobbles
+            WHERE account_id = ?
+            ORDER BY id DESC
+            """,
+            (account_id,),
+        ).fetchall()
+        kept = [tuple(row) for row in reversed(rows[: self.window_size])]
+        self._archive_rows(conn, [tuple(row) for row in rows[self.window_size :]])
+        conn.execute("DELETE FROM scrobbles WHERE account_id = ?", (account_id,))
+        conn.executemany(
+            f"""
+            INSERT INTO scrobbles (account_id, slot, id, {", ".join(SCROBBLE_COLUMNS)})
+            VALUES ({", ".join("?" * (len(SCROBBLE_COLUMNS) + 3))})
+            """,
+            ((account_id, slot, row[0], *row[2:]) for slot, row in enumerate(kept)),
+        )
+        conn.execute(
+            "UPDATE sync_windows SET capacity = ?, seq = ? WHERE account_id = ?",
+            (self.window_size, len(kept), account_id),
+        )
+        return self.window_size, len(kept)
+
+    def get_last_id(self, account_id: int = DEFAULT_ACCOUNT_ID, sequence: str = "scrobbles") -> int:
+        """Last id an account reserved from a sequence (see _reserve_ids), 0 if it never did."""
+        with self.transaction() as conn:
+            row = conn.execute(
+                "SELECT value FROM account_sequences WHERE account_id = ? AND name = ?", (account_id, sequence)
+            ).fetchone()
+        return 0 if row is None else row["value"]
+
+    @staticmethod
+    def _reserve_ids(conn: sqlite3.Connection, n: int, account_id: int, sequence: str = "scrobbles") -> range:
+        """
+        Reserve n ids of a sequence for rows of an account: 'scrobbles', shared by the synced window and the
+        archive, or 'lastfm_history'.
+        """
+        last_id = conn.execute(
+            "UPDATE sequences SET value = value + ? WHERE name = ? RETURNING value", (n, sequence)
+        ).fetchone()[0]
+        conn.execute(
+            """
+            INSERT INTO account_sequences (account_id, name, value) VALUES (?, ?, ?)
+            ON CONFLICT (account_id, name) DO UPDATE SET value = excluded.value
+            """,
+            (account_id, sequence, last_id),
+        )
+        return range(last_id - n + 1, last_id + 1)
+
+    def _archive_rows(self, conn: sqlite3.Connection, rows: List[tuple]) -> None:
+        """Store rows of the synced window, as (id, account_id, *SCROBBLE_COLUMNS), in the monthly archive."""
+        # rows stored before timestamps were recorded are archived in the current month
+        now = int(time.time())
+        rows_by_month = defaultdict(list)
+        for row in rows:
+            rows_by_month[_archive_month(row[-1] or now)].append(row)
+
+        for month, month_rows in rows_by_month.items():
+            table = self._ensure_archive_table(conn, month)
+            conn.executemany(
+                f"""
+                INSERT OR IGNORE INTO {self.archive_schema}.{table} (id, account_id, {", ".join(SCROBBLE_COLUMNS)})
+                VALUES ({", ".join("?" * (len(SCROBBLE_COLUMNS) + 2))})
+                """,
+                month_rows,
+            )
+
+    def _archive_months(self, start: Optional[int] = None, end: Optional[int] = None) -> List[str]:
+        """Months of the existing archive tables between start and end (inclusive) if given, latest first."""
+        first_month = _archive_month(start) if start is not None else None
+        last_month = _archive_month(end) if end is not None else None
+
+        with self.transaction() as conn:
+            months = [
+                row["name"][len(ARCHIVE_TABLE_PREFIX) :]
+                for row in conn.execute(
+                    f"SELECT name FROM {self.archive_schema}.sqlite_master WHERE type = 'table' AND name LIKE ?",
+                    (ARCHIVE_TABLE_PREFIX + "%",),
+                )
+            ]
+        return [
+            month
+            for month in sorted(months, reverse=True)
+            if (first_month is None or month >= first_month) and (last_month is None or month <= last_month)
+        ]
+
+    def _ensure_archive_table(self, conn: sqlite3.Connection, month: str) -> str:
+        table = f"{ARCHIVE_TABLE_PREFIX}{month}"
+        if table not in self._archive_tables:
+            conn.execute(
+                f"""
+                CREATE TABLE IF NOT EXISTS {self.archive_schema}.{table} (
+                    id INTEGER PRIMARY KEY,
+                    account_id INTEGER NOT NULL,
+                    video_id TEXT NOT NULL,
+                    title TEXT NOT NULL,
+                    artist TEXT NOT NULL,
+                    album TEXT,
+                    played INTEGER NOT NULL,
+                    timestamp INTEGER
+                )
+                """
+            )
+            conn.execute(
+                f"""
+                CREATE INDEX IF NOT EXISTS {self.archive_schema}.idx_{table}_account_id_video_id
+                ON {table} (account_id, video_id, timestamp)
+                """
+            )
+            self._archive_tables.add(table)
+        return table
+
+    @metrics.timed("db_enqueue_scrobbles")
+    def enqueue_scrobbles(self, tracks: List[Track], account_id: int = DEFAULT_ACCOUNT_ID) -> int:
+        """
+        Add planned scrobbles to the outbox, they are delivered in insertion order.
+
+        Args:
+            tracks: List of tracks, with a timestamp
+            account_id: Account owning the scrobbles
+
+        Returns:
+            Number of enqueued scrobbles
+        """
+        if not tracks:
+            return 0
+
+        with self.transaction() as conn:
+            cursor = conn.executemany(
+                """
+                INSERT INTO outbox (account_id, video_id, title, artist, album, played, timestamp)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                ((account_id, *track) for track in tracks),
+            )
+            return cursor.rowcount
+
+    @metrics.timed("db_fetch_pending_scrobbles")
+    def fetch_pending_scrobbles(self, limit: int, account_id: int = DEFAULT_ACCOUNT_ID) -> List[PendingScrobble]:
+        """
+        Fetch the oldest scrobbles of the outbox that were not acknowledged yet.
+
+        Args:
+            limit: Maximum number of scrobbles to fetch
+            account_id: Account owning the scrobbles
+
+        Returns:
+            Pending scrobbles, oldest first
+        """
+        with self.transaction() as conn:
+            cursor = conn.execute(
+                f"""
+                SELECT id, {", ".join(SCROBBLE_COLUMNS)}
+                FROM outbox
+                WHERE account_id = ? AND acked IS NULL
+                ORDER BY id
+                LIMIT ?
+                """,
+                (account_id, limit),
+            )
+            return [PendingScrobble(row[0], Track._make(row[1:])) for row in cursor.fetchall()]
+
+    def count_pending_scrobbles(self, account_id: int = DEFAULT_ACCOUNT_ID) -> int:
+        with self.transaction() as conn:
+            return conn.execute(
+                "SELECT COUNT(*) FROM outbox WHERE account_id = ? AND acked IS NULL", (account_id,)
+            ).fetchone()[0]
+
+    @metrics.timed("db_ack_scrobbles")
+    def ack_scrobbles(self, outbox_ids: List[int]) -> int:
+        """
+        Mark outbox scrobbles as accepted by Last.fm.
+
+        Args:
+            outbox_ids: Outbox ids of the scrobbles
+
+        Returns:
+            Number of acknowledged scrobbles
+        """
+        with self.transaction() as conn:
+            cursor = conn.executemany(
+                "UPDATE outbox SET acked = ? WHERE id = ? AND acked IS NULL",
+                ((int(time.time()), outbox_id) for outbox_id in outbox_ids),
+            )
+            return cursor.rowcount
+
+    @metrics.timed("db_purge_acked_scrobbles")
+    def purge_acked_scrobbles(self, account_id: int = DEFAULT_ACCOUNT_ID) -> int:
+        """
+        Delete acknowledged scrobbles from the outbox.
+
+        Returns:
+            Number of deleted rows
+        """
+        with self.transaction() as conn:
+            cursor = conn.execute("DELETE FROM outbox WHERE account_id = ? AND acked IS NOT NULL", (account_id,))
+            return cursor.rowcount
+
+    @metrics.timed("db_fetch_latest_scrobbles")
+    def fetch_latest_scrobbles(self, account_id: int = DEFAULT_ACCOUNT_ID) -> List[Track]:
+        """
+        Fetch all scrobbles of the synced window of an account, latest first.
+
+        Args:
+            account_id: Account owning the scrobbles
+
+        Returns:
+            List of tracks
+        """
+        return list(map(Track._make, self.iter_latest_scrobbles(account_id=account_id)))
+
+    def iter_latest_scrobbles(
+        self,
+        columns: Sequence[str] = SCROBBLE_COLUMNS,
+        limit: Optional[int] = None,
+        account_id: int = DEFAULT_ACCOUNT_ID,
+    ) -> Iterator[sqlite3.Row]:
+        """
+        Stream the scrobbles of an account, latest first, reading rows from SQLite only as they are consumed.
+
+        Close the generator (or exhaust it) to release the underlying statement early.
+
+        Args:
+            columns: Columns to select, a subset of SCROBBLE_COLUMNS
+            limit: Maximum number of rows to read, None for all of them
+            account_id: Account owning the scrobbles
+
+        Yields:
+            Rows with the selected columns
+        """
+        unknown = set(columns) - set(SCROBBLE_COLUMNS)
+        if unknown or not columns:
+            raise ValueError(f"Invalid columns: {sorted(unknown) or columns}")
+
+        # no transaction() here: a suspended generator must not hold a transaction open
+        conn = self._tx_conn or self._conn
+        owned = conn is None and not self.persistent
+        if conn is None:
+            conn = self.connect()
+            if self.persistent:
+                self._conn = conn
+
+        try:
+            window = conn.execute(
+                "SELECT capacity, seq FROM sync_windows WHERE account_id = ?", (account_id,)
+            ).fetchone()
+            if window is None:
+                return
+
+            # latest first: the slots below the next one to write, then the ones above, both in primary key order
+            head = window["seq"] % window["capacity"]
+            # a negative LIMIT reads all the rows
+            remaining = -1 if limit is None else limit
+            for condition in ("slot < ?", "slot >= ?"):
+                if remaining == 0:
+                    return
+                cursor = conn.execute(
+                    f"""
+                    SELECT {", ".join(columns)}
+                    FROM scrobbles
+                    WHERE account_id = ? AND {condition}
+                    ORDER BY slot DESC
+                    LIMIT ?
+                    """,
+                    (account_id, head, remaining),
+                )
+                try:
+                    for row in cursor:
+                        yield row
+                        remaining -= 1
+                finally:
+                    cursor.close()
+        finally:
+            if owned:
+                conn.close()
+
+
+def _ring_slots(first: int, count: int, capacity: int) -> str:
+    """SQL condition on the slot column for count consecutive slots of a ring buffer, from slot first % capacity."""
+    if count >= capacity:
+        return "1"
+    first %= capacity
+    last = first + count
+    if last <= capacity:
+        return f"(slot >= {first} AND slot < {last})"
+    return f"(slot >= {first} OR slot < {last - capacity})"
+
+
+def _archive_month(timestamp: int) -> str:
+    """Name suffix of the archive table holding a timestamp, e.g. 202401."""
+    return time.strftime("%Y%m", time.gmtime(timestamp))
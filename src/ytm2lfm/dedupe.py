@@ -0,0 +1,320 @@
+import hashlib
+import logging
+import math
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from ytm2lfm.canonical import match_key
+from ytm2lfm.database import DEFAULT_ACCOUNT_ID, SQLite
+from ytm2lfm.metrics import metrics
+from ytm2lfm.track import Track
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    """
+    Set of strings answering "definitely absent" or "possibly present", in about 1.2 bytes per key for a 1%
+    false positive rate whatever the length of the keys.
+
+    The bit positions of a key are derived from a single BLAKE2b digest by double hashing.
+    """
+
+    def __init__(self, size: int, hashes: int, bits: Optional[bytes] = None):
+        """
+        Args:
+            size: Number of bits
+            hashes: Number of bits set per key
+            bits: Bits of a filter of the same size and hashes, see to_bytes, empty filter if None
+        """
+        if size < 1 or hashes < 1:
+            raise ValueError("size and hashes must be positive integers")
+        self.size = size
+        self.hashes = hashes
+        self.bits = bytearray(bits) if bits is not None else bytearray((size + 7) // 8)
+        if len(self.bits) != (size + 7) // 8:
+            raise ValueError(f"Expected {(size + 7) // 8} bytes of bits, got {len(self.bits)}")
+
+    @classmethod
+    def for_capacity(cls, capacity: int, error_rate: float, bits: Optional[bytes] = None) -> "BloomFilter":
+        """Filter sized to keep the false positive rate at error_rate with up to capacity keys."""
+        if capacity < 1 or not 0 < error_rate < 1:
+            raise ValueError("capacity must be positive and error_rate between 0 and 1")
+        size = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        hashes = max(1, round(size / capacity * math.log(2)))
+        return cls(size, hashes, bits)
+
+    def add(self, key: str) -> None:
+        bits = self.bits
+        position, step = _hash(key)
+        for _ in range(self.hashes):
+            position %= self.size
+            bits[position >> 3] |= 1 << (position & 7)
+            position += step
+
+    def __contains__(self, key: str) -> bool:
+        # most absent keys are told apart by their first bits, stop at the first unset one
+        bits = self.bits
+        position, step = _hash(key)
+        for _ in range(self.hashes):
+            position %= self.size
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+            position += step
+        return True
+
+    def to_bytes(self) -> bytes:
+        return bytes(self.bits)
+
+
+def _hash(key: str) -> Tuple[int, int]:
+    """First bit position and step of a key, from a single 128-bit BLAKE2b digest."""
+    digest = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=16).digest(), "little")
+    # odd step, so that the positions do not cycle early when the size is even
+    return digest >> 64, (digest & 0xFFFFFFFFFFFFFFFF) | 1
+
+
+class DuplicateFilter:
+    """
+    Tell the plays of an account that are already stored, in the synced window or in the archive, without a
+    database probe per play.
+
+    Stored plays are kept in a Bloom filter keyed on (video_id, timestamp // bucket). A play is a duplicate of
+    a stored play of the same video less than bucket seconds apart: the keys of its own and the neighbouring
+    buckets are looked up, "definitely absent" answers skip the database, and only possible hits are confirmed
+    by an indexed query (SQLite.has_play).
+
+    The filter is persisted in the duplicate_filters table with the largest id it covers. refresh() only adds
+    the rows stored above that id, so catching up after an import or a run reads the new rows only. The filter
+    is built for twice the rows stored, and rebuilt from scratch when it outgrows its capacity, or when its
+    settings change.
+
+    Not thread-safe, use it from the thread owning the database.
+    """
+
+    # rows the filter is built from, one persisted filter per account and source, and the sequence of their ids
+    source = "plays"
+    sequence = "scrobbles"
+
+    def __init__(
+        self,
+        db: SQLite,
+        account_id: int = DEFAULT_ACCOUNT_ID,
+        bucket: int = 30,
+        capacity: int = 10_000,
+        error_rate: float = 0.01,
+    ):
+        """
+        Args:
+            db: Database holding the plays and the persisted filter
+            account_id: Account whose plays are filtered
+            bucket: Plays of the same video less than this many seconds apart are duplicates, keep it below
+                    the shortest track duration so that replays are not mistaken for duplicates
+            capacity: Minimum number of rows the filter is sized for, it is built for twice the rows stored
+                      and doubled when exceeded
+            error_rate: Target false positive rate, the share of new plays confirmed in the database for nothing
+        """
+        self.db = db
+        self.account_id = account_id
+        self.bucket = bucket
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.count = 0
+        self.watermark = 0
+        self._bloom: Optional[BloomFilter] = None
+        self._unsaved = 0
+
+    def load(self) -> int:
+        """
+        Load the persisted filter, or build it if missing or stale, then catch up with the new plays.
+
+        Returns:
+            Number of plays added
+        """
+        row = self.db.load_duplicate_filter(self.account_id, self.source)
+        if row is not None and (row["bucket"], row["error_rate"]) == (self.bucket, self.error_rate):
+            # a filter grown past the configured capacity keeps its size
+            self.capacity = max(self.capacity, row["capacity"])
+            if row["capacity"] == self.capacity:
+                self._bloom = self._new_bloom(row["bits"])
+                self.count, self.watermark = row["count"], row["watermark"]
+        if self._bloom is None:
+            self._reset()
+        return self.refresh()
+
+    def refresh(self) -> int:
+        """
+        Add the plays stored since the last refresh.
+
+        Returns:
+            Number of plays added
+        """
+        if self._bloom is None:
+            return self.load()
+
+        # ids are reserved in the transaction storing their rows: the account stored none if it reserved none
+        last_id = self.db.get_last_id(self.account_id, self.sequence)
+        if last_id <= self.watermark:
+            return 0
+        with metrics.span("duplicate_filter_refresh"):
+            added = self.add(self._iter_rows_after(self.watermark))
+        self.watermark = max(self.watermark, last_id)
+        self.db.on_rollback(self._discard)
+        return added
+
+    def add(self, rows: Iterable[Tuple[int, str, int]]) -> int:
+        """
+        Add rows stored above the watermark, as (id, key, timestamp), e.g. the plays just inserted in the
+        transaction that refreshed the filter.
+
+        Returns:
+            Number of rows added
+        """
+        # ids of rows rolled back are reserved again, a watermark past them would skip the rows reusing them
+        self.db.on_rollback(self._discard)
+        added = 0
+        for row_id, key, timestamp in rows:
+            self._bloom.add(self._key(key, timestamp // self.bucket))
+            self.watermark = max(self.watermark, row_id)
+            added += 1
+        self.count += added
+        self._unsaved += added
+
+        if self.count > self.capacity:
+            logger.info("Duplicate filter holds %s plays, rebuilding it for %s", self.count, 2 * self.capacity)
+            self.capacity *= 2
+            self._reset()
+            self.refresh()
+        return added
+
+    def filter_new(self, tracks: Iterable[Track]) -> List[Track]:
+        """Tracks, with a timestamp, that are not duplicates of a stored play."""
+        new = []
+        checked = 0
+        for track in tracks:
+            if self.might_contain(track.video_id, track.timestamp):
+                checked += 1
+                if self.db.has_play(
+                    track.video_id,
+                    track.timestamp - self.bucket + 1,
+                    track.timestamp + self.bucket - 1,
+                    self.account_id,
+                ):
+                    continue
+            new.append(track)
+
+        if checked:
+            metrics.inc("duplicate_filter_checks", checked)
+        return new
+
+    def might_contain(self, key: str, timestamp: int) -> bool:
+        """False if no row of the key (a video ID for plays) less than bucket seconds away from timestamp is stored."""
+        if self._bloom is None:
+            self.load()
+        bucket = timestamp // self.bucket
+        return any(self._key(key, bucket + offset) in self._bloom for offset in (-1, 0, 1))
+
+    def save(self, min_unsaved: int = 1) -> None:
+        """
+        Persist the filter, once at least min_unsaved rows were added since it was last saved: catching up with
+        a few rows on the next load is cheaper than writing the whole filter again.
+        """
+        if self._bloom is None or self._unsaved < min_unsaved:
+            return
+        self.db.save_duplicate_filter(
+            self.bucket,
+            self.capacity,
+            self.error_rate,
+            self.count,
+            self.watermark,
+            self._bloom.to_bytes(),
+            self.account_id,
+            self.source,
+        )
+        self._unsaved = 0
+
+    def _iter_rows_after(self, watermark: int) -> Iterator[Tuple[int, str, int]]:
+        """(id, key, timestamp) of the rows stored with an id above watermark."""
+        return self.db.iter_plays_after(watermark, self.account_id)
+
+    def _count_rows(self) -> int:
+        return self.db.count_plays(self.account_id)
+
+    def _new_bloom(self, bits: Optional[bytes] = None) -> BloomFilter:
+        # a lookup probes the keys of 3 buckets
+        return BloomFilter.for_capacity(self.capacity, self.error_rate / 3, bits)
+
+    def _discard(self) -> None:
+        """Drop the filter, loaded again from its persisted copy, which is rolled back along with the rows."""
+        self._bloom = None
+        self.count = self.watermark = self._unsaved = 0
+
+    def _reset(self) -> None:
+        # sized for the rows of the account rather than a fixed capacity, with room to grow before a rebuild
+        self.capacity = max(self.capacity, 2 * self._count_rows())
+        self._bloom = self._new_bloom()
+        self.count = self.watermark = 0
+        # the persisted filter no longer matches, even if it stays empty
+        self._unsaved = 1
+
+    @staticmethod
+    def _key(key: str, bucket: int) -> str:
+        return f"{key}\0{bucket}"
+
+
+class LastFMDuplicateFilter(DuplicateFilter):
+    """
+    Tell the planned scrobbles of an account that are already on Last.fm, among the scrobbles seeded from
+    Last.fm (see seed.LastFMSeeder), without a database probe per scrobble.
+
+    Same as DuplicateFilter, over the lastfm_history table keyed on the normalised artist and title, with a
+    bucket of the dedupe window: only the scrobbles the filter might hold are confirmed, all of them by a
+    single range query.
+    """
+
+    source = "lastfm"
+    sequence = "lastfm_history"
+
+    def filter_new(self, tracks: Iterable[Track]) -> List[Track]:
+        """Tracks, with a timestamp, with no seeded scrobble of the same names less than bucket seconds away."""
+        tracks = list(tracks)
+        if self._bloom is None and not self.db.get_last_id(self.account_id, self.sequence):
+            # nothing was ever seeded for the account, no filter to build
+            return tracks
+        # seeding loads the scrobbles from another process
+        self.refresh()
+        keys = [self.track_key(match_key(track.artist), match_key(track.title)) for track in tracks]
+        possible = [i for i, (track, key) in enumerate(zip(tracks, keys)) if self.might_contain(key, track.timestamp)]
+        if not possible:
+            return tracks
+
+        metrics.inc("duplicate_filter_checks", len(possible))
+        seeded: Dict[str, List[int]] = {}
+        for artist_key, title_key, timestamp in self.db.fetch_lastfm_history_between(
+            min(tracks[i].timestamp for i in possible) - self.bucket + 1,
+            max(tracks[i].timestamp for i in possible) + self.bucket - 1,
+            self.account_id,
+        ):
+            seeded.setdefault(self.track_key(artist_key, title_key), []).append(timestamp)
+
+        duplicates = set()
+        for i in possible:
+            track = tracks[i]
+            scrobbled = next(
+                (timestamp for timestamp in seeded.get(keys[i], ()) if abs(timestamp - track.timestamp) < self.bucket),
+                None,
+            )
+            if scrobbled is not None:
+                logger.info("Skipping %s - %s, already on Last.fm at %s", track.artist, track.title, scrobbled)
+                duplicates.add(i)
+        return [track for i, track in enumerate(tracks) if i not in duplicates]
+
+    @staticmethod
+    def track_key(artist_key: str, title_key: str) -> str:
+        return f"{artist_key}\0{title_key}"
+
+    def _count_rows(self) -> int:
+        return self.db.count_lastfm_history(self.account_id)
+
+    def _iter_rows_after(self, watermark: int) -> Iterator[Tuple[int, str, int]]:
+        for row_id, artist_key, title_key, timestamp in self.db.iter_lastfm_history_after(watermark, self.account_id):
+            yield row_id, self.track_key(artist_key, title_key), timestamp
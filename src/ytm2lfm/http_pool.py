@@ -0,0 +1,57 @@
+import logging
+from typing import Dict
+
+import pylast
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# pylast uses httpx (or its httpx2 fork, depending on the version), use the very module it was built with
+httpx = pylast.httpx
+
+
+class _SharedTransport(httpx.HTTPTransport):
+    """
+    HTTP transport whose connection pool outlives the clients using it.
+
+    pylast opens and closes an httpx client for every request, which closes its transports;
+    closing is a no-op here so connections are kept alive until shutdown.
+    """
+
+    def __exit__(self, *args) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+    def shutdown(self) -> None:
+        super().close()
+
+
+class HTTPPool:
+    """Keep-alive HTTP connections shared by the YouTube Music and Last.fm clients of all accounts."""
+
+    def __init__(self, max_connections: int = 8):
+        """
+        Args:
+            max_connections: Maximum number of connections kept open per host
+        """
+        self.requests_session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max_connections)
+        self.requests_session.mount("https://", adapter)
+
+        self._transport = _SharedTransport(
+            verify=pylast.SSL_CONTEXT,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+
+    @property
+    def lastfm_mounts(self) -> Dict[str, httpx.HTTPTransport]:
+        """Transports to route pylast requests through the shared pool, passed as its proxy setting."""
+        return {"https://": self._transport}
+
+    def close(self) -> None:
+        self.requests_session.close()
+        self._transport.shutdown()
+        logger.debug("HTTP connection pool closed")
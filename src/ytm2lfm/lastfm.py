@@ -1,37 +1,193 @@
+import json
 import logging
+import os
+import threading
+from typing import Any, Dict, List, Optional, Tuple
 
 import pylast
 
 logger = logging.getLogger(__name__)
 
+# WSError statuses worth retrying: transient service errors and the HTTP 5xx codes pylast reports as WSErrors
+TRANSIENT_STATUSES = frozenset(
+    str(status)
+    for status in (
+        pylast.STATUS_OPERATION_FAILED,
+        pylast.STATUS_OFFLINE,
+        pylast.STATUS_TEMPORARILY_UNAVAILABLE,
+        500,
+        502,
+        503,
+        504,
+    )
+)
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """Whether Last.fm rejected the request because the API rate limit was exceeded (error 29)."""
+    return isinstance(error, pylast.WSError) and str(error.status) == str(pylast.STATUS_RATE_LIMIT_EXCEEDED)
+
+
+def is_transient_error(error: Exception) -> bool:
+    """Whether a failed Last.fm request may succeed if tried again."""
+    if isinstance(error, pylast.WSError):
+        return str(error.status) in TRANSIENT_STATUSES
+    return isinstance(error, (pylast.NetworkError, pylast.MalformedResponseError))
+
+
+class SessionKeyCache:
+    """
+    Last.fm session keys stored in a JSON file readable by the owner only, keyed by API key and username.
+
+    Session keys do not expire, so caching them saves the authentication round trip of every run.
+    A single instance can be shared by the clients of all accounts.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def get(self, api_key: str, username: str) -> Optional[str]:
+        with self._lock:
+            return self._read().get(self._key(api_key, username))
+
+    def set(self, api_key: str, username: str, session_key: Optional[str]) -> None:
+        """Store a session key, or forget it if session_key is None."""
+        with self._lock:
+            entries = self._read()
+            if session_key is None:
+                entries.pop(self._key(api_key, username), None)
+            else:
+                entries[self._key(api_key, username)] = session_key
+
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w") as f:
+                json.dump(entries, f)
+            os.replace(tmp_path, self.path)
+
+    def _read(self) -> Dict[str, str]:
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            logger.warning("Ignoring corrupted Last.fm session cache %s", self.path)
+            return {}
+
+    @staticmethod
+    def _key(api_key: str, username: str) -> str:
+        return f"{api_key}:{username}"
+
 
 class LastFMClient(pylast.LastFMNetwork):
-    """Client for interacting with Last.fm API."""
+    """Client for interacting with Last.fm API, authenticating lazily on the first scrobble."""
 
-    def __init__(self, api_key: str, api_secret: str, username: str, password: str):
+    def __init__(
+        self,
+        api_key: str,
+        api_secret: str,
+        username: str,
+        password: str,
+        mounts: Optional[Dict[str, Any]] = None,
+        session_cache: Optional[SessionKeyCache] = None,
+    ):
         """
-        Initialize and authenticate with Last.fm API.
+        Initialize the Last.fm API client, without any network request.
 
         Args:
             api_key: Last.fm API key
             api_secret: Last.fm API secret
             username: Last.fm username
             password: Last.fm password (will be hashed)
+            mounts: httpx transports by URL scheme to send the requests through, see HTTPPool.lastfm_mounts
+            session_cache: Cache of session keys reused across runs, the session key only lives in memory if None
+        """
+        # pylast authenticates right away when given a password hash, it is only set afterwards
+        super().__init__(api_key=api_key, api_secret=api_secret, username=username, proxy=mounts)
+        self.password_hash = pylast.md5(password)
+        self.session_cache = session_cache
+
+        if session_cache is not None:
+            self.session_key = session_cache.get(api_key, username)
+
+    def authenticate(self) -> None:
+        """
+        Get a new session key from Last.fm and store it in the session cache.
 
         Raises:
             pylast.WSError: If authentication fails
         """
         try:
-            super().__init__(
-                api_key=api_key,
-                api_secret=api_secret,
-                username=username,
-                password_hash=pylast.md5(password),
-            )
-
-            # Verify authentication
-            self.get_authenticated_user()
-            logger.info("LastFM client initialized")
+            self.session_key = pylast.SessionKeyGenerator(self).get_session_key(self.username, self.password_hash)
         except pylast.WSError as e:
             logger.error("Last.fm authentication failed: %s", e)
             raise
+
+        if self.session_cache is not None:
+            self.session_cache.set(self.api_key, self.username, self.session_key)
+        logger.info("LastFM client authenticated")
+
+    def get_correction(self, artist: str, title: str) -> Tuple[str, str]:
+        """
+        Look up the names Last.fm corrects an artist and a track title to, no authentication needed.
+
+        Returns:
+            Corrected artist and title, unchanged if Last.fm has no correction
+        """
+        corrected_artist = pylast.Artist(artist, self).get_correction() or artist
+        corrected_title = pylast.Track(artist, title, self).get_correction() or title
+        return corrected_artist, corrected_title
+
+    def get_recent_tracks(
+        self, limit: Optional[int] = None, time_from: Optional[int] = None, time_to: Optional[int] = None
+    ) -> List[Tuple[str, str, int]]:
+        """
+        Fetch the latest scrobbles of the user in a time range, latest first, no authentication needed.
+
+        pylast asks for one more track than limit, in case the track playing now shows up: up to a limit of
+        199, this is a single request. The track playing now has no timestamp and is left out.
+
+        Args:
+            limit: Maximum number of scrobbles, all the scrobbles of the range if None
+            time_from: Only the scrobbles after this timestamp
+            time_to: Only the scrobbles before this timestamp
+
+        Returns:
+            (artist, title, timestamp) of the scrobbles
+        """
+        played_tracks = pylast.User(self.username, self).get_recent_tracks(
+            limit=limit, cacheable=False, time_from=time_from, time_to=time_to
+        )
+        return [
+            (played.track.artist.name, played.track.title, int(played.timestamp))
+            for played in played_tracks
+            if played.timestamp and played.track.artist.name and played.track.title
+        ]
+
+    def get_registered(self) -> int:
+        """Timestamp of the registration of the user, before any scrobble."""
+        return pylast.User(self.username, self).get_unixtime_registered()
+
+    def scrobble_many(self, tracks) -> None:
+        """
+        Scrobble a batch of tracks, authenticating first if no session key is known yet,
+        and once more if Last.fm rejects the session key.
+        """
+        if not self.session_key:
+            self.authenticate()
+
+        try:
+            super().scrobble_many(tracks)
+        except pylast.WSError as e:
+            if str(e.status) != str(pylast.STATUS_INVALID_SK):
+                raise
+            logger.warning("Last.fm session key rejected, authenticating again")
+            self.session_key = None
+            if self.session_cache is not None:
+                self.session_cache.set(self.api_key, self.username, None)
+            self.authenticate()
+            super().scrobble_many(tracks)
@@ -1,7 +1,30 @@
+import atexit
+import contextvars
+import json
 import logging
 import logging.config
+import logging.handlers
 import sys
-from typing import Any, Dict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+# Context fields (e.g. the account being served) added to every record logged in the current context.
+# Tasks of the event loop get a copy of the context, and the daemon runs its blocking calls in the caller's
+# context, so the fields follow the work of an account across tasks and threads.
+_log_context: contextvars.ContextVar[Dict[str, Any]] = contextvars.ContextVar("log_context", default={})
+
+# Record attributes set by the logging module itself, everything else is an extra field of the record
+_RECORD_ATTRIBUTES = frozenset(logging.makeLogRecord({}).__dict__) | {"message", "asctime", "context"}
+
+
+@contextmanager
+def log_context(**fields: Any) -> Iterator[None]:
+    """Add fields to the records logged in the enclosed block, e.g. `with log_context(account=name):`."""
+    token = _log_context.set({**_log_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _log_context.reset(token)
 
 
 class IncludeLevelFilter:
@@ -20,9 +43,72 @@ class ExcludeLevelFilter:
         return log_record.levelno != self.__level  # Exclude this level
 
 
-def setup_logging() -> None:
+class ContextFilter:
+    """
+    Copy the context fields onto each record, as attributes, and as a "[account=...] " prefix in record.context.
+
+    Must run in the thread logging the record, i.e. on the queue handler and not on the listener's handlers.
+    """
+
+    def filter(self, log_record: logging.LogRecord) -> bool:
+        fields = _log_context.get()
+        for key, value in fields.items():
+            setattr(log_record, key, value)
+        log_record.context = "".join(f"[{key}={value}] " for key, value in fields.items())
+        return True
+
+
+class JSONFormatter(logging.Formatter):
+    """Format records as compact single-line JSON objects, with the context and extra fields as keys."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update(
+            (key, value if isinstance(value, (str, int, float, bool, type(None))) else str(value))
+            for key, value in record.__dict__.items()
+            if key not in _RECORD_ATTRIBUTES
+        )
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, separators=(",", ":"))
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler keeping the records as they are, formatting is left to the listener thread.
+
+    The default handler formats the message in the calling thread, the message is only merged with its
+    arguments here (arguments may change after the call) and tracebacks are rendered to text, as they hold
+    references to frames.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging(json_format: bool = False, queue: bool = True) -> Optional[logging.handlers.QueueListener]:
     """
     Configures the logging for the application. Should be called once at startup.
+
+    Args:
+        json_format: Write records as single-line JSON objects instead of plain text
+        queue: Hand records over to a background thread writing them, so that logging never blocks
+               the event loop or a worker thread on I/O
+
+    Returns:
+        The queue listener writing the records, stopped at exit, None if queue is False
     """
     LOGGING_CONFIG: Dict[str, Any] = {
         "version": 1,
@@ -36,24 +122,28 @@ def setup_logging() -> None:
                 "()": ExcludeLevelFilter,
                 "level": logging.INFO,
             },
+            "context": {
+                "()": ContextFilter,
+            },
         },
         "formatters": {
-            "standard": {"format": "%(asctime)s - %(name)-15s - %(levelname)-8s - %(message)s"},
+            "standard": {"format": "%(asctime)s - %(name)-15s - %(levelname)-8s - %(context)s%(message)s"},
+            "json": {"()": JSONFormatter},
         },
         "handlers": {
             "stdout": {
                 "class": "logging.StreamHandler",
                 "level": "INFO",
-                "formatter": "standard",
+                "formatter": "json" if json_format else "standard",
                 "stream": sys.stdout,
-                "filters": ["info_only"],
+                "filters": ["info_only", "context"],
             },
             "stderr": {
                 "class": "logging.StreamHandler",
                 "level": "DEBUG",
-                "formatter": "standard",
+                "formatter": "json" if json_format else "standard",
                 "stream": sys.stderr,
-                "filters": ["exclude_info"],
+                "filters": ["exclude_info", "context"],
             },
         },
         "loggers": {
@@ -71,4 +161,23 @@ def setup_logging() -> None:
         },
     }
 
+    if queue:
+        # the stream handlers are only used by the listener thread, the context is read in the calling thread
+        for name in ("stdout", "stderr"):
+            LOGGING_CONFIG["handlers"][name]["filters"].remove("context")
+        LOGGING_CONFIG["handlers"]["queue"] = {
+            "class": _QueueHandler,
+            "handlers": ["stdout", "stderr"],
+            "respect_handler_level": True,
+            "filters": ["context"],
+        }
+        LOGGING_CONFIG["loggers"]["ytm2lfm"]["handlers"] = ["queue"]
+
     logging.config.dictConfig(LOGGING_CONFIG)
+
+    if not queue:
+        return None
+    listener = logging.getHandlerByName("queue").listener
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,172 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from ytm2lfm.database import SQLite
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of parameters bound to a single SELECT ... IN (...), below SQLite's default limit
+_MAX_BATCH = 500
+
+
+def parse_duration(duration: Optional[str]) -> Optional[int]:
+    """Parse a YouTube Music duration such as "3:25" or "1:02:03" into seconds, None if it is not valid."""
+    if not duration:
+        return None
+    seconds = 0
+    for part in duration.split(":"):
+        if not part.isdigit():
+            return None
+        seconds = seconds * 60 + int(part)
+    return seconds or None
+
+
+def history_duration(item: Dict[str, Any]) -> Optional[int]:
+    """Duration in seconds of an entry of the raw YouTube Music history, if it has one."""
+    seconds = item.get("duration_seconds")
+    if isinstance(seconds, int) and seconds > 0:
+        return seconds
+    return parse_duration(item.get("duration"))
+
+
+class TrackMetadataCache:
+    """
+    Durations of YouTube Music videos, used to space the timestamps of the tracks scrobbled in a run.
+
+    An in-memory LRU sits in front of the track_metadata table, so durations survive restarts and are
+    shared by all accounts. Entries expire after ttl seconds, both in memory and in the database, and
+    expired rows are deleted by evict_expired(). Lookups of missing durations are left to the caller,
+    get() only reads the cache so it never costs a network request.
+    """
+
+    def __init__(
+        self,
+        db: SQLite,
+        capacity: int = 4096,
+        ttl: float = 30 * 24 * 3600,
+        clock: Callable[[], float] = time.time,
+    ):
+        """
+        Args:
+            db: Database holding the track_metadata table
+            capacity: Maximum number of durations kept in memory
+            ttl: Seconds after which a duration is fetched again
+            clock: Time source in seconds, for tests
+        """
+        self.db = db
+        self.capacity = capacity
+        self.ttl = ttl
+        self.clock = clock
+        self._lru: "OrderedDict[str, Tuple[int, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, video_ids: Iterable[str]) -> Dict[str, int]:
+        """
+        Read the cached durations of videos, from memory first and then from the database in batches.
+
+        Returns:
+            Duration in seconds per video ID, missing and expired videos are left out
+        """
+        now = self.clock()
+        durations = {}
+        misses = []
+        with self._lock:
+            for video_id in dict.fromkeys(video_ids):
+                entry = self._lru.get(video_id)
+                if entry is not None and entry[1] > now:
+                    self._lru.move_to_end(video_id)
+                    durations[video_id] = entry[0]
+                else:
+                    misses.append(video_id)
+
+        if misses:
+            loaded = self._load(misses, now)
+            self._remember(loaded)
+            durations.update((video_id, duration) for video_id, (duration, _) in loaded.items())
+
+        return durations
+
+    def put(self, durations: Dict[str, int]) -> None:
+        """Store durations in seconds per video ID, in memory and in the database."""
+        if not durations:
+            return
+        expires = self.clock() + self.ttl
+        entries = {video_id: (duration, expires) for video_id, duration in durations.items()}
+        with self.db.transaction() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO track_metadata (video_id, duration, expires) VALUES (?, ?, ?)",
+                ((video_id, duration, int(expires)) for video_id, (duration, expires) in entries.items()),
+            )
+        self._remember(entries)
+
+    def evict_expired(self) -> int:
+        """
+        Delete the expired durations from the database.
+
+        Returns:
+            Number of deleted rows
+        """
+        now = self.clock()
+        with self._lock:
+            for video_id in [video_id for video_id, (_, expires) in self._lru.items() if expires <= now]:
+                del self._lru[video_id]
+        with self.db.transaction() as conn:
+            return conn.execute("DELETE FROM track_metadata WHERE expires <= ?", (int(now),)).rowcount
+
+    def _load(self, video_ids: List[str], now: float) -> Dict[str, Tuple[int, float]]:
+        loaded = {}
+        with self.db.transaction() as conn:
+            for start in range(0, len(video_ids), _MAX_BATCH):
+                batch = video_ids[start : start + _MAX_BATCH]
+                rows = conn.execute(
+                    f"""
+                    SELECT video_id, duration, expires
+                    FROM track_metadata
+                    WHERE video_id IN ({", ".join("?" * len(batch))}) AND expires > ?
+                    """,
+                    (*batch, int(now)),
+                )
+                loaded.update((row[0], (row[1], row[2])) for row in rows)
+        return loaded
+
+    def _remember(self, entries: Dict[str, Tuple[int, float]]) -> None:
+        with self._lock:
+            for video_id, entry in entries.items():
+                self._lru[video_id] = entry
+                self._lru.move_to_end(video_id)
+            while len(self._lru) > self.capacity:
+                self._lru.popitem(last=False)
+
+
+def spaced_timestamps(durations: List[int], now: int, floor: Optional[int] = None) -> List[int]:
+    """
+    Back-compute the start timestamps of consecutive plays ending now.
+
+    Args:
+        durations: Duration in seconds of each play, latest first
+        now: End of the latest play
+        floor: Timestamp of the latest play already scrobbled, the plays are squeezed into (floor, now] if needed,
+               down to 1s apart, so that none of them collides with it
+
+    Returns:
+        Timestamps of the plays, latest first and strictly decreasing
+
+    Raises:
+        ValueError: If there are more plays than seconds between floor and now
+    """
+    n = len(durations)
+    if floor is not None and now - floor < n:
+        raise ValueError(f"No room for {n} plays between the latest scrobble at {floor} and {now}")
+
+    timestamps = []
+    timestamp = now
+    for duration in durations:
+        timestamp -= max(duration, 1)
+        timestamps.append(timestamp)
+
+    if floor is not None:
+        timestamps = [min(max(timestamp, floor + n - i), now - i) for i, timestamp in enumerate(timestamps)]
+    return timestamps
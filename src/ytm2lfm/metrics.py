@@ -0,0 +1,218 @@
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, Callable, ContextManager, Dict, Iterator, List, Tuple, TypeVar
+
+logger = logging.getLogger(__name__)
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+PREFIX = "ytm2lfm_"
+
+# Metric name and sorted (label, value) pairs
+_Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+_DISABLED = nullcontext()
+
+
+class Metrics:
+    """
+    Stage timings, counters and gauges of the scrobbling pipeline, exported in the Prometheus text format
+    (textfile or HTTP endpoint) and as a JSON run summary.
+
+    Disabled by default: spans are then a shared no-op context manager and updates return after checking
+    the enabled flag, so the instrumentation costs next to nothing unless an export is configured.
+    Thread-safe, a single instance (`metrics`) is shared by the whole process.
+    """
+
+    def __init__(self, enabled: bool = False, clock: Callable[[], float] = time.perf_counter):
+        self.enabled = enabled
+        self._clock = clock
+        self._lock = threading.Lock()
+        # count, total and maximum seconds per stage
+        self._stages: Dict[str, List[float]] = {}
+        self._counters: Dict[_Key, float] = {}
+        self._gauges: Dict[_Key, float] = {}
+
+    def span(self, stage: str) -> ContextManager[None]:
+        """Time the enclosed block as a run of stage, e.g. `with metrics.span("get_history"):`."""
+        if not self.enabled:
+            return _DISABLED
+        return self._span(stage)
+
+    @contextmanager
+    def _span(self, stage: str) -> Iterator[None]:
+        start = self._clock()
+        try:
+            yield
+        finally:
+            self.observe(stage, self._clock() - start)
+
+    def timed(self, stage: str) -> Callable[[F], F]:
+        """Decorator timing every call of a function as a run of stage."""
+
+        def decorator(func: F) -> F:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                start = self._clock()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.observe(stage, self._clock() - start)
+
+            return wrapper  # type: ignore[return-value]
+
+        return decorator
+
+    def observe(self, stage: str, seconds: float) -> None:
+        """Record a run of stage that took seconds."""
+        if not self.enabled:
+            return
+        with self._lock:
+            stats = self._stages.get(stage)
+            if stats is None:
+                self._stages[stage] = [1, seconds, seconds]
+            else:
+                stats[0] += 1
+                stats[1] += seconds
+                stats[2] = max(stats[2], seconds)
+
+    def inc(self, name: str, value: float = 1, **labels: str) -> None:
+        """Add value to a counter."""
+        if not self.enabled:
+            return
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels: str) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self._gauges[_key(name, labels)] = value
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stages.clear()
+            self._counters.clear()
+            self._gauges.clear()
+
+    def summary(self) -> Dict[str, Any]:
+        """Metrics as a JSON-serialisable dict, counters and gauges keyed by name{label="value"}."""
+        with self._lock:
+            return {
+                "stages": {
+                    stage: {"count": int(count), "seconds": total, "max_seconds": longest}
+                    for stage, (count, total, longest) in sorted(self._stages.items())
+                },
+                "counters": {_format_key(key): value for key, value in sorted(self._counters.items())},
+                "gauges": {_format_key(key): value for key, value in sorted(self._gauges.items())},
+            }
+
+    def render_prometheus(self) -> str:
+        """Metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            if self._stages:
+                lines.append(f"# TYPE {PREFIX}stage_seconds summary")
+                for stage, (count, total, _) in sorted(self._stages.items()):
+                    lines.append(f'{PREFIX}stage_seconds_sum{{stage="{stage}"}} {total:.6f}')
+                    lines.append(f'{PREFIX}stage_seconds_count{{stage="{stage}"}} {int(count)}')
+                lines.append(f"# TYPE {PREFIX}stage_seconds_max gauge")
+                for stage, (_, _, longest) in sorted(self._stages.items()):
+                    lines.append(f'{PREFIX}stage_seconds_max{{stage="{stage}"}} {longest:.6f}')
+            lines.extend(_render(self._counters, "counter", suffix="_total"))
+            lines.extend(_render(self._gauges, "gauge"))
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path: str) -> None:
+        """
+        Write the metrics for the textfile collector of the Prometheus node exporter. The file is replaced
+        atomically, so the collector never reads a partial file.
+        """
+        _write_atomic(path, self.render_prometheus())
+
+    def write_summary(self, path: str) -> None:
+        """Write the JSON run summary."""
+        _write_atomic(path, json.dumps(self.summary(), indent=2) + "\n")
+
+    def serve_http(self, port: int, host: str = "127.0.0.1") -> Any:
+        """
+        Serve the metrics on http://host:port/metrics from a background thread.
+
+        Returns:
+            The HTTP server, stopped with its shutdown() method
+        """
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = metrics.render_prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug("Metrics request: " + format, *args)
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, name="ytm2lfm-metrics", daemon=True).start()
+        logger.info("Serving metrics on http://%s:%s/metrics", host, server.server_address[1])
+        return server
+
+
+def _key(name: str, labels: Dict[str, str]) -> _Key:
+    return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{label}="{value}"' for (label, _), value in zip(labels, escaped)) + "}"
+
+
+def _format_key(key: _Key) -> str:
+    name, labels = key
+    return name + _format_labels(labels)
+
+
+def _render(values: Dict[_Key, float], kind: str, suffix: str = "") -> List[str]:
+    lines = []
+    typed = set()
+    for (name, labels), value in sorted(values.items()):
+        metric = PREFIX + name + suffix
+        if metric not in typed:
+            lines.append(f"# TYPE {metric} {kind}")
+            typed.add(metric)
+        lines.append(f"{metric}{_format_labels(labels)} {_format_value(value)}")
+    return lines
+
+
+def _format_value(value: float) -> str:
+    # counters of bytes would lose digits in the exponent notation of :g
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _write_atomic(path: str, content: str) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+# Shared by the whole process, enabled by the CLI when an export is configured
+metrics = Metrics()
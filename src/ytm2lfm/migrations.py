@@ -0,0 +1,288 @@
+import logging
+import sqlite3
+from typing import List
+
+logger = logging.getLogger(__name__)
+
+# Forward-only schema migrations. Migration N (1-based) upgrades a database from
+# PRAGMA user_version N - 1 to N. Never edit a released migration, append a new one.
+MIGRATIONS: List[List[str]] = [
+    # 1: initial schema, a no-op for databases created before versioning
+    [
+        """
+        CREATE TABLE IF NOT EXISTS scrobbles (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            video_id TEXT NOT NULL,
+            title TEXT NOT NULL,
+            artist TEXT NOT NULL,
+            album TEXT,
+            played INTEGER NOT NULL
+        )
+        """,
+    ],
+    # 2: scrobble timestamp, lookup indexes and duplicate detection
+    [
+        "ALTER TABLE scrobbles ADD COLUMN timestamp INTEGER",
+        "CREATE INDEX IF NOT EXISTS idx_scrobbles_video_id ON scrobbles (video_id)",
+        "CREATE INDEX IF NOT EXISTS idx_scrobbles_timestamp ON scrobbles (timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_scrobbles_artist_title ON scrobbles (artist, title)",
+        # rows without a timestamp (inserted before this migration) never conflict, NULLs are distinct
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_scrobbles_video_id_timestamp ON scrobbles (video_id, timestamp)",
+    ],
+    # 3: accounts, existing scrobbles belong to the default account
+    [
+        """
+        CREATE TABLE IF NOT EXISTS accounts (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE
+        )
+        """,
+        "INSERT OR IGNORE INTO accounts (id, name) VALUES (1, 'default')",
+        "ALTER TABLE scrobbles ADD COLUMN account_id INTEGER NOT NULL DEFAULT 1",
+        "CREATE INDEX IF NOT EXISTS idx_scrobbles_account_id ON scrobbles (account_id, id)",
+        "DROP INDEX IF EXISTS idx_scrobbles_video_id_timestamp",
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_scrobbles_account_id_video_id_timestamp
+        ON scrobbles (account_id, video_id, timestamp)
+        """,
+    ],
+    # 4: outbox of planned scrobbles, acked is set once Last.fm accepted them
+    [
+        """
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            account_id INTEGER NOT NULL,
+            video_id TEXT NOT NULL,
+            title TEXT NOT NULL,
+            artist TEXT NOT NULL,
+            album TEXT,
+            played INTEGER NOT NULL,
+            timestamp INTEGER NOT NULL,
+            acked INTEGER
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_outbox_pending ON outbox (account_id, id) WHERE acked IS NULL",
+    ],
+    # 5: cache of track durations shared by all accounts, rows expire at the expires timestamp
+    [
+        """
+        CREATE TABLE IF NOT EXISTS track_metadata (
+            video_id TEXT PRIMARY KEY,
+            duration INTEGER NOT NULL,
+            expires INTEGER NOT NULL
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_track_metadata_expires ON track_metadata (expires)",
+    ],
+    # 6: memo of canonical track names, keyed by the version of the rules and the raw names
+    [
+        """
+        CREATE TABLE IF NOT EXISTS canonical_names (
+            version TEXT NOT NULL,
+            raw_artist TEXT NOT NULL,
+            raw_title TEXT NOT NULL,
+            raw_album TEXT NOT NULL,
+            artist TEXT NOT NULL,
+            title TEXT NOT NULL,
+            album TEXT NOT NULL,
+            PRIMARY KEY (version, raw_artist, raw_title, raw_album)
+        ) WITHOUT ROWID
+        """,
+    ],
+    # 7: resumable imports, the byte offset reached in each source file and the cut-off of the import
+    [
+        """
+        CREATE TABLE IF NOT EXISTS import_checkpoints (
+            account_id INTEGER NOT NULL,
+            source TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            offset INTEGER NOT NULL,
+            before INTEGER,
+            PRIMARY KEY (account_id, source)
+        ) WITHOUT ROWID
+        """,
+    ],
+    # 8: scrobbles seeded from Last.fm, keyed on the normalised names to find duplicates of planned scrobbles
+    [
+        """
+        CREATE TABLE IF NOT EXISTS lastfm_history (
+            account_id INTEGER NOT NULL,
+            artist_key TEXT NOT NULL,
+            title_key TEXT NOT NULL,
+            timestamp INTEGER NOT NULL,
+            PRIMARY KEY (account_id, artist_key, title_key, timestamp)
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_lastfm_history_timestamp ON lastfm_history (account_id, timestamp)",
+    ],
+    # 9: persisted Bloom filters of the stored plays, up to date with the rows up to the watermark id
+    [
+        """
+        CREATE TABLE IF NOT EXISTS duplicate_filters (
+            account_id INTEGER PRIMARY KEY,
+            bucket INTEGER NOT NULL,
+            capacity INTEGER NOT NULL,
+            error_rate REAL NOT NULL,
+            count INTEGER NOT NULL,
+            watermark INTEGER NOT NULL,
+            bits BLOB NOT NULL
+        )
+        """,
+    ],
+    # 10: the synced window becomes a ring buffer per account, rewritten in place at slot = seq % capacity.
+    # Row ids move to their own sequence, the window takes the capacity of its current rows and is resized
+    # to the configured one on its next write.
+    [
+        "CREATE TABLE IF NOT EXISTS sequences (name TEXT PRIMARY KEY, value INTEGER NOT NULL) WITHOUT ROWID",
+        """
+        INSERT INTO sequences (name, value)
+        SELECT 'scrobbles', COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'scrobbles'), 0)
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS sync_windows (
+            account_id INTEGER PRIMARY KEY,
+            capacity INTEGER NOT NULL,
+            seq INTEGER NOT NULL
+        )
+        """,
+        """
+        INSERT INTO sync_windows (account_id, capacity, seq)
+        SELECT account_id, COUNT(*), COUNT(*) FROM scrobbles GROUP BY account_id
+        """,
+        """
+        CREATE TABLE scrobbles_ring (
+            account_id INTEGER NOT NULL,
+            slot INTEGER NOT NULL,
+            id INTEGER NOT NULL,
+            video_id TEXT NOT NULL,
+            title TEXT NOT NULL,
+            artist TEXT NOT NULL,
+            album TEXT,
+            played INTEGER NOT NULL,
+            timestamp INTEGER,
+            PRIMARY KEY (account_id, slot)
+        ) WITHOUT ROWID
+        """,
+        """
+        INSERT INTO scrobbles_ring (account_id, slot, id, video_id, title, artist, album, played, timestamp)
+        SELECT account_id, ROW_NUMBER() OVER (PARTITION BY account_id ORDER BY id) - 1, id,
+               video_id, title, artist, album, played, timestamp
+        FROM scrobbles
+        """,
+        "DROP TABLE scrobbles",
+        "ALTER TABLE scrobbles_ring RENAME TO scrobbles",
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_scrobbles_account_id_video_id_timestamp
+        ON scrobbles (account_id, video_id, timestamp)
+        """,
+        # the lookup indexes went with the old table, scoped to the account now that the key starts with it
+        "CREATE INDEX IF NOT EXISTS idx_scrobbles_account_id_timestamp ON scrobbles (account_id, timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_scrobbles_account_id_artist_title ON scrobbles (account_id, artist, title)",
+        "CREATE INDEX IF NOT EXISTS idx_scrobbles_id ON scrobbles (id)",
+    ],
+    # 11: one persisted Bloom filter per account and source, the stored plays or the scrobbles seeded from Last.fm.
+    # Seeded scrobbles get ids from their own sequence, so that a filter catches up with the new ones only.
+    [
+        """
+        CREATE TABLE duplicate_filters_by_source (
+            account_id INTEGER NOT NULL,
+            source TEXT NOT NULL,
+            bucket INTEGER NOT NULL,
+            capacity INTEGER NOT NULL,
+            error_rate REAL NOT NULL,
+            count INTEGER NOT NULL,
+            watermark INTEGER NOT NULL,
+            bits BLOB NOT NULL,
+            PRIMARY KEY (account_id, source)
+        )
+        """,
+        """
+        INSERT INTO duplicate_filters_by_source
+        SELECT account_id, 'plays', bucket, capacity, error_rate, count, watermark, bits FROM duplicate_filters
+        """,
+        "DROP TABLE duplicate_filters",
+        "ALTER TABLE duplicate_filters_by_source RENAME TO duplicate_filters",
+        """
+        CREATE TABLE lastfm_history_ids (
+            account_id INTEGER NOT NULL,
+            artist_key TEXT NOT NULL,
+            title_key TEXT NOT NULL,
+            timestamp INTEGER NOT NULL,
+            id INTEGER NOT NULL,
+            PRIMARY KEY (account_id, artist_key, title_key, timestamp)
+        ) WITHOUT ROWID
+        """,
+        """
+        INSERT INTO lastfm_history_ids (account_id, artist_key, title_key, timestamp, id)
+        SELECT account_id, artist_key, title_key, timestamp, ROW_NUMBER() OVER (ORDER BY account_id, timestamp)
+        FROM lastfm_history
+        """,
+        "DROP TABLE lastfm_history",
+        "ALTER TABLE lastfm_history_ids RENAME TO lastfm_history",
+        "CREATE INDEX IF NOT EXISTS idx_lastfm_history_timestamp ON lastfm_history (account_id, timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_lastfm_history_id ON lastfm_history (account_id, id)",
+        "INSERT INTO sequences (name, value) SELECT 'lastfm_history', COUNT(*) FROM lastfm_history",
+    ],
+    # 12: last id each account reserved from each sequence, so that the filters of an account only catch up
+    # when it stored rows. Existing accounts start at the current value, an upper bound of their ids.
+    [
+        """
+        CREATE TABLE IF NOT EXISTS account_sequences (
+            account_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            value INTEGER NOT NULL,
+            PRIMARY KEY (account_id, name)
+        ) WITHOUT ROWID
+        """,
+        """
+        INSERT INTO account_sequences (account_id, name, value)
+        SELECT accounts.id, sequences.name, sequences.value FROM accounts, sequences
+        """,
+    ],
+    # 13: earliest scrobble inserted in the synced window of each account, the plays stored since were handled
+    # by the runs. Windows that already wrapped around only know their current earliest scrobble.
+    [
+        "ALTER TABLE sync_windows ADD COLUMN first_timestamp INTEGER",
+        """
+        UPDATE sync_windows
+        SET first_timestamp = (
+            SELECT MIN(timestamp) FROM scrobbles WHERE scrobbles.account_id = sync_windows.account_id
+        )
+        """,
+    ],
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """
+    Apply all pending migrations, each one in its own transaction.
+
+    Args:
+        conn: Connection to the database to upgrade, with no transaction in progress
+
+    Returns:
+        Number of migrations applied
+    """
+    current = get_schema_version(conn)
+    if current > SCHEMA_VERSION:
+        raise RuntimeError(f"Database schema version {current} is newer than the latest known version {SCHEMA_VERSION}")
+
+    for version in range(current + 1, SCHEMA_VERSION + 1):
+        conn.execute("BEGIN")
+        try:
+            for statement in MIGRATIONS[version - 1]:
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        logger.info("Applied database migration %s", version)
+
+    return SCHEMA_VERSION - current
@@ -0,0 +1,77 @@
+import json
+import os
+from typing import Dict, List, NamedTuple, Optional
+
+from ytm2lfm.canonical import Names
+from ytm2lfm.track import Track
+
+PLAN_VERSION = 1
+
+
+class AccountPlan(NamedTuple):
+    """
+    Scrobbles planned for an account from a fetched history, applied later without fetching it again.
+
+    Everything a run computes with network calls is kept: the new tracks, the durations looked up to space
+    their timestamps and their canonical names. The timestamps themselves are stamped when the plan is applied.
+    """
+
+    account: str
+    # fingerprint of the planned history, recorded as processed once the plan is applied
+    fingerprint: str
+    # fingerprint of the last processed history and high-water mark of the database (see
+    # SQLite.get_high_water_mark) when planned: a plan is stale once either one moved
+    last_processed: Optional[str]
+    high_water_mark: int
+    # latest first, as returned by Scrobbler.get_tracks_to_scrobble
+    tracks: List[Track]
+    durations: Dict[str, int]
+    names: Dict[Names, Names]
+
+
+def write_plan(path: str, plans: List[AccountPlan]) -> None:
+    """Write the plans of a run as a compact JSON file, replaced atomically."""
+    content = {
+        "version": PLAN_VERSION,
+        "accounts": [
+            {
+                "account": plan.account,
+                "fingerprint": plan.fingerprint,
+                "last_processed": plan.last_processed,
+                "high_water_mark": plan.high_water_mark,
+                "tracks": [list(track[:5]) for track in plan.tracks],
+                "durations": plan.durations,
+                "names": [[*raw, *names] for raw, names in plan.names.items()],
+            }
+            for plan in plans
+        ],
+    }
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(content, f, separators=(",", ":"), ensure_ascii=False)
+    os.replace(path + ".tmp", path)
+
+
+def read_plan(path: str) -> List[AccountPlan]:
+    """
+    Read the plans written by write_plan.
+
+    Raises:
+        ValueError: If the file is not a plan of a supported version
+    """
+    with open(path, encoding="utf-8") as f:
+        content = json.load(f)
+    if not isinstance(content, dict) or content.get("version") != PLAN_VERSION:
+        raise ValueError(f"{path} is not a plan of version {PLAN_VERSION}")
+
+    return [
+        AccountPlan(
+            account=plan["account"],
+            fingerprint=plan["fingerprint"],
+            last_processed=plan["last_processed"],
+            high_water_mark=plan["high_water_mark"],
+            tracks=[Track(*track) for track in plan["tracks"]],
+            durations=plan["durations"],
+            names={tuple(names[:3]): tuple(names[3:]) for names in plan["names"]},
+        )
+        for plan in content["accounts"]
+    ]
@@ -0,0 +1,143 @@
+import logging
+import random
+import threading
+import time
+from typing import Callable, Optional, TypeVar
+
+from ytm2lfm.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+R = TypeVar("R")
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket with AIMD rate adaptation.
+
+    The bucket refills at `rate` tokens per second up to `burst` tokens, so short runs go through
+    without any delay while long backfills are paced. Each success raises the rate additively up
+    to `max_rate`, each rate-limit error halves it (down to `min_rate`), converging on the highest
+    throughput the API actually allows. A single instance can be shared by every account of a process.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: int,
+        min_rate: float = 0.1,
+        max_rate: Optional[float] = None,
+        increase: float = 0.1,
+        decrease: float = 0.5,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        """
+        Args:
+            rate: Initial number of tokens added per second
+            burst: Maximum number of tokens in the bucket
+            min_rate: Lower bound of the rate when backing off
+            max_rate: Upper bound of the rate when recovering, defaults to the initial rate
+            increase: Tokens per second added to the rate after each success
+            decrease: Factor applied to the rate after each rate-limit error
+            clock: Monotonic clock, in seconds
+            sleep: Function used to wait for tokens
+        """
+        if rate <= 0 or burst < 1:
+            raise ValueError("rate must be positive and burst at least 1")
+
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min(min_rate, rate)
+        self.max_rate = rate if max_rate is None else max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = float(burst)
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """
+        Take one token, waiting until it is available.
+
+        Returns:
+            Number of seconds spent waiting
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                wait = (1 - self._tokens) / self.rate
+            self._sleep(wait)
+            waited += wait
+
+    def on_success(self) -> None:
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_rate_limited(self) -> None:
+        with self._lock:
+            self._refill()
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self._tokens = 0.0
+        logger.warning("Rate limited, slowing down to %.2f requests per second", self.rate)
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+
+def call_with_retries(
+    func: Callable[[], R],
+    limiter: TokenBucket,
+    is_rate_limited: Callable[[Exception], bool],
+    is_transient: Callable[[Exception], bool],
+    max_retries: int = 5,
+    base_delay: float = 1.0,
+    max_delay: float = 60.0,
+    sleep: Callable[[float], None] = time.sleep,
+) -> R:
+    """
+    Call func once a token is available, retrying rate-limit and transient errors with
+    exponential backoff and full jitter.
+
+    Args:
+        func: Function performing a single request
+        limiter: Token bucket pacing the requests
+        is_rate_limited: Tells whether an error means the API rate limit was exceeded
+        is_transient: Tells whether an error may succeed if tried again
+        max_retries: Maximum number of retries after the first attempt
+        base_delay: Backoff delay of the first retry, in seconds
+        max_delay: Upper bound of the backoff delay, in seconds
+        sleep: Function used to wait between attempts
+
+    Returns:
+        The result of func
+    """
+    attempt = 0
+    while True:
+        waited = limiter.acquire()
+        if waited:
+            metrics.observe("rate_limit_wait", waited)
+        try:
+            result = func()
+        except Exception as e:
+            rate_limited = is_rate_limited(e)
+            if rate_limited:
+                limiter.on_rate_limited()
+            if attempt >= max_retries or not (rate_limited or is_transient(e)):
+                raise
+            delay = random.uniform(0, min(max_delay, base_delay * 2**attempt))
+            attempt += 1
+            metrics.inc("retries", reason="rate_limit" if rate_limited else "transient")
+            logger.warning("Request failed (%s), retry %s/%s in %.1fs", e, attempt, max_retries, delay)
+            sleep(delay)
+        else:
+            limiter.on_success()
+            return result
@@ -0,0 +1,117 @@
+from enum import Enum
+from typing import Hashable, List, Optional, Sequence, Tuple, TypeVar
+
+T = TypeVar("T", bound=Hashable)
+
+
+class HistoryChange(str, Enum):
+    NEW = "new"
+    REPLAY = "replay"
+    UNCHANGED = "unchanged"
+
+
+def myers_diff(old: Sequence[T], new: Sequence[T], max_cost: Optional[int] = None) -> Optional[List[Tuple[int, int]]]:
+    """
+    Compute the longest common subsequence of two sequences with Myers' O((N + M) * D) diff algorithm.
+
+    Args:
+        old: Previous sequence
+        new: Current sequence
+        max_cost: Maximum number of insertions plus deletions to explore. None means unbounded.
+
+    Returns:
+        List of matched (old_index, new_index) pairs in increasing order, or None if the
+        edit script between both sequences costs more than max_cost.
+    """
+    n, m = len(old), len(new)
+    max_d = n + m if max_cost is None else min(max_cost, n + m)
+
+    # v[k + offset] is the furthest x reached on diagonal k = x - y
+    offset = max_d + 1
+    v = [0] * (2 * max_d + 3)
+    trace: List[List[int]] = []
+
+    for d in range(max_d + 1):
+        # keep the diagonals d - 1 can reach, which is all the backtracking needs
+        trace.append(v[offset - d - 1 : offset + d + 2])
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[offset + k - 1] < v[offset + k + 1]):
+                x = v[offset + k + 1]
+            else:
+                x = v[offset + k - 1] + 1
+            y = x - k
+            while x < n and y < m and old[x] == new[y]:
+                x += 1
+                y += 1
+            v[offset + k] = x
+            if x >= n and y >= m:
+                return _backtrack(trace, x, y)
+
+    return None
+
+
+def _backtrack(trace: List[List[int]], x: int, y: int) -> List[Tuple[int, int]]:
+    matches: List[Tuple[int, int]] = []
+    for d in range(len(trace) - 1, 0, -1):
+        v = trace[d]
+        k = x - y
+        # v holds diagonals -d - 1 .. d + 1
+        if k == -d or (k != d and v[k - 1 + d + 1] < v[k + 1 + d + 1]):
+            prev_k = k + 1
+        else:
+            prev_k = k - 1
+        prev_x = v[prev_k + d + 1]
+        prev_y = prev_x - prev_k
+        while x > prev_x and y > prev_y:
+            x -= 1
+            y -= 1
+            matches.append((x, y))
+        x, y = prev_x, prev_y
+
+    while x > 0 and y > 0:
+        x -= 1
+        y -= 1
+        matches.append((x, y))
+
+    matches.reverse()
+    return matches
+
+
+def reconcile_history(
+    history_list: Sequence[T], snapshot_list: Sequence[T], max_cost: Optional[int] = None
+) -> Optional[List[HistoryChange]]:
+    """
+    Classify every entry of the current history by diffing it against the last stored snapshot.
+
+    Entries kept in order from the snapshot are unchanged. Entries that are not part of the
+    common subsequence are new tracks, or replays when the same track was already in the snapshot
+    (YouTube Music moves a replayed track to the top of the history). History entries older than
+    the oldest matched entry fall outside the stored window and are reported as unchanged.
+
+    Args:
+        history_list: Track identifiers from recent history, latest first
+        snapshot_list: Track identifiers from the last stored snapshot, latest first
+        max_cost: Maximum diff cost (insertions plus deletions) to explore
+
+    Returns:
+        One HistoryChange per history entry, or None if the diff is more expensive than max_cost
+    """
+    # YouTube Music only adds entries on top: diffing oldest first keeps the older entries matched when the
+    # common subsequence has ties, so a replayed track is the one reported rather than the one it moved past
+    matches = myers_diff(snapshot_list[::-1], history_list[::-1], max_cost)
+    if matches is None:
+        return None
+
+    if not matches:
+        return [HistoryChange.NEW] * len(history_list)
+
+    changes = [HistoryChange.UNCHANGED] * len(history_list)
+    last = len(history_list) - 1
+    matched = {last - j for _, j in matches}
+    snapshot_ids = set(snapshot_list)
+
+    for j in range(last - matches[0][1]):
+        if j not in matched:
+            changes[j] = HistoryChange.REPLAY if history_list[j] in snapshot_ids else HistoryChange.NEW
+
+    return changes
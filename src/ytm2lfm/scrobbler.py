@@ -1,74 +1,248 @@
 import logging
 import time
-from typing import Any, Dict, List
+from contextlib import closing
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Iterator, List, Optional
 
-from ytm2lfm.database import SQLite
-from ytm2lfm.lastfm import LastFMClient
+from ytm2lfm.canonical import Canonicalizer, Names
+from ytm2lfm.database import DEFAULT_ACCOUNT_ID, SQLite
+from ytm2lfm.dedupe import DuplicateFilter, LastFMDuplicateFilter
+from ytm2lfm.lastfm import LastFMClient, is_rate_limit_error, is_transient_error
+from ytm2lfm.metadata import TrackMetadataCache, history_duration, spaced_timestamps
+from ytm2lfm.metrics import metrics
+from ytm2lfm.ratelimit import TokenBucket, call_with_retries
+from ytm2lfm.reconcile import HistoryChange, reconcile_history
+from ytm2lfm.track import PendingScrobble, Track
 from ytm2lfm.utils import find_overlap_start_index
 from ytm2lfm.ytmusic import YTMusicClient
 
+if TYPE_CHECKING:
+    from ytm2lfm.config import DedupeSettings, ScrobblerSettings
+
 logger = logging.getLogger(__name__)
 
+# New rows a duplicate filter catches up with on its next load before a run writes it again
+FILTER_SAVE_THRESHOLD = 1000
+
 
 class Scrobbler:
     def __init__(
-        self, lastfm_client: LastFMClient, ytmusic_client: YTMusicClient, database: SQLite, min_overlap_length: int = 50
+        self,
+        lastfm_client: Optional[LastFMClient],
+        ytmusic_client: Optional[YTMusicClient],
+        database: SQLite,
+        min_overlap_length: int = 50,
+        reconcile_mode: str = "overlap",
+        max_diff_cost: int = 400,
+        account_id: int = DEFAULT_ACCOUNT_ID,
+        max_synced_tracks: int = 200,
+        rate_limiter: Optional[TokenBucket] = None,
+        max_retries: int = 5,
+        metadata_cache: Optional[TrackMetadataCache] = None,
+        default_duration: int = 180,
+        max_duration_lookups: int = 20,
+        canonicalizer: Optional[Canonicalizer] = None,
+        dedupe_window: int = 1800,
+        duplicate_filter: Optional[DuplicateFilter] = None,
+        lastfm_duplicate_filter: Optional[LastFMDuplicateFilter] = None,
     ):
         """
         Initialize the Scrobbler with necessary clients and configuration.
 
         Args:
-            lastfm_client: Authenticated Last.fm client
-            ytmusic_client: Authenticated YouTube Music client
+            lastfm_client: Authenticated Last.fm client, can be attached later (before delivering scrobbles)
+            ytmusic_client: Authenticated YouTube Music client, can be attached later (before fetching history)
             database: SQLite database instance
             min_overlap_length: Minimum number of matching tracks required to detect an overlap
+            reconcile_mode: "overlap" to scrobble the history before the first overlap with the database,
+                            "diff" to diff the history against the database and also scrobble replays
+            max_diff_cost: Maximum edit cost explored by the "diff" mode before falling back to "overlap"
+            account_id: Database account the scrobbles are stored under
+            max_synced_tracks: Number of latest scrobbles kept in the database and read to detect new tracks
+            rate_limiter: Token bucket pacing Last.fm requests, share one instance between all accounts of a process.
+                          Defaults to 5 requests per second with a burst of 5.
+            max_retries: Maximum number of retries of a batch on rate-limit and transient Last.fm errors
+            metadata_cache: Cache of track durations used to space the scrobble timestamps, share one instance
+                            between all accounts of a process. Defaults to a cache backed by the database.
+            default_duration: Duration in seconds assumed for the tracks whose duration is unknown
+            max_duration_lookups: Maximum number of durations looked up on YouTube Music per run
+            canonicalizer: Normalisation of the track names before they are stored and scrobbled, share one
+                           instance between all accounts of a process. Defaults to the default rules only.
+            dedupe_window: Seconds around a planned scrobble in which a scrobble of the same track seeded from
+                           Last.fm (see seed.LastFMSeeder) marks it as a duplicate, 0 disables the check
+            duplicate_filter: Filter of the plays stored for the account, so that recording the tracks only
+                              looks up the ones it might hold. Defaults to a filter with the default settings.
+            lastfm_duplicate_filter: Filter of the scrobbles seeded from Last.fm for the account, with a bucket
+                                     of dedupe_window + 1. Defaults to a filter with the default settings.
         """
+        if reconcile_mode not in ("overlap", "diff"):
+            raise ValueError(f"Unknown reconcile mode: {reconcile_mode}")
+
         self.lastfm = lastfm_client
         self.ytmusic = ytmusic_client
         self.db = database
         self.min_overlap_length = min_overlap_length
+        self.reconcile_mode = reconcile_mode
+        self.max_diff_cost = max_diff_cost
+        self.account_id = account_id
+        self.max_synced_tracks = max_synced_tracks
+        self.rate_limiter = rate_limiter or TokenBucket(rate=5, burst=5)
+        self.max_retries = max_retries
+        self.metadata = metadata_cache or TrackMetadataCache(database)
+        self.default_duration = default_duration
+        self.max_duration_lookups = max_duration_lookups
+        self.canonicalizer = canonicalizer or Canonicalizer(database)
+        self.dedupe_window = dedupe_window
+        self.duplicates = duplicate_filter or DuplicateFilter(database, account_id)
+        self.lastfm_duplicates = lastfm_duplicate_filter or LastFMDuplicateFilter(
+            database, account_id, bucket=dedupe_window + 1
+        )
+        # durations carried by the last parsed history, only cached for the tracks actually scrobbled
+        self._history_durations: Dict[str, int] = {}
 
-    def get_tracks_to_scrobble(self) -> List[Dict[str, Any]]:
+    @classmethod
+    def from_settings(
+        cls,
+        database: SQLite,
+        settings: "ScrobblerSettings",
+        account_id: int,
+        lastfm_client: Optional[LastFMClient] = None,
+        ytmusic_client: Optional[YTMusicClient] = None,
+        rate_limiter: Optional[TokenBucket] = None,
+        metadata_cache: Optional[TrackMetadataCache] = None,
+        canonicalizer: Optional[Canonicalizer] = None,
+        dedupe_settings: Optional["DedupeSettings"] = None,
+    ) -> "Scrobbler":
+        """Scrobbler of an account configured from the scrobbler settings, shared by the CLI and the daemon."""
+        duplicate_filter = lastfm_duplicate_filter = None
+        if dedupe_settings is not None:
+            duplicate_filter = DuplicateFilter(
+                database,
+                account_id,
+                bucket=dedupe_settings.bucket,
+                capacity=dedupe_settings.capacity,
+                error_rate=dedupe_settings.error_rate,
+            )
+            lastfm_duplicate_filter = LastFMDuplicateFilter(
+                database,
+                account_id,
+                bucket=settings.dedupe_window + 1,
+                capacity=dedupe_settings.capacity,
+                error_rate=dedupe_settings.error_rate,
+            )
+        return cls(
+            lastfm_client,
+            ytmusic_client,
+            database,
+            min_overlap_length=settings.sequence_match_length,
+            reconcile_mode=settings.reconcile_mode,
+            max_diff_cost=settings.max_diff_cost,
+            account_id=account_id,
+            max_synced_tracks=settings.max_synced_tracks,
+            rate_limiter=rate_limiter,
+            max_retries=settings.max_retries,
+            metadata_cache=metadata_cache,
+            default_duration=settings.default_duration,
+            max_duration_lookups=settings.max_duration_lookups,
+            canonicalizer=canonicalizer,
+            dedupe_window=settings.dedupe_window,
+            duplicate_filter=duplicate_filter,
+            lastfm_duplicate_filter=lastfm_duplicate_filter,
+        )
+
+    def get_tracks_to_scrobble(
+        self, history: Optional[List[Dict[str, Any]]] = None, scrobbled_ids: Optional[Iterable[str]] = None
+    ) -> List[Track]:
         """
         Determine which tracks need to be scrobbled by comparing YouTube Music history
         with previously scrobbled tracks.
 
+        Args:
+            history: Raw YouTube Music history already fetched, fetched from YouTube Music if not provided
+            scrobbled_ids: Video IDs of the latest scrobbles already read, latest first,
+                           streamed from the database if not provided
+
         Returns:
             List of tracks that need to be scrobbled (the new tracks not previously scrobbled)
         """
         # Get recent tracks from YT Music
-        tracks_history = self._get_recently_played()
+        tracks_history = self._get_recently_played(history)
 
         # Ensure we have enough history for overlap detection
         if len(tracks_history) < self.min_overlap_length:
             logger.warning(
-                f"Not enough YT Music history. Found {len(tracks_history)} entries "
-                f"but need at least {self.min_overlap_length}"
+                "Not enough YT Music history. Found %s entries but need at least %s",
+                len(tracks_history),
+                self.min_overlap_length,
             )
             return []
 
-        # Get already scrobbled tracks from database
-        tracks_scrobbled = self.db.fetch_latest_scrobbles()
+        with metrics.span("detect_new_tracks"):
+            tracks_to_scrobble = self._detect_new_tracks(tracks_history, scrobbled_ids)
+        metrics.inc("new_tracks", len(tracks_to_scrobble))
+        return tracks_to_scrobble
 
-        # Find where the history starts to overlap with already scrobbled tracks
-        overlap_idx = find_overlap_start_index(
-            [track["video_id"] for track in tracks_history],
-            [track["video_id"] for track in tracks_scrobbled],
-            self.min_overlap_length,
-        )
+    def _detect_new_tracks(self, tracks_history: List[Track], scrobbled_ids: Optional[Iterable[str]]) -> List[Track]:
+        history_ids = [track.video_id for track in tracks_history]
+
+        if self.reconcile_mode == "diff":
+            if scrobbled_ids is None:
+                # the diff needs the whole synced window
+                scrobbled_ids = list(self._iter_scrobbled_ids())
+            tracks_to_scrobble = self._diff_tracks_to_scrobble(tracks_history, history_ids, list(scrobbled_ids))
+            if tracks_to_scrobble is not None:
+                return tracks_to_scrobble
+
+        # Find where the history starts to overlap with already scrobbled tracks,
+        # reading scrobbled tracks from the database only until the overlap is confirmed
+        if scrobbled_ids is not None:
+            overlap_idx = find_overlap_start_index(history_ids, scrobbled_ids, self.min_overlap_length)
+        else:
+            with closing(self._iter_scrobbled_ids()) as scrobbled:
+                overlap_idx = find_overlap_start_index(history_ids, scrobbled, self.min_overlap_length)
 
         # If we found an overlap, everything before that index is new and needs scrobbling
         if overlap_idx is not None:
             tracks_to_scrobble = tracks_history[:overlap_idx]
-            logger.info(f"Found {len(tracks_to_scrobble)} new tracks to scrobble (overlap at index {overlap_idx})")
+            logger.info("Found %s new tracks to scrobble (overlap at index %s)", len(tracks_to_scrobble), overlap_idx)
         else:
             # No overlap found - all tracks are new
             tracks_to_scrobble = tracks_history
-            logger.info(f"No overlap found with existing scrobbles.")
+            logger.info("No overlap found with existing scrobbles.")
 
         return tracks_to_scrobble
 
-    def scrobble_tracks(self, tracks: List[Dict[str, Any]], batch_size: int = 50, sync=False, dry_run=False) -> int:
+    def _iter_scrobbled_ids(self) -> Iterator[str]:
+        """Stream the video IDs of the latest scrobbles in the synced window, latest first."""
+        with closing(
+            self.db.iter_latest_scrobbles(("video_id",), limit=self.max_synced_tracks, account_id=self.account_id)
+        ) as rows:
+            for row in rows:
+                yield row[0]
+
+    def _diff_tracks_to_scrobble(
+        self, tracks_history: List[Track], history_ids: List[str], scrobbled_ids: List[str]
+    ) -> Optional[List[Track]]:
+        """
+        Diff the YouTube Music history against the scrobbled tracks and keep new tracks and replays.
+
+        Returns:
+            Tracks to scrobble, or None if the diff exceeded max_diff_cost
+        """
+        changes = reconcile_history(history_ids, scrobbled_ids, self.max_diff_cost)
+        if changes is None:
+            logger.warning(
+                "History diff exceeded the maximum cost of %s, falling back to overlap detection", self.max_diff_cost
+            )
+            return None
+
+        tracks_to_scrobble = [
+            track for track, change in zip(tracks_history, changes) if change is not HistoryChange.UNCHANGED
+        ]
+        n_replays = sum(change is HistoryChange.REPLAY for change in changes)
+        logger.info("Found %s new tracks to scrobble (%s replays)", len(tracks_to_scrobble), n_replays)
+        return tracks_to_scrobble
+
+    def scrobble_tracks(self, tracks: List[Track], batch_size: int = 50, sync=False, dry_run=False) -> int:
         """
         Scrobble tracks to Last.fm and save them to the database.
 
@@ -81,77 +255,253 @@ class Scrobbler:
         Returns:
             Number of tracks successfully scrobbled
         """
+        self.enqueue_tracks(tracks, sync=sync, dry_run=dry_run)
+        if sync:
+            return 0
+        return self.deliver_pending(batch_size=batch_size, dry_run=dry_run)
+
+    def enqueue_tracks(
+        self,
+        tracks: List[Track],
+        sync=False,
+        dry_run=False,
+        looked_up: Optional[Dict[str, int]] = None,
+        names: Optional[Dict[Names, Names]] = None,
+        scrobble_latest: Optional[int] = None,
+    ) -> int:
+        """
+        Save tracks to the database and, unless syncing, plan their scrobbles in the outbox.
+
+        Both writes happen in the same transaction, so once this returns the tracks are never
+        detected as new again and their scrobbles are delivered by deliver_pending, even if the
+        process stops in between.
+
+        The tracks are canonicalised and stamped as consecutive plays ending now, spaced by their durations.
+        Scrobbles already seeded from Last.fm around the same time are left out of the outbox.
+
+        Args:
+            tracks: List of tracks to scrobble, latest first
+            sync: Syncs database without scrobbling
+            dry_run: Run without side effects
+            looked_up: Durations already looked up for the missing_durations of the tracks,
+                       looked up here if not provided
+            names: Canonical names already resolved for the pending names of the tracks,
+                   resolved here if not provided
+            scrobble_latest: Number of latest tracks to plan in the outbox, the others are only saved,
+                             all of them if not provided
+
+        Returns:
+            Number of scrobbles planned in the outbox
+        """
         if not tracks:
             logger.info("No new tracks to scrobble")
             return 0
 
-        # Add timestamp and reverse to process oldest first
-        epoch_time = int(time.time())
-        tracks_to_scrobble = [track | {"timestamp": epoch_time} for track in tracks]
+        if dry_run:
+            logger.info("Dry-run: skipped saving %s tracks in database and outbox", len(tracks))
+            return 0
+
+        if looked_up is None:
+            looked_up = self.lookup_durations(self.missing_durations(tracks))
+        if names is None:
+            names = self.canonicalizer.resolve(self.canonicalizer.pending(tracks))
+
+        if sync:
+            scrobble_latest = 0
+        elif scrobble_latest is None:
+            scrobble_latest = len(tracks)
+
+        with metrics.span("enqueue"):
+            enqueued = self._enqueue(tracks, scrobble_latest, looked_up, names)
+        metrics.inc("tracks_enqueued", enqueued)
+        return enqueued
+
+    def _enqueue(
+        self, tracks: List[Track], scrobble_latest: int, looked_up: Dict[str, int], names: Dict[Names, Names]
+    ) -> int:
+        durations = self.metadata.get(track.video_id for track in tracks)
+        new_durations = {}
+        for track in tracks:
+            if track.video_id not in durations:
+                duration = self._history_durations.get(track.video_id) or looked_up.get(track.video_id)
+                if duration is not None:
+                    new_durations[track.video_id] = duration
+        durations.update(new_durations)
+
+        # Add timestamps and reverse to process oldest first
+        try:
+            timestamps = spaced_timestamps(
+                [durations.get(track.video_id, self.default_duration) for track in tracks],
+                now=int(time.time()),
+                floor=self.db.get_latest_timestamp(self.account_id),
+            )
+        except ValueError as e:
+            # stored anyway, they would be dropped as duplicates of the latest scrobble: the run fails and
+            # the history is processed again once there is room
+            logger.warning("Not storing %s tracks for now: %s", len(tracks), e)
+            raise RuntimeError(f"No room to timestamp {len(tracks)} tracks after the latest scrobble") from e
+        tracks_to_scrobble = [track.stamped(timestamp) for track, timestamp in zip(tracks, timestamps)]
         tracks_to_scrobble.reverse()
 
+        with self.db.transaction():
+            tracks_to_scrobble = self.canonicalizer.apply(names, tracks_to_scrobble)
+            self.metadata.put(new_durations)
+            self.db.insert_tracks(tracks_to_scrobble, self.account_id, self.duplicates)
+            planned = tracks_to_scrobble[len(tracks_to_scrobble) - scrobble_latest :] if scrobble_latest else []
+            enqueued = self.db.enqueue_scrobbles(self._without_lastfm_duplicates(planned), self.account_id)
+            self.duplicates.save(min_unsaved=FILTER_SAVE_THRESHOLD)
+            self.lastfm_duplicates.save(min_unsaved=FILTER_SAVE_THRESHOLD)
+            return enqueued
+
+    def _without_lastfm_duplicates(self, tracks: List[Track]) -> List[Track]:
+        """Tracks with no scrobble seeded from Last.fm within dedupe_window of their timestamp."""
+        if not self.dedupe_window or not tracks:
+            return tracks
+        kept = self.lastfm_duplicates.filter_new(tracks)
+        if len(kept) < len(tracks):
+            metrics.inc("duplicates_skipped", len(tracks) - len(kept))
+        return kept
+
+    def missing_durations(self, tracks: List[Track]) -> List[str]:
+        """Video IDs of the tracks whose duration is neither cached nor carried by the history."""
+        durations = self.metadata.get(track.video_id for track in tracks)
+        return [
+            video_id
+            for video_id in dict.fromkeys(track.video_id for track in tracks)
+            if video_id not in durations and video_id not in self._history_durations
+        ]
+
+    def history_durations(self, tracks: List[Track]) -> Dict[str, int]:
+        """Durations of tracks carried by the last parsed history, cached by enqueue_tracks along with looked_up."""
+        return {
+            track.video_id: self._history_durations[track.video_id]
+            for track in tracks
+            if track.video_id in self._history_durations
+        }
+
+    def lookup_durations(self, video_ids: List[str]) -> Dict[str, int]:
+        """
+        Look up the durations of videos on YouTube Music, at most max_duration_lookups of them.
+        Does not touch the database, so it can run on another thread.
+
+        Returns:
+            Duration in seconds per video ID, empty if there is no YouTube Music client
+        """
+        if not video_ids or self.ytmusic is None:
+            return {}
+        if len(video_ids) > self.max_duration_lookups:
+            logger.info(
+                "Looking up %s of %s missing track durations, assuming %ss for the others",
+                self.max_duration_lookups,
+                len(video_ids),
+                self.default_duration,
+            )
+        video_ids = video_ids[: self.max_duration_lookups]
+        with metrics.span("lookup_durations"):
+            durations = self.ytmusic.get_durations(video_ids)
+        metrics.inc("duration_lookups", len(video_ids))
+        return durations
+
+    def deliver_pending(self, batch_size: int = 50, dry_run=False) -> int:
+        """
+        Drain the outbox: submit pending scrobbles to Last.fm in batches, oldest first,
+        and mark each batch as acknowledged once Last.fm accepted it.
+
+        A failed or interrupted delivery leaves the remaining scrobbles pending, and the next call
+        resumes from the first unacknowledged batch.
+
+        Args:
+            batch_size: Number of scrobbles to submit in each batch
+            dry_run: Run without side effects
+
+        Returns:
+            Number of tracks successfully scrobbled
+        """
+        if dry_run:
+            pending = self.db.count_pending_scrobbles(self.account_id)
+            logger.info("Dry-run: skipped delivering %s pending scrobbles", pending)
+            return 0
+
+        if self.lastfm is None:
+            raise RuntimeError("A Last.fm client is required to deliver scrobbles")
+
         scrobbled_count = 0
-        for i in range(0, len(tracks_to_scrobble), batch_size):
-            try:
-                tracks_batch = tracks_to_scrobble[i : i + batch_size]
-                if not sync or dry_run:
-                    self.lastfm.scrobble_many(tracks_batch)
-                    scrobbled_count += len(tracks_batch)
-
-                if dry_run:
-                    logger.info("Dry-run: Skip inserting tracks in database.")
-                else:
-                    self.db.insert_tracks(tracks_batch)
-                    time.sleep(0.5)  # Avoid rate limiting
-            except Exception as e:
-                logger.error(f"Failed to scrobble batch starting at index {i}: {str(e)}", exc_info=True)
-                raise
+        while batch := self.db.fetch_pending_scrobbles(batch_size, self.account_id):
+            self.submit_batch(batch)
+            self.db.ack_scrobbles([pending.id for pending in batch])
+            scrobbled_count += len(batch)
 
         return scrobbled_count
 
-    def cleanup_database(self, dry_run=False, keep_latest: int = 200):
+    def submit_batch(self, batch: List[PendingScrobble]) -> None:
+        """
+        Submit a batch of pending scrobbles to Last.fm, paced by the rate limiter and retried on
+        rate-limit and transient errors. Does not touch the database, so it can run on another thread.
+
+        Args:
+            batch: Pending scrobbles as returned by SQLite.fetch_pending_scrobbles
+        """
+        if self.lastfm is None:
+            raise RuntimeError("A Last.fm client is required to deliver scrobbles")
+
+        scrobbles = [pending.track.to_lastfm() for pending in batch]
+        try:
+            with metrics.span("scrobble_batch"):
+                call_with_retries(
+                    lambda: self.lastfm.scrobble_many(scrobbles),
+                    self.rate_limiter,
+                    is_rate_limited=is_rate_limit_error,
+                    is_transient=is_transient_error,
+                    max_retries=self.max_retries,
+                )
+        except Exception as e:
+            metrics.inc("batch_failures")
+            logger.error("Failed to scrobble batch starting at outbox entry %s: %s", batch[0].id, e, exc_info=True)
+            raise
+        metrics.inc("batches")
+        metrics.inc("tracks_scrobbled", len(batch))
+
+    def cleanup_database(self, dry_run=False, keep_latest: Optional[int] = None):
         """
-        Clean up the database by keeping only the most recent entries.
+        Clean up the database by keeping only the most recent entries,
+        older entries are moved to the monthly archive.
 
         Args:
             dry_run: Run without side effects
-            keep_latest: Number of most recent entries to keep
+            keep_latest: Number of most recent entries to keep, defaults to max_synced_tracks
         """
+        if keep_latest is None:
+            keep_latest = self.max_synced_tracks
+
         if dry_run:
-            logger.info(f"Dry-run: skipped cleaning database to keep only {keep_latest} entries")
+            logger.info("Dry-run: skipped cleaning database to keep only %s entries", keep_latest)
         else:
-            self.db.delete_except_latest_n(keep_latest)
-            logger.info(f"Database cleaned up, keeping latest {keep_latest} entries")
+            with metrics.span("cleanup"):
+                archived = self.db.archive_except_latest_n(keep_latest, self.account_id)
+                self.db.purge_acked_scrobbles(self.account_id)
+                self.metadata.evict_expired()
+            metrics.inc("tracks_archived", archived)
+            logger.info("Database cleaned up, keeping latest %s entries and archiving %s", keep_latest, archived)
 
-    def _get_recently_played(self) -> List[Dict[str, Any]]:
-        """Get recently played tracks from YouTube Music"""
+    def _get_recently_played(self, history: Optional[List[Dict[str, Any]]] = None) -> List[Track]:
+        """Get recently played tracks from YouTube Music, or parse an already fetched history"""
         try:
-            history = self.ytmusic.get_history()
-            logger.info(f"Fetched {len(history)} recent tracks from YouTube Music")
-
-            processed = []
-            for track in history:
-                # Skip keys with None values
-                for k in list(track.keys()):
-                    if track[k] is None:
-                        track.pop(k)
-
-                if "title" not in track or "artists" not in track:
-                    continue
-
-                processed.append(
-                    {
-                        "video_id": track["videoId"],
-                        "title": track["title"],
-                        "artist": ", ".join(
-                            [artist["name"] for artist in track["artists"] if not artist["name"].endswith(" views")]
-                        ),
-                        "album": track.get("album", {}).get("name", ""),
-                        "played": track["played"],
-                    }
-                )
+            if history is None:
+                if self.ytmusic is None:
+                    raise RuntimeError("A YouTube Music client is required to fetch the history")
+                with metrics.span("get_history"):
+                    history = self.ytmusic.get_history()
+                logger.info("Fetched %s recent tracks from YouTube Music", len(history))
 
-            return processed
+            with metrics.span("parse"):
+                self._history_durations = {
+                    item["videoId"]: duration
+                    for item in history
+                    if (duration := history_duration(item)) is not None and item.get("videoId")
+                }
+                tracks = [track for track in map(Track.from_history, history) if track is not None]
+            metrics.inc("history_tracks", len(tracks))
+            return tracks
         except Exception as e:
-            logger.error(f"Failed to process YouTube Music history: {str(e)}")
+            logger.error("Failed to process YouTube Music history: %s", e)
             raise
@@ -0,0 +1,152 @@
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, List, Optional, Tuple, TypeVar
+
+from ytm2lfm.canonical import match_key
+from ytm2lfm.database import DEFAULT_ACCOUNT_ID, SQLite
+from ytm2lfm.lastfm import LastFMClient, is_rate_limit_error, is_transient_error
+from ytm2lfm.metrics import metrics
+from ytm2lfm.ratelimit import TokenBucket, call_with_retries
+from ytm2lfm.track import Track
+from ytm2lfm.utils import find_overlap_start_index
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Scrobbles per request: pylast asks for one more, in case the track playing now shows up, and
+# user.getRecentTracks accepts up to 200
+PAGE_SIZE = 199
+
+# Time range of the Last.fm history paged by each worker
+WINDOW = 30 * 24 * 3600
+
+
+class LastFMSeeder:
+    """
+    Load the scrobbles of an account from Last.fm, to tell which plays of the YouTube Music history are
+    already scrobbled when the database does not know it (new machine, lost database volume).
+
+    The history is split into time windows paged back in time in parallel, at most max_in_flight requests
+    at once and paced by the shared rate limiter, and the pages are bulk loaded into the lastfm_history table
+    on the calling thread as they arrive. The table is keyed on the normalised artist, title and timestamp,
+    so seeding again, or fetching a scrobble twice at the edge of a page, only adds the missing scrobbles.
+    """
+
+    def __init__(
+        self,
+        client: LastFMClient,
+        db: SQLite,
+        account_id: int = DEFAULT_ACCOUNT_ID,
+        rate_limiter: Optional[TokenBucket] = None,
+        max_in_flight: int = 4,
+        max_retries: int = 5,
+        window: int = WINDOW,
+        clock: Callable[[], float] = time.time,
+    ):
+        """
+        Args:
+            client: Last.fm client of the account, no authentication needed
+            db: Database holding the lastfm_history table
+            account_id: Database account the scrobbles are loaded for
+            rate_limiter: Token bucket pacing Last.fm requests, shared with the scrobblers of the process
+            max_in_flight: Maximum number of pages fetched at once
+            max_retries: Maximum retries of a page on rate-limit and transient Last.fm errors
+            window: Seconds of history paged by each worker
+            clock: Current time, in seconds since the epoch
+        """
+        self.client = client
+        self.db = db
+        self.account_id = account_id
+        self.rate_limiter = rate_limiter or TokenBucket(rate=5, burst=5)
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.window = window
+        self._clock = clock
+
+    def seed(self, since: Optional[int] = None) -> int:
+        """
+        Load the scrobbles of the account into the database.
+
+        Args:
+            since: Only the scrobbles after this timestamp, all of them since the registration of the user if None
+
+        Returns:
+            Number of scrobbles loaded that were not known yet
+        """
+        until = int(self._clock())
+        if since is None:
+            since = self._call(self.client.get_registered)
+        # latest first, the recent scrobbles are the ones runs check
+        windows = [(start, min(start + self.window, until)) for start in range(since, until, self.window)][::-1]
+        logger.info("Seeding %s windows of Last.fm scrobbles", len(windows))
+
+        loaded = 0
+        with ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="ytm2lfm-seed") as pool:
+            futures = {pool.submit(self._fetch_page, start, end): (start, end) for start, end in windows}
+            try:
+                while futures:
+                    done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        start, end = futures.pop(future)
+                        scrobbles = future.result()
+                        loaded += self._load(scrobbles)
+                        if len(scrobbles) < PAGE_SIZE:
+                            continue
+                        # the next page of the window ends at the oldest scrobble of this one, so that the other
+                        # scrobbles of the same second are not missed
+                        oldest = min(timestamp for _, _, timestamp in scrobbles)
+                        end = oldest if oldest < end else oldest - 1
+                        futures[pool.submit(self._fetch_page, start, end)] = (start, end)
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+
+        logger.info("Loaded %s new Last.fm scrobbles", loaded)
+        return loaded
+
+    def count_unscrobbled(self, tracks: List[Track], min_overlap_length: int) -> int:
+        """
+        Number of latest tracks of a history that are not on Last.fm yet.
+
+        The history and the seeded scrobbles are matched on their normalised names, latest first, the same
+        way new tracks are detected against the database (see utils.find_overlap_start_index).
+
+        Args:
+            tracks: Canonical tracks of the history, latest first
+            min_overlap_length: Minimum number of consecutive matching tracks to confirm the overlap
+
+        Returns:
+            Index of the first track already scrobbled, all the tracks if no overlap is found
+        """
+        history_keys = [(match_key(track.artist), match_key(track.title)) for track in tracks]
+        # scrobbles of tracks missing from the history (e.g. from other players) are ignored
+        known = set(history_keys)
+        scrobbled_keys = [
+            (artist, title)
+            for artist, title, _ in self.db.fetch_lastfm_history(4 * len(tracks), self.account_id)
+            if (artist, title) in known
+        ]
+        overlap_idx = find_overlap_start_index(history_keys, scrobbled_keys, min_overlap_length)
+        return len(tracks) if overlap_idx is None else overlap_idx
+
+    def _fetch_page(self, start: int, end: int) -> List[Tuple[str, str, int]]:
+        with metrics.span("lastfm_history_page"):
+            return self._call(lambda: self.client.get_recent_tracks(PAGE_SIZE, time_from=start, time_to=end))
+
+    def _call(self, fn: Callable[[], T]) -> T:
+        return call_with_retries(
+            fn,
+            self.rate_limiter,
+            is_rate_limited=is_rate_limit_error,
+            is_transient=is_transient_error,
+            max_retries=self.max_retries,
+        )
+
+    def _load(self, scrobbles: List[Tuple[str, str, int]]) -> int:
+        return self.db.insert_lastfm_history(
+            ((match_key(artist), match_key(title), timestamp) for artist, title, timestamp in scrobbles),
+            self.account_id,
+        )
@@ -0,0 +1,108 @@
+import gzip
+import json
+import logging
+import os
+import re
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from ytm2lfm.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_SUFFIX = ".json.gz"
+PROCESSED_FILE = "processed"
+
+
+class HistorySnapshots:
+    """
+    On-disk cache of raw YouTube Music histories, one directory per account.
+
+    Every fetched history is stored as a gzip-compressed JSON snapshot named after its fingerprint,
+    and the fingerprint of the last history fully processed (saved in the database and delivered to
+    Last.fm) is recorded separately. Comparing a new fingerprint with the processed one tells whether
+    a run has anything to do, and the latest snapshot can be replayed to retry a failed run without
+    fetching the history again.
+    """
+
+    def __init__(self, directory: str, keep: int = 10):
+        """
+        Args:
+            directory: Directory holding the snapshots, created when needed
+            keep: Number of snapshots kept per account, older ones are deleted
+        """
+        self.directory = directory
+        self.keep = keep
+
+    def save(self, account_name: str, fingerprint: str, history: List[Dict[str, Any]]) -> str:
+        """
+        Store a history snapshot, unless it is the same as the latest one.
+
+        Returns:
+            Path of the snapshot
+        """
+        latest = self._list(account_name)
+        if latest and latest[-1][1] == fingerprint:
+            return latest[-1][2]
+
+        account_dir = self._account_dir(account_name)
+        os.makedirs(account_dir, exist_ok=True)
+        path = os.path.join(account_dir, f"{time.time_ns()}-{fingerprint}{SNAPSHOT_SUFFIX}")
+        with gzip.open(path + ".tmp", "wt", encoding="utf-8") as f:
+            json.dump(history, f, separators=(",", ":"))
+        os.replace(path + ".tmp", path)
+        metrics.inc("snapshot_bytes", os.path.getsize(path))
+
+        for _, _, old_path in self._list(account_name)[: -self.keep]:
+            os.remove(old_path)
+
+        return path
+
+    def load_latest(self, account_name: str) -> Optional[Tuple[str, List[Dict[str, Any]]]]:
+        """
+        Read the latest stored snapshot of an account.
+
+        Returns:
+            Fingerprint and raw history of the snapshot, or None if there is none
+        """
+        snapshots = self._list(account_name)
+        if not snapshots:
+            return None
+        _, fingerprint, path = snapshots[-1]
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            return fingerprint, json.load(f)
+
+    def last_processed(self, account_name: str) -> Optional[str]:
+        """Fingerprint of the last history fully processed for an account."""
+        try:
+            with open(os.path.join(self._account_dir(account_name), PROCESSED_FILE)) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def mark_processed(self, account_name: str, fingerprint: str) -> None:
+        account_dir = self._account_dir(account_name)
+        os.makedirs(account_dir, exist_ok=True)
+        path = os.path.join(account_dir, PROCESSED_FILE)
+        with open(path + ".tmp", "w") as f:
+            f.write(fingerprint)
+        os.replace(path + ".tmp", path)
+
+    def _account_dir(self, account_name: str) -> str:
+        return os.path.join(self.directory, re.sub(r"[^\w.-]", "_", account_name))
+
+    def _list(self, account_name: str) -> List[Tuple[int, str, str]]:
+        """Stored snapshots of an account as (creation time, fingerprint, path), oldest first."""
+        try:
+            names = os.listdir(self._account_dir(account_name))
+        except FileNotFoundError:
+            return []
+
+        snapshots = []
+        for name in names:
+            if not name.endswith(SNAPSHOT_SUFFIX):
+                continue
+            created, _, fingerprint = name[: -len(SNAPSHOT_SUFFIX)].partition("-")
+            snapshots.append((int(created), fingerprint, os.path.join(self._account_dir(account_name), name)))
+        snapshots.sort()
+        return snapshots
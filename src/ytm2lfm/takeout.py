@@ -0,0 +1,253 @@
+import codecs
+import json
+import logging
+import os
+import sys
+import time
+from datetime import datetime
+from typing import Any, BinaryIO, Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from ytm2lfm.canonical import Canonicalizer
+from ytm2lfm.database import DEFAULT_ACCOUNT_ID, SQLite
+from ytm2lfm.dedupe import DuplicateFilter
+from ytm2lfm.metrics import metrics
+from ytm2lfm.track import Track
+
+logger = logging.getLogger(__name__)
+
+YOUTUBE_MUSIC_HEADER = "YouTube Music"
+WATCHED_PREFIX = "Watched "
+
+# Last.fm ignores scrobbles older than two weeks
+MAX_SCROBBLE_AGE = 14 * 24 * 3600
+
+_WHITESPACE = " \t\n\r"
+
+
+def iter_json_array(f: BinaryIO, offset: int = 0, chunk_size: int = 1 << 16) -> Iterator[Tuple[Any, int]]:
+    """
+    Stream the items of a top-level JSON array of objects, such as a Google Takeout watch-history.json,
+    holding a single chunk and a single item in memory whatever the size of the file.
+
+    Args:
+        f: File opened in binary mode
+        offset: Byte offset to resume from, 0 or an offset yielded by a previous iteration
+        chunk_size: Number of bytes read at once
+
+    Yields:
+        Each item, and the byte offset right after it
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    f.seek(offset)
+    text = ""
+    # position in text and the byte offset it stands for, the decoded text always starts on a character
+    pos = 0
+    pos_offset = offset
+    in_array = offset > 0
+    eof = False
+
+    def read_more() -> bool:
+        nonlocal text, pos, eof
+        if eof:
+            return False
+        data = f.read(chunk_size)
+        eof = not data
+        text = text[pos:] + utf8.decode(data, final=eof)
+        pos = 0
+        return True
+
+    while True:
+        while pos < len(text) and text[pos] in _WHITESPACE:
+            pos += 1
+            pos_offset += 1
+        if pos == len(text):
+            if not read_more():
+                raise ValueError(f"Unexpected end of JSON array at byte {pos_offset}")
+            continue
+
+        char = text[pos]
+        if not in_array:
+            if char != "[":
+                raise ValueError(f"Expected a JSON array at byte {pos_offset}")
+            in_array = True
+        elif char == "]":
+            return
+        elif char != ",":
+            try:
+                item, end = decoder.raw_decode(text, pos)
+            except json.JSONDecodeError:
+                # the item continues in the next chunk
+                if read_more():
+                    continue
+                raise
+            pos_offset += len(text[pos:end].encode("utf-8"))
+            pos = end
+            yield item, pos_offset
+            continue
+        pos += 1
+        pos_offset += 1
+
+
+def parse_entry(entry: Dict[str, Any]) -> Optional[Track]:
+    """
+    Parse an entry of a Google Takeout watch history.
+
+    Returns:
+        The played track with its timestamp, or None if the entry is not a YouTube Music play of a track
+        that still exists (removed videos have neither a title nor a channel)
+    """
+    if entry.get("header") != YOUTUBE_MUSIC_HEADER or "time" not in entry:
+        return None
+    title, url, channels = entry.get("title", ""), entry.get("titleUrl"), entry.get("subtitles")
+    if not url or not channels or not title.startswith(WATCHED_PREFIX):
+        return None
+    video_id = parse_qs(urlsplit(url).query).get("v", [None])[0]
+    title = title[len(WATCHED_PREFIX) :]
+    if video_id is None or title == url:
+        return None
+
+    played = entry["time"]
+    return Track(
+        video_id=sys.intern(video_id),
+        title=title,
+        artist=channels[0]["name"],
+        album="",
+        played=played,
+        timestamp=int(datetime.fromisoformat(played).timestamp()),
+    )
+
+
+def iter_takeout_tracks(f: BinaryIO, offset: int = 0) -> Iterator[Tuple[Track, int]]:
+    """Stream the YouTube Music plays of a watch history file, with the byte offset right after each one."""
+    for entry, end in iter_json_array(f, offset):
+        track = parse_entry(entry)
+        if track is not None:
+            yield track, end
+
+
+def iter_chunks(tracks: Iterator[Tuple[Track, int]], size: int) -> Iterator[Tuple[List[Track], int]]:
+    """Group streamed tracks in chunks of at most size, with the byte offset right after the last one."""
+    chunk: List[Track] = []
+    end = 0
+    for track, end in tracks:
+        chunk.append(track)
+        if len(chunk) == size:
+            yield chunk, end
+            chunk = []
+    if chunk:
+        yield chunk, end
+
+
+class ImportResult(NamedTuple):
+    parsed: int
+    archived: int
+    enqueued: int
+
+
+class TakeoutImporter:
+    """
+    Backfill the archive of an account from a Google Takeout watch history (watch-history.json).
+
+    The file is streamed and processed in chunks: each chunk is canonicalised, stored in the monthly archive
+    and, for the plays recent enough for Last.fm to accept them, planned in the outbox, in the same transaction
+    as the byte offset reached. An interrupted import resumes after the last committed chunk.
+
+    Only the plays older than the synced window of the account are imported, newer ones are already handled
+    by the regular runs. The cut-off is fixed when an import starts, so that a resumed import keeps it.
+    Plays already stored, e.g. by the import of an earlier, overlapping export, are neither archived nor
+    scrobbled again, and only the plays older than the first scrobble of the runs are scrobbled: the ones
+    since, archived from the synced window as it moved on, were scrobbled by the runs.
+    """
+
+    def __init__(
+        self,
+        db: SQLite,
+        canonicalizer: Canonicalizer,
+        account_id: int = DEFAULT_ACCOUNT_ID,
+        chunk_size: int = 1000,
+        max_scrobble_age: int = MAX_SCROBBLE_AGE,
+        duplicate_filter: Optional[DuplicateFilter] = None,
+        clock: Callable[[], float] = time.time,
+    ):
+        """
+        Args:
+            db: Database to import into
+            canonicalizer: Normalisation of the track names, as for the regular runs
+            account_id: Database account the plays are imported for
+            chunk_size: Number of plays stored per transaction
+            max_scrobble_age: Plays older than this many seconds are archived but not scrobbled
+            duplicate_filter: Filter of the plays already stored for the account,
+                              defaults to a filter with the default settings
+            clock: Current time, in seconds since the epoch
+        """
+        self.db = db
+        self.canonicalizer = canonicalizer
+        self.account_id = account_id
+        self.chunk_size = chunk_size
+        self.max_scrobble_age = max_scrobble_age
+        self.duplicates = duplicate_filter or DuplicateFilter(db, account_id)
+        self._clock = clock
+
+    def import_file(self, path: str, restart=False, scrobble=True, dry_run=False) -> ImportResult:
+        """
+        Import a watch history file, resuming from its checkpoint.
+
+        Args:
+            path: Path of watch-history.json
+            restart: Ignore the checkpoint and import the file from the start
+            scrobble: Plan the scrobbles of the recent plays, otherwise only archive them
+            dry_run: Parse the file without storing anything
+
+        Returns:
+            Number of plays parsed, archived and planned in the outbox
+        """
+        source = os.path.abspath(path)
+        size = os.path.getsize(path)
+        offset, before = 0, self.db.get_earliest_timestamp(self.account_id)
+        checkpoint = None if restart else self.db.get_import_checkpoint(source, self.account_id)
+        if checkpoint is not None:
+            if checkpoint["size"] == size:
+                offset, before = checkpoint["offset"], checkpoint["before"]
+                logger.info("Resuming the import of %s at byte %s of %s", path, offset, size)
+            else:
+                logger.warning("%s changed since its last import, importing it from the start", path)
+
+        scrobble_after = self._clock() - self.max_scrobble_age
+        # the plays since the first scrobble of the runs were scrobbled by them, with timestamps spaced back
+        # from each run rather than the ones of the export, too far apart to be told duplicates
+        scrobble_before = self.db.get_first_synced_timestamp(self.account_id)
+        parsed = archived = enqueued = 0
+        with open(path, "rb") as f:
+            for chunk, end in iter_chunks(iter_takeout_tracks(f, offset), self.chunk_size):
+                parsed += len(chunk)
+                tracks = [track for track in chunk if before is None or track.timestamp < before]
+                if dry_run:
+                    continue
+
+                with metrics.span("import_chunk"), self.db.transaction():
+                    new_tracks = self.duplicates.filter_new(tracks)
+                    if len(new_tracks) < len(tracks):
+                        metrics.inc("duplicates_skipped", len(tracks) - len(new_tracks))
+                    tracks = self.canonicalizer.canonicalize(new_tracks)
+                    archived += self.db.archive_tracks(tracks, self.account_id)
+                    if scrobble:
+                        # the history is latest first, deliver each chunk oldest first
+                        recent = [
+                            track
+                            for track in reversed(tracks)
+                            if scrobble_after < track.timestamp
+                            and (scrobble_before is None or track.timestamp < scrobble_before)
+                        ]
+                        enqueued += self.db.enqueue_scrobbles(recent, self.account_id)
+                    self.db.save_import_checkpoint(source, size, end, before, self.account_id)
+                # only once committed, ids of rolled back rows are handed out again
+                self.duplicates.refresh()
+                logger.info("Imported %s plays up to byte %s of %s", parsed, end, size)
+
+        # a filter left unsaved is only caught up with more rows on its next load
+        if not dry_run:
+            self.duplicates.save()
+        metrics.inc("imported_tracks", archived)
+        return ImportResult(parsed, archived, enqueued)
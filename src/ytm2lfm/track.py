@@ -0,0 +1,63 @@
+import sys
+from typing import Any, Dict, NamedTuple, Optional
+
+# Builds tracks from a ready tuple, skipping the keyword handling of the generated __new__ on hot paths
+_tuple_new = tuple.__new__
+
+
+class Track(NamedTuple):
+    """
+    A played track, from the parsed YouTube Music history to the database.
+
+    The field order matches the scrobbles table columns (SCROBBLE_COLUMNS), so tracks are bound to
+    SQL statements positionally. Video IDs are interned: the same track shows up in the history,
+    the database and the outbox, and comparisons mostly hit the identity fast path.
+    """
+
+    video_id: str
+    title: str
+    artist: str
+    album: str
+    played: str
+    timestamp: Optional[int] = None
+
+    @classmethod
+    def from_history(cls, item: Dict[str, Any]) -> Optional["Track"]:
+        """
+        Parse an entry of the raw YouTube Music history.
+
+        Returns:
+            The track, or None if the entry has no title or no artists
+        """
+        title = item.get("title")
+        artists = item.get("artists")
+        if title is None or artists is None:
+            return None
+
+        album = item.get("album")
+        return _tuple_new(
+            cls,
+            (
+                sys.intern(item["videoId"]),
+                title,
+                ", ".join([artist["name"] for artist in artists if not artist["name"].endswith(" views")]),
+                album.get("name", "") if album else "",
+                item["played"],
+                None,
+            ),
+        )
+
+    def stamped(self, timestamp: int) -> "Track":
+        """Copy of the track with its scrobble timestamp, a faster _replace(timestamp=...)."""
+        return _tuple_new(Track, (self[0], self[1], self[2], self[3], self[4], timestamp))
+
+    def to_lastfm(self) -> Dict[str, Any]:
+        """Keyword arguments of the track for a pylast scrobble."""
+        return {"artist": self.artist, "title": self.title, "timestamp": self.timestamp, "album": self.album}
+
+
+class PendingScrobble(NamedTuple):
+    """A scrobble of the outbox waiting for Last.fm, identified by its outbox id."""
+
+    id: int
+    track: Track
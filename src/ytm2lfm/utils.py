@@ -1,10 +1,14 @@
 # scrobbler/utils.py
-from collections import OrderedDict
-from typing import List, Optional
+import hashlib
+from typing import Any, Dict, Hashable, Iterable, Iterator, Optional, Sequence, Set, TypeVar
+
+T = TypeVar("T", bound=Hashable)
+
+_EXHAUSTED = object()
 
 
 def find_overlap_start_index(
-    history_list: List[str], scrobbled_list: List[str], min_overlap_length: int
+    history_list: Sequence[T], scrobbled_list: Iterable[T], min_overlap_length: int
 ) -> Optional[int]:
     """
     Find the starting index in history_list where it begins to overlap with scrobbled_list.
@@ -14,9 +18,15 @@ def find_overlap_start_index(
     - Elements before this index are new tracks that need to be scrobbled
     - Elements at and after this index are tracks that have already been scrobbled
 
+    Tracks played again are moved to the top of the YouTube Music history, so every history entry
+    visited so far is removed from the scrobbled sequence before the next comparison. The match is
+    done in a single pass over both lists (O(n + m) with hashable identifiers, e.g. video IDs as
+    strings or integer-interned IDs), and scrobbled_list is consumed lazily: iteration stops as soon
+    as the overlap is confirmed.
+
     Args:
         history_list: List of track identifiers from recent history (e.g., YouTube Music)
-        scrobbled_list: List of already scrobbled track identifiers (from database)
+        scrobbled_list: Already scrobbled track identifiers (from database), latest first
         min_overlap_length: Minimum number of consecutive matching tracks required to
                             confirm a genuine overlap (rather than coincidental matches)
 
@@ -30,25 +40,61 @@ def find_overlap_start_index(
         With min_overlap_length = 3, the function would return 3 (index of 'D' in history).
         This means tracks A, B, C are new and should be scrobbled.
     """
-    if not scrobbled_list or not history_list or min_overlap_length <= 0:
+    if not history_list or min_overlap_length <= 0:
         return None
 
-    count = 0
-    start_idx = None
+    scrobbled_iter = iter(scrobbled_list)
+    seen: Set[T] = set()
+
+    head = _next_unseen(scrobbled_iter, seen)
+    if head is _EXHAUSTED:
+        return None
 
-    scrobbled_od = OrderedDict.fromkeys(scrobbled_list)
+    count = 0
+    start_idx = 0
 
-    for idx in range(len(history_list)):
-        if history_list[idx] == next(iter(scrobbled_od)):
-            if start_idx is None:
+    for idx, track in enumerate(history_list):
+        if track == head:
+            if count == 0:
                 start_idx = idx
             count += 1
+            if count >= min_overlap_length:
+                return start_idx
         else:
-            count, start_idx = 0, None
-
-        if count >= min_overlap_length:
-            return start_idx
+            count = 0
 
-        scrobbled_od.pop(history_list[idx], None)
+        seen.add(track)
+        if track == head:
+            head = _next_unseen(scrobbled_iter, seen)
+            if head is _EXHAUSTED:
+                # nothing left to compare against, no overlap can be completed anymore
+                return None
 
     return None
+
+
+def _next_unseen(iterator: Iterator[T], seen: Set[T]):
+    """Advance iterator to the first element not in seen, or return a sentinel when exhausted."""
+    for item in iterator:
+        if item not in seen:
+            return item
+    return _EXHAUSTED
+
+
+def history_fingerprint(history: Iterable[Dict[str, Any]]) -> str:
+    """
+    Hash the identity of a raw YouTube Music history: the video ID and play period of each entry, in order.
+
+    Other fields (thumbnails, feedback tokens) may change between requests without any new play,
+    so they are left out. Two histories with the same fingerprint yield the same tracks to scrobble.
+
+    Args:
+        history: Raw history as returned by YTMusicClient.get_history, latest first
+
+    Returns:
+        Hex digest of the history
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for track in history:
+        digest.update(f"{track.get('videoId')}\0{track.get('played')}\n".encode())
+    return digest.hexdigest()
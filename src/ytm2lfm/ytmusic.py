@@ -1,13 +1,22 @@
 import logging
-from typing import Any, Dict, List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
 
+import requests
 from ytmusicapi import OAuthCredentials, YTMusic
 
 logger = logging.getLogger(__name__)
 
 
 class YTMusicClient(YTMusic):
-    def __init__(self, auth_file: str, client_id: str, client_secret: str):
+    def __init__(
+        self,
+        auth_file: str,
+        client_id: str,
+        client_secret: str,
+        requests_session: Optional[requests.Session] = None,
+        max_in_flight: int = 8,
+    ):
         """
         Initialize YouTube Music client with OAuth credentials.
 
@@ -15,15 +24,19 @@ class YTMusicClient(YTMusic):
             auth_file: Path to OAuth credentials file
             client_id: Google API client ID
             client_secret: Google API client secret
+            requests_session: Session to share keep-alive connections with other clients, a new one by default
+            max_in_flight: Maximum number of concurrent duration lookups, through the connections of the session
         """
+        self.max_in_flight = max_in_flight
         try:
             super().__init__(
                 auth_file,
+                requests_session=requests_session,
                 oauth_credentials=OAuthCredentials(client_id=client_id, client_secret=client_secret),
             )
             logger.info("YouTube Music client initialized")
         except Exception as e:
-            logger.error(f"YouTube Music authentication failed: {e}")
+            logger.error("YouTube Music authentication failed: %s", e)
             raise
 
     def get_history(self) -> List[Dict[str, Any]]:
@@ -39,34 +52,31 @@ class YTMusicClient(YTMusic):
             return history
 
         except Exception as e:
-            logger.error(f"Failed to fetch YouTube Music history: {e}")
+            logger.error("Failed to fetch YouTube Music history: %s", e)
             raise
 
-    def _is_valid_track(self, track: Dict[str, Any]) -> bool:
+    def get_durations(self, video_ids: List[str]) -> Dict[str, int]:
         """
-        Check if a track has the required fields.
+        Look up the durations of videos missing from the history, skipping the ones that fail.
 
         Args:
-            track: Track data from YTMusic API
+            video_ids: Video IDs to look up
 
         Returns:
-            True if the track is valid, False otherwise
+            Duration in seconds per video ID
         """
-        # Remove None values
-        for k in list(track.keys()):
-            if track[k] is None:
-                track.pop(k)
+        if not video_ids:
+            return {}
+        with ThreadPoolExecutor(
+            max_workers=min(len(video_ids), self.max_in_flight), thread_name_prefix="ytm2lfm-durations"
+        ) as pool:
+            lookups = list(pool.map(self._get_duration, video_ids))
+        return {video_id: seconds for video_id, seconds in zip(video_ids, lookups) if seconds}
 
-        return "title" in track and "artists" in track and "videoId" in track
-
-    def _format_artists(self, artists: List[Dict[str, Any]]) -> str:
-        """
-        Format the artists list into a comma-separated string.
-
-        Args:
-            artists: List of artist dictionaries
-
-        Returns:
-            Comma-separated string of artist names
-        """
-        return ", ".join([artist["name"] for artist in artists if not artist["name"].endswith(" views")])
+    def _get_duration(self, video_id: str) -> Optional[int]:
+        try:
+            seconds = int(self.get_song(video_id)["videoDetails"]["lengthSeconds"])
+        except Exception as e:
+            logger.warning("Failed to look up the duration of video %s: %s", video_id, e)
+            return None
+        return seconds if seconds > 0 else None
@@ -0,0 +1,19 @@
+import os
+import tempfile
+
+import pytest
+
+from ytm2lfm.database import SQLite
+
+
+@pytest.fixture
+def temp_db_path():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        yield os.path.join(tmpdirname, "test_scrobbles.db")
+
+
+@pytest.fixture
+def db(temp_db_path):
+    db = SQLite(temp_db_path)
+    yield db
+    db.close()
@@ -0,0 +1,67 @@
+import pytest
+
+from ytm2lfm.canonical import NO_RULES, Canonicalizer
+from ytm2lfm.track import Track
+
+
+class FakeCorrector:
+    def __init__(self, fail=()):
+        self.calls = []
+        self.fail = set(fail)
+
+    def __call__(self, artist, title):
+        self.calls.append((artist, title))
+        if title in self.fail:
+            raise RuntimeError("Last.fm is down")
+        return artist.upper(), title
+
+
+def track(artist, title, album=""):
+    return Track("vid1", title, artist, album, "Today")
+
+
+@pytest.mark.parametrize(
+    "raw, canonical",
+    [
+        (("Artist - Topic", "Song"), ("Artist", "Song")),
+        (("Artist feat. Guest", "Song"), ("Artist", "Song")),
+        (("Artist ft Guest", "Song"), ("Artist", "Song")),
+        (("Artist", "Song (Official Video)"), ("Artist", "Song")),
+        (("Artist", "Song [Official Music Video] (HD)"), ("Artist", "Song")),
+        (("Artist", "Song (Lyric Video)"), ("Artist", "Song")),
+        (("Artist", "Song (Remastered 2011)"), ("Artist", "Song (Remastered 2011)")),
+        (("Artist", "Video"), ("Artist", "Video")),
+    ],
+)
+def test_default_rules(db, raw, canonical):
+    assert Canonicalizer(db).normalize(*raw, "") == (*canonical, "")
+
+
+def test_names_are_canonicalised_once(db):
+    corrector = FakeCorrector()
+    tracks = [track("Artist - Topic", "Song"), track("Artist - Topic", "Song"), track("Other", "Song (Audio)")]
+
+    canonicalizer = Canonicalizer(db, corrector=corrector)
+    assert [(t.artist, t.title) for t in canonicalizer.canonicalize(tracks)] == [
+        ("ARTIST", "Song"),
+        ("ARTIST", "Song"),
+        ("OTHER", "Song"),
+    ]
+    assert corrector.calls == [("Artist", "Song"), ("Other", "Song")]
+
+    # memoised in the database for the next process
+    canonicalizer = Canonicalizer(db, corrector=corrector)
+    assert canonicalizer.pending(tracks) == []
+    assert canonicalizer.canonicalize(tracks)[0].artist == "ARTIST"
+    assert len(corrector.calls) == 2
+
+    # another version of the rules starts over
+    assert Canonicalizer(db, rules=NO_RULES).canonicalize(tracks)[0].artist == "Artist - Topic"
+
+
+def test_failed_corrections_are_retried(db):
+    corrector = FakeCorrector(fail={"Song"})
+    canonicalizer = Canonicalizer(db, corrector=corrector)
+
+    assert canonicalizer.canonicalize([track("Artist - Topic", "Song")])[0].artist == "Artist"
+    assert canonicalizer.pending([track("Artist - Topic", "Song")]) == [("Artist - Topic", "Song", "")]
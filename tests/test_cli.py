@@ -0,0 +1,276 @@
+import json
+import os
+import sys
+import threading
+from unittest import mock
+
+import pytest
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, "src"))
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+
+import cli  # noqa: E402
+from ytm2lfm.config import get_settings  # noqa: E402
+from ytm2lfm.database import SQLite  # noqa: E402
+from ytm2lfm.track import Track  # noqa: E402
+from ytm2lfm.utils import history_fingerprint  # noqa: E402
+
+from .test_scrobbler import FakeLastFM, FakeYTMusic  # noqa: E402
+
+
+class FakeAuthLastFM(FakeLastFM):
+    def __init__(self, on_authenticate=None):
+        super().__init__()
+        self.session_key = None
+        self.authentications = 0
+        self.on_authenticate = on_authenticate
+
+    def authenticate(self):
+        self.authentications += 1
+        if self.on_authenticate is not None:
+            self.on_authenticate()
+        self.session_key = "session"
+
+
+class FakeServices:
+    """Stand-ins for the Last.fm and YouTube Music clients the CLI creates, recording every call by account."""
+
+    def __init__(self, histories):
+        self.histories = histories
+        self.lastfm = {}
+        self.history_fetches = []
+        self.lookups = []
+        self.ytmusic_clients = []
+        self.on_history = {}
+        self.on_authenticate = None
+
+    def create_lastfm_client(self, account, session_cache=None):
+        if account.name not in self.lastfm:
+            self.lastfm[account.name] = FakeAuthLastFM(self.on_authenticate)
+        return self.lastfm[account.name]
+
+    def create_ytmusic_client(self, account):
+        services = self
+        self.ytmusic_clients.append(account.name)
+
+        class Client(FakeYTMusic):
+            def get_history(self):
+                services.history_fetches.append(account.name)
+                if account.name in services.on_history:
+                    services.on_history[account.name]()
+                return super().get_history()
+
+            def get_durations(self, video_ids):
+                services.lookups.append(account.name)
+                return super().get_durations(video_ids)
+
+        return Client(self.histories[account.name])
+
+
+@pytest.fixture
+def services(tmp_path, monkeypatch):
+    auth_file = tmp_path / "oauth.json"
+    auth_file.write_text("{}")
+    accounts = [
+        {
+            "name": name,
+            "lastfm": {"api_key": "key", "shared_secret": "secret", "registered_to": name, "password": "password"},
+            "ytmusic": {"auth_file": str(auth_file), "client_id": "id", "client_secret": "secret"},
+        }
+        for name in ("alice", "bob")
+    ]
+    monkeypatch.setenv("SQLITE__DB_PATH", str(tmp_path / "scrobbles.db"))
+    monkeypatch.setenv("ACCOUNTS", json.dumps(accounts))
+    monkeypatch.setenv("SCROBBLER__SEQUENCE_MATCH_LENGTH", "2")
+
+    services = FakeServices({"alice": ["b", "a"], "bob": ["z", "y"]})
+    monkeypatch.setattr(cli, "create_lastfm_client", services.create_lastfm_client)
+    monkeypatch.setattr(cli, "create_ytmusic_client", services.create_ytmusic_client)
+    get_settings.cache_clear()
+    with mock.patch("ytm2lfm.ratelimit.time.sleep"), mock.patch("ytm2lfm.ratelimit.random.uniform", return_value=0):
+        yield services
+    get_settings.cache_clear()
+
+
+def test_run_scrobble_overlaps_fetch_auth_and_database_read(services, monkeypatch):
+    read_started = threading.Event()
+    auth_started = threading.Event()
+    overlaps = {}
+
+    def wait_for_read():
+        # bob's history is still being fetched while alice's synced window is read
+        overlaps["fetch"] = read_started.wait(5)
+
+    def authenticate():
+        auth_started.set()
+        overlaps["auth"] = read_started.wait(5)
+
+    iter_latest_scrobbles = SQLite.iter_latest_scrobbles
+
+    def read(self, *args, **kwargs):
+        read_started.set()
+        overlaps.setdefault("read", auth_started.wait(5))
+        return iter_latest_scrobbles(self, *args, **kwargs)
+
+    services.on_history["bob"] = wait_for_read
+    services.on_authenticate = authenticate
+    monkeypatch.setattr(SQLite, "iter_latest_scrobbles", read)
+
+    assert len(cli.run_scrobble()) == 4
+    assert overlaps == {"fetch": True, "auth": True, "read": True}
+    assert services.lastfm["alice"].calls == [["a", "b"]]
+    assert services.lastfm["bob"].calls == [["y", "z"]]
+
+
+def test_unchanged_history_skips_database_and_lastfm(services, monkeypatch):
+    cli.run_scrobble()
+    assert [client.authentications for client in services.lastfm.values()] == [1, 1]
+
+    create_database = mock.Mock(side_effect=AssertionError("the database was opened"))
+    create_scrobbler = mock.Mock(side_effect=AssertionError("a scrobbler was created"))
+    monkeypatch.setattr(cli, "create_database", create_database)
+    monkeypatch.setattr(cli, "create_scrobbler", create_scrobbler)
+
+    assert cli.run_scrobble() == []
+    assert sorted(services.history_fetches) == ["alice", "alice", "bob", "bob"]
+    create_database.assert_not_called()
+    create_scrobbler.assert_not_called()
+    assert [client.authentications for client in services.lastfm.values()] == [1, 1]
+
+
+def test_changed_history_is_marked_once_processed(services):
+    snapshots = cli.create_snapshots()
+    cli.run_scrobble()
+    processed = snapshots.last_processed("alice")
+    assert processed is not None
+
+    services.histories["alice"] = ["c", "b", "a"]
+    services.lastfm["alice"].fail_on_call = 2
+    with pytest.raises(RuntimeError, match="alice"):
+        cli.run_scrobble()
+    # the new play was planned but not delivered, the history is processed again by the next run
+    assert snapshots.last_processed("alice") == processed
+
+    assert cli.run_scrobble() == []
+    assert services.lastfm["alice"].calls == [["a", "b"], ["c"]]
+    assert snapshots.last_processed("alice") == snapshots.load_latest("alice")[0] != processed
+
+
+def test_replay_processes_the_stored_snapshot_without_youtube_music(services):
+    snapshots = cli.create_snapshots()
+    for name, video_ids in (("alice", ["d", "c"]), ("bob", ["x", "w"])):
+        history = FakeYTMusic(video_ids).get_history()
+        snapshots.save(name, history_fingerprint(history), history)
+
+    assert len(cli.run_scrobble(replay=True)) == 4
+    assert services.history_fetches == []
+    assert services.lookups == []
+    assert services.lastfm["alice"].calls == [["c", "d"]]
+    assert services.lastfm["bob"].calls == [["w", "x"]]
+    assert snapshots.last_processed("alice") == snapshots.load_latest("alice")[0]
+
+
+def test_youtube_music_client_is_only_created_again_for_missing_durations(services):
+    cli.run_scrobble()
+    # one client fetches the history, another one looks up the durations missing from it
+    assert sorted(services.ytmusic_clients) == ["alice", "alice", "bob", "bob"]
+
+    services.ytmusic_clients.clear()
+    services.histories["alice"] = ["a", "b", "a"]
+    services.histories["bob"] = ["x", "z", "y"]
+    cli.run_scrobble()
+    # the duration of alice's new play is cached
+    assert sorted(services.ytmusic_clients) == ["alice", "bob", "bob"]
+    assert sorted(services.lookups) == ["alice", "bob", "bob"]
+
+
+def stored_plays(db_path, account):
+    db = SQLite(db_path)
+    try:
+        tracks = db.fetch_latest_scrobbles(account_id=db.get_account_id(account))
+    finally:
+        db.close()
+    # the timestamps end when the scrobbles were planned, only their spacing is compared
+    return [(track[:4], tracks[0].timestamp - track.timestamp) for track in tracks]
+
+
+def test_plan_then_apply_matches_a_scrobble_run(services, tmp_path, monkeypatch):
+    assert len(cli.run_scrobble()) == 4
+    scrobbled = {name: client.calls for name, client in services.lastfm.items()}
+    expected = {name: stored_plays(str(tmp_path / "scrobbles.db"), name) for name in ("alice", "bob")}
+
+    monkeypatch.setenv("SQLITE__DB_PATH", str(tmp_path / "planned" / "scrobbles.db"))
+    get_settings.cache_clear()
+    services.lastfm.clear()
+    plans = cli.run_plan(str(tmp_path / "run.plan"))
+    assert [plan.account for plan in plans] == ["alice", "bob"]
+    assert services.lastfm == {}
+
+    assert cli.run_apply(str(tmp_path / "run.plan")) == 4
+    assert {name: client.calls for name, client in services.lastfm.items()} == scrobbled
+    for name in ("alice", "bob"):
+        assert stored_plays(str(tmp_path / "planned" / "scrobbles.db"), name) == expected[name]
+    assert cli.run_scrobble() == []
+
+
+def test_apply_submits_the_plan_without_youtube_music(services, tmp_path):
+    from ytm2lfm.plan import read_plan, write_plan
+
+    path = str(tmp_path / "run.plan")
+    plans = cli.run_plan(path)
+    # planning writes nothing to the database, not even the accounts
+    db = SQLite(str(tmp_path / "scrobbles.db"))
+    assert db.get_account_id("alice") is None
+    db.close()
+
+    alice = plans[0]
+    assert [track.video_id for track in alice.tracks] == ["b", "a"]
+    assert alice.durations == {"a": 200, "b": 200}
+    # what apply submits comes from the plan file alone
+    renamed = {raw: (names[0], names[1].upper(), names[2]) for raw, names in alice.names.items()}
+    write_plan(path, [alice._replace(durations={"a": 100, "b": 300}, names=renamed)])
+    services.histories["alice"] = ["c", "b", "a"]
+    services.history_fetches.clear()
+    services.lookups.clear()
+
+    assert cli.run_apply(path) == 2
+    assert services.history_fetches == []
+    assert services.lookups == []
+    assert services.lastfm["alice"].calls == [["A", "B"]]
+    assert "bob" not in services.lastfm
+    assert [play[1] for play in stored_plays(str(tmp_path / "scrobbles.db"), "alice")] == [0, 100]
+    assert cli.create_snapshots().last_processed("alice") == read_plan(path)[0].fingerprint
+
+
+def test_apply_refuses_stale_accounts(services, tmp_path):
+    path = str(tmp_path / "run.plan")
+    cli.run_plan(path)
+    # alice was processed since, and bob's synced window moved without a new history
+    cli.create_snapshots().mark_processed("alice", "other")
+    db = SQLite(str(tmp_path / "scrobbles.db"))
+    db.insert_tracks([Track("x", "x", "artist x", "album", 1)], account_id=db.get_or_create_account("bob"))
+    db.close()
+
+    with pytest.raises(RuntimeError, match="alice, bob"):
+        cli.run_apply(path)
+    assert services.lastfm == {}
+    assert cli.create_snapshots().last_processed("alice") == "other"
+
+
+def test_apply_again_resumes_after_a_failure(services, tmp_path):
+    path = str(tmp_path / "run.plan")
+    plans = cli.run_plan(path)
+    services.lastfm["alice"] = FakeAuthLastFM()
+    services.lastfm["alice"].fail_on_call = 1
+
+    with pytest.raises(RuntimeError, match="Last.fm is down"):
+        cli.run_apply(path)
+    assert "bob" not in services.lastfm
+
+    # alice's scrobbles are delivered from the outbox without being planned twice, bob's plan is applied
+    assert cli.run_apply(path) == 4
+    assert services.lastfm["alice"].calls == [["a", "b"]]
+    assert services.lastfm["bob"].calls == [["y", "z"]]
+    snapshots = cli.create_snapshots()
+    assert [snapshots.last_processed(plan.account) for plan in plans] == [plan.fingerprint for plan in plans]
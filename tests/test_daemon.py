@@ -0,0 +1,120 @@
+import asyncio
+from types import SimpleNamespace
+from unittest import mock
+
+import pytest
+
+from ytm2lfm.daemon import AdaptiveInterval, Daemon
+
+from .test_scrobbler import FakeLastFM, FakeYTMusic
+
+SCROBBLER_SETTINGS = SimpleNamespace(
+    sequence_match_length=2,
+    reconcile_mode="overlap",
+    max_diff_cost=400,
+    max_synced_tracks=200,
+    batch_size=50,
+    rate_limit=100.0,
+    rate_limit_burst=100,
+    max_retries=0,
+    default_duration=180,
+    max_duration_lookups=20,
+    dedupe_window=1800,
+)
+
+
+class FakeDaemon(Daemon):
+    def __init__(self, *args, histories, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.histories = histories
+        self.lastfm_clients = {}
+        self.ytmusic_logins = 0
+
+    def create_ytmusic_client(self, account):
+        self.ytmusic_logins += 1
+        return FakeYTMusic(self.histories[account.name])
+
+    def create_lastfm_client(self, account):
+        return self.lastfm_clients.setdefault(account.name, FakeLastFM())
+
+
+@pytest.fixture
+def daemon(db):
+    accounts = [SimpleNamespace(name="alice"), SimpleNamespace(name="bob")]
+    daemon = FakeDaemon(db, accounts, SCROBBLER_SETTINGS, histories={"alice": ["b", "a"], "bob": ["z", "y"]})
+    yield daemon
+    daemon.close()
+
+
+def test_run_once_serves_all_accounts_with_warm_clients(daemon):
+    assert asyncio.run(daemon.run_once()) == [2, 2]
+    assert daemon.lastfm_clients["alice"].calls == [["a", "b"]]
+    assert daemon.lastfm_clients["bob"].calls == [["y", "z"]]
+
+    daemon.histories["alice"].insert(0, "c")
+    assert asyncio.run(daemon.run_once()) == [1, 0]
+    assert daemon.lastfm_clients["alice"].calls == [["a", "b"], ["c"]]
+    assert daemon.ytmusic_logins == 2
+    assert [job.runs for job in daemon.jobs] == [2, 2]
+
+
+def test_failed_run_resets_clients(daemon):
+    with mock.patch.object(FakeYTMusic, "get_history", side_effect=RuntimeError("YouTube Music is down")):
+        assert asyncio.run(daemon.run_once()) == [None, None]
+    assert [job.failures for job in daemon.jobs] == [1, 1]
+    assert all(job.scrobbler.ytmusic is None for job in daemon.jobs)
+
+    assert asyncio.run(daemon.run_once()) == [2, 2]
+
+
+def test_run_until_stopped(daemon):
+    daemon.interval = 0.01
+
+    async def run():
+        task = asyncio.create_task(daemon.run())
+        await asyncio.sleep(0.1)
+        daemon.stop()
+        await task
+
+    asyncio.run(run())
+    assert all(job.runs >= 2 for job in daemon.jobs)
+
+
+def test_unchanged_history_skips_database_and_lastfm(daemon, db):
+    asyncio.run(daemon.run_once())
+
+    with mock.patch.object(db, "transaction") as transaction, mock.patch.object(db, "fetch_pending_scrobbles") as fetch:
+        assert asyncio.run(daemon.run_once()) == [0, 0]
+    transaction.assert_not_called()
+    fetch.assert_not_called()
+    assert not any(job.history_changed for job in daemon.jobs)
+
+
+def test_adaptive_interval():
+    interval = AdaptiveInterval(10, 60, backoff=2)
+
+    assert [interval.update(changed=False) for _ in range(4)] == [20, 40, 60, 60]
+    assert interval.update(changed=True) == 10
+    with pytest.raises(ValueError):
+        AdaptiveInterval(10, 5)
+
+
+def test_watch_mode_polls_idle_accounts_less_often(db):
+    accounts = [SimpleNamespace(name="alice")]
+    daemon = FakeDaemon(
+        db, accounts, SCROBBLER_SETTINGS, interval=0.01, max_interval=10, histories={"alice": ["b", "a"]}
+    )
+
+    async def run():
+        task = asyncio.create_task(daemon.run())
+        await asyncio.sleep(0.2)
+        daemon.stop()
+        await task
+
+    try:
+        asyncio.run(run())
+    finally:
+        daemon.close()
+    # the first run sees a new history, then the interval doubles after each unchanged poll
+    assert 3 <= daemon.jobs[0].runs <= 6
+    assert daemon.jobs[0].interval.current > 0.01
@@ -1,22 +1,13 @@
-import os
-import sqlite3
-import tempfile
 from pathlib import Path
 
 import pytest
 
 from ytm2lfm.database import SQLite
+from ytm2lfm.track import Track
 
 # Assuming the SQLite class code is already imported and available here
 
 
-@pytest.fixture
-def temp_db_path():
-    with tempfile.TemporaryDirectory() as tmpdirname:
-        db_path = os.path.join(tmpdirname, "test_scrobbles.db")
-        yield db_path
-
-
 def test_ensure_db_dir_creates_directory(temp_db_path):
     _ = SQLite(temp_db_path)
     assert Path(temp_db_path).parent.exists()
@@ -33,19 +24,19 @@ def test_init_db_creates_table(temp_db_path):
 def test_insert_and_fetch_tracks(temp_db_path):
     db = SQLite(temp_db_path)
     tracks = [
-        {"video_id": "vid1", "title": "title1", "artist": "artist1", "album": "album1", "played": "Today"},
-        {"video_id": "vid2", "title": "title2", "artist": "artist2", "album": "album2", "played": "Last Week"},
+        Track("vid1", "title1", "artist1", "album1", "Today"),
+        Track("vid2", "title2", "artist2", "album2", "Last Week"),
     ]
     n_inserted_rows = db.insert_tracks(tracks)
     rows = db.fetch_latest_scrobbles()
     assert len(rows) == n_inserted_rows == 2
-    assert rows[0]["video_id"] == "vid2"  # Latest inserted first
+    assert rows[0].video_id == "vid2"  # Latest inserted first
 
 
 def test_delete_all_tracks(temp_db_path):
     db = SQLite(temp_db_path)
     tracks = [
-        {"video_id": "vid1", "title": "title1", "artist": "artist1", "album": "album1", "played": 1},
+        Track("vid1", "title1", "artist1", "album1", 1),
     ]
     db.insert_tracks(tracks)
     db.delete_all_tracks()
@@ -55,19 +46,150 @@ def test_delete_all_tracks(temp_db_path):
 
 def test_delete_except_latest_n(temp_db_path):
     db = SQLite(temp_db_path)
-    tracks = [
-        {"video_id": f"vid{i}", "title": f"title{i}", "artist": f"artist{i}", "album": f"album{i}", "played": "Today"}
-        for i in range(1, 6)
-    ]
+    tracks = [Track(f"vid{i}", f"title{i}", f"artist{i}", f"album{i}", "Today") for i in range(1, 6)]
     db.insert_tracks(tracks)
     db.delete_except_latest_n(2)
     rows = db.fetch_latest_scrobbles()
     assert len(rows) == 2
-    assert rows[0]["video_id"] == "vid5"
-    assert rows[1]["video_id"] == "vid4"
+    assert rows[0].video_id == "vid5"
+    assert rows[1].video_id == "vid4"
 
 
 def test_delete_except_latest_n_invalid_value(temp_db_path):
     db = SQLite(temp_db_path)
     with pytest.raises(ValueError):
         db.delete_except_latest_n(0)
+
+
+def test_pragmas_applied(temp_db_path):
+    db = SQLite(temp_db_path)
+    with db.transaction() as conn:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1  # NORMAL
+
+
+@pytest.mark.parametrize("persistent", [True, False])
+def test_transaction_groups_writes_and_rolls_back_on_error(temp_db_path, persistent):
+    db = SQLite(temp_db_path, persistent=persistent)
+    track = Track("vid1", "title1", "artist1", "album1", 1)
+
+    with pytest.raises(RuntimeError):
+        with db.transaction():
+            db.insert_tracks([track])
+            db.insert_tracks([track._replace(video_id="vid2")])
+            raise RuntimeError("boom")
+    assert db.fetch_latest_scrobbles() == []
+
+    with db.transaction():
+        db.insert_tracks([track])
+        db.delete_except_latest_n(1)
+    assert [row.video_id for row in db.fetch_latest_scrobbles()] == ["vid1"]
+
+
+def test_accounts_are_isolated(temp_db_path):
+    db = SQLite(temp_db_path)
+    assert db.get_or_create_account("default") == 1
+    other = db.get_or_create_account("other")
+    assert other != 1
+    assert db.get_or_create_account("other") == other
+
+    tracks = [Track(f"vid{i}", f"title{i}", f"artist{i}", f"album{i}", 1) for i in range(1, 4)]
+    db.insert_tracks(tracks)
+    db.insert_tracks(tracks, account_id=other)
+    db.delete_except_latest_n(1, account_id=other)
+
+    assert len(db.fetch_latest_scrobbles()) == 3
+    assert [row.video_id for row in db.fetch_latest_scrobbles(account_id=other)] == ["vid3"]
+
+    db.delete_all_tracks(account_id=other)
+    assert db.fetch_latest_scrobbles(account_id=other) == []
+    assert len(db.fetch_latest_scrobbles()) == 3
+
+
+@pytest.mark.parametrize("persistent", [True, False])
+def test_iter_latest_scrobbles(temp_db_path, persistent):
+    db = SQLite(temp_db_path, persistent=persistent)
+    tracks = [Track(f"vid{i}", f"title{i}", f"artist{i}", f"album{i}", 1) for i in range(1, 6)]
+    db.insert_tracks(tracks)
+
+    rows = list(db.iter_latest_scrobbles(("video_id", "title"), limit=2))
+    assert [tuple(row) for row in rows] == [("vid5", "title5"), ("vid4", "title4")]
+
+    # a partially consumed generator does not block writes
+    rows = db.iter_latest_scrobbles(("video_id",))
+    assert next(rows)["video_id"] == "vid5"
+    db.insert_tracks([tracks[0]._replace(video_id="vid6")])
+    rows.close()
+    assert db.fetch_latest_scrobbles()[0].video_id == "vid6"
+
+
+def test_iter_latest_scrobbles_invalid_columns(temp_db_path):
+    db = SQLite(temp_db_path)
+    with pytest.raises(ValueError):
+        list(db.iter_latest_scrobbles(("video_id", "id; DROP TABLE scrobbles")))
+
+
+@pytest.mark.parametrize("separate_archive", [False, True])
+def test_window_is_a_ring_buffer(temp_db_path, separate_archive):
+    db = SQLite(temp_db_path, archive_path=temp_db_path + ".archive" if separate_archive else None, window_size=4)
+    january = 1704067200  # 2024-01-01
+    tracks = [Track(f"vid{i}", "title", "artist", "", 1, january + i) for i in range(11)]
+
+    assert db.get_high_water_mark() == 0
+    assert db.insert_tracks(tracks[:3]) == 3
+    assert db.get_high_water_mark() == 3
+    # wraps around, overwriting the oldest slots
+    assert db.insert_tracks(tracks[3:6]) == 3
+    assert [row.video_id for row in db.fetch_latest_scrobbles()] == ["vid5", "vid4", "vid3", "vid2"]
+    assert [row[0] for row in db.iter_latest_scrobbles(("video_id",), limit=3)] == ["vid5", "vid4", "vid3"]
+    assert [row.video_id for row in db.iter_archived_scrobbles()] == ["vid1", "vid0"]
+    # more tracks than the window at once
+    assert db.insert_tracks(tracks[6:] + tracks[4:5]) == 5
+    assert [row.video_id for row in db.fetch_latest_scrobbles()] == ["vid10", "vid9", "vid8", "vid7"]
+    assert [row.video_id for row in db.iter_archived_scrobbles()] == [f"vid{i}" for i in range(6, -1, -1)]
+
+    # retention is already done by the inserts
+    assert db.archive_except_latest_n(4) == 0
+    assert db.archive_except_latest_n(2) == 2
+    assert [row.video_id for row in db.fetch_latest_scrobbles()] == ["vid10", "vid9"]
+    with db.transaction() as conn:
+        assert [row[0] for row in conn.execute("SELECT slot FROM scrobbles ORDER BY slot")] == [1, 2]
+
+
+@pytest.mark.parametrize("separate_archive", [False, True])
+def test_archive_except_latest_n(temp_db_path, separate_archive):
+    archive_path = temp_db_path + ".archive" if separate_archive else None
+    db = SQLite(temp_db_path, archive_path=archive_path)
+    january, february = 1704067200, 1706745600  # 2024-01-01, 2024-02-01
+    tracks = [
+        Track(f"vid{i}", f"title{i}", f"artist{i}", "", 1, t)
+        for i, t in enumerate([january, january + 60, february, february + 60, february + 120])
+    ]
+    db.insert_tracks(tracks)
+
+    assert db.archive_except_latest_n(2) == 3
+    assert db.archive_except_latest_n(2) == 0
+    assert [row.video_id for row in db.fetch_latest_scrobbles()] == ["vid4", "vid3"]
+    assert [row.video_id for row in db.iter_archived_scrobbles()] == ["vid2", "vid1", "vid0"]
+    assert [row.video_id for row in db.iter_archived_scrobbles(end=february - 1)] == ["vid1", "vid0"]
+    assert [row.video_id for row in db.iter_archived_scrobbles(start=january + 60, end=january + 60)] == ["vid1"]
+    assert list(db.iter_archived_scrobbles(account_id=2)) == []
+
+    with db.transaction() as conn:
+        schema = "archive" if separate_archive else "main"
+        tables = {row[0] for row in conn.execute(f"SELECT name FROM {schema}.sqlite_master WHERE type = 'table'")}
+    assert {"archive_scrobbles_202401", "archive_scrobbles_202402"} <= tables
+
+
+@pytest.mark.parametrize("separate_archive", [False, True])
+def test_archive_tracks_never_collides_with_archived_scrobbles(temp_db_path, separate_archive):
+    db = SQLite(temp_db_path, archive_path=temp_db_path + ".archive" if separate_archive else None)
+    january = 1704067200  # 2024-01-01
+    imported = [Track(f"old{i}", "title", "artist", "", 1, january + i) for i in range(3)]
+
+    assert db.archive_tracks(imported) == 3
+    assert db.archive_tracks(imported[:2]) == 0
+
+    db.insert_tracks([Track(f"vid{i}", "title", "artist", "", 1, january + 100 + i) for i in range(4)])
+    assert db.archive_except_latest_n(1) == 3
+    assert [row.video_id for row in db.iter_archived_scrobbles()] == ["vid2", "vid1", "vid0", "old2", "old1", "old0"]
@@ -0,0 +1,165 @@
+from unittest import mock
+
+import pytest
+
+from ytm2lfm.database import DEFAULT_ACCOUNT_ID
+from ytm2lfm.dedupe import BloomFilter, DuplicateFilter, LastFMDuplicateFilter
+from ytm2lfm.track import Track
+
+# 2024-01-31T23:59:00Z, the bucket window spans two archive months
+T0 = 1706745540
+
+
+def play(video_id, timestamp):
+    return Track(video_id, f"title {video_id}", "artist", "", "", timestamp)
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter.for_capacity(10_000, 0.01)
+    keys = [f"key{i}" for i in range(10_000)]
+    for key in keys:
+        bloom.add(key)
+
+    assert all(key in bloom for key in keys)
+    false_positives = sum(f"other{i}" in bloom for i in range(10_000))
+    assert false_positives < 200
+
+    copy = BloomFilter(bloom.size, bloom.hashes, bloom.to_bytes())
+    assert all(key in copy for key in keys)
+    with pytest.raises(ValueError):
+        BloomFilter(bloom.size, bloom.hashes, b"\0")
+
+
+def test_filter_new_confirms_possible_hits(db):
+    db.insert_tracks([play("window", T0 + 600)])
+    db.archive_tracks([play("archived", T0), play("next_month", T0 + 120)])
+    duplicates = DuplicateFilter(db, bucket=30)
+
+    candidates = [
+        play("window", T0 + 620),
+        play("window", T0 + 630),
+        play("archived", T0 + 29),
+        play("archived", T0 - 29),
+        play("archived", T0 + 60),
+        play("next_month", T0 + 100),
+        play("new", T0),
+    ]
+    assert [(track.video_id, track.timestamp) for track in duplicates.filter_new(candidates)] == [
+        ("window", T0 + 630),
+        ("archived", T0 + 60),
+        ("new", T0),
+    ]
+
+
+def test_filter_is_persisted_and_caught_up_incrementally(db):
+    db.archive_tracks([play(f"vid{i}", T0 - 3600 * i) for i in range(10)])
+    duplicates = DuplicateFilter(db, capacity=100)
+    assert duplicates.load() == 10
+    duplicates.save()
+
+    db.archive_tracks([play("vid10", T0 - 36000)])
+    reloaded = DuplicateFilter(db, capacity=100)
+    assert reloaded.load() == 1
+    assert (reloaded.count, reloaded.watermark) == (11, duplicates.watermark + 1)
+    assert reloaded.filter_new([play("vid10", T0 - 36000)]) == []
+
+    # other settings rebuild the filter
+    assert DuplicateFilter(db, bucket=60, capacity=100).load() == 11
+
+
+def test_filter_is_sized_for_the_stored_plays_and_grows_past_them(db):
+    db.archive_tracks([play(f"vid{i}", T0 - 3600 * i) for i in range(10)])
+    duplicates = DuplicateFilter(db, capacity=4)
+    duplicates.load()
+    assert (duplicates.capacity, duplicates.count) == (20, 10)
+
+    db.archive_tracks([play(f"vid{i}", T0 - 3600 * i) for i in range(10, 25)])
+    duplicates.refresh()
+    duplicates.save()
+    assert (duplicates.capacity, duplicates.count) == (50, 25)
+    assert all(duplicates.might_contain(f"vid{i}", T0 - 3600 * i) for i in range(25))
+    # the grown filter is loaded as it is
+    reloaded = DuplicateFilter(db, capacity=4)
+    assert reloaded.load() == 0
+    assert reloaded.capacity == 50
+
+
+def test_insert_only_looks_up_possible_duplicates(db):
+    duplicates = DuplicateFilter(db, capacity=100)
+    statements = []
+    with db.transaction() as conn:
+        conn.set_trace_callback(statements.append)
+
+    assert db.insert_tracks([play("a", T0), play("b", T0 + 200)], duplicates=duplicates) == 2
+    assert not any(statement.startswith("SELECT 1 FROM scrobbles") for statement in statements)
+    # the filter holds the inserted plays
+    assert (duplicates.count, duplicates.might_contain("a", T0)) == (2, True)
+
+    statements.clear()
+    assert db.insert_tracks([play("a", T0), play("c", T0 + 400)], duplicates=duplicates) == 1
+    assert sum(statement.startswith("SELECT 1 FROM scrobbles") for statement in statements) == 1
+    assert [row.video_id for row in db.fetch_latest_scrobbles()] == ["c", "b", "a"]
+
+    # nothing was stored since the insert, the filter catches up without reading the plays
+    statements.clear()
+    assert (duplicates.refresh(), duplicates.count) == (0, 3)
+    assert not any("scrobbles" in statement for statement in statements if "sequences" not in statement)
+
+
+def test_rolled_back_insert_does_not_move_the_filter_past_reused_ids(db):
+    duplicates = DuplicateFilter(db, capacity=100)
+    db.insert_tracks([play("a", T0)], duplicates=duplicates)
+    duplicates.save()
+
+    with pytest.raises(RuntimeError):
+        with db.transaction():
+            db.insert_tracks([play("b", T0 + 200)], duplicates=duplicates)
+            raise RuntimeError("boom")
+    # the id of "b" is reserved again by a play stored without the filter
+    db.insert_tracks([play("c", T0 + 400)])
+
+    assert duplicates.might_contain("c", T0 + 400)
+    assert duplicates.might_contain("a", T0)
+    assert duplicates.watermark == db.get_last_id()
+
+
+def test_filter_only_catches_up_with_the_plays_of_its_account(db):
+    other = db.get_or_create_account("other")
+    duplicates = DuplicateFilter(db, capacity=100)
+    duplicates.load()
+
+    statements = []
+    with db.transaction() as conn:
+        conn.set_trace_callback(statements.append)
+    db.insert_tracks([play("a", T0)], account_id=other)
+    statements.clear()
+    assert duplicates.refresh() == 0
+    assert not any("archive_scrobbles" in statement for statement in statements)
+
+    db.insert_tracks([play("a", T0)])
+    assert duplicates.refresh() == 1
+
+
+def test_lastfm_filter_confirms_possible_hits_in_one_query(db):
+    db.insert_lastfm_history([("artist", "title a", T0), ("artist", "title b", T0 - 7200)])
+    duplicates = LastFMDuplicateFilter(db, bucket=1801, capacity=100)
+    candidates = [play("a", T0 + 600), play("b", T0), play("c", T0 + 1200)]
+
+    with mock.patch.object(db, "fetch_lastfm_history_between", wraps=db.fetch_lastfm_history_between) as query:
+        assert duplicates.filter_new(candidates) == candidates[1:]
+    assert query.call_count == 1
+
+    # scrobbles seeded since the filter was loaded are caught up with
+    db.insert_lastfm_history([("artist", "title c", T0 + 1000)])
+    assert duplicates.filter_new(candidates) == candidates[1:2]
+    # no possible hit, no query
+    with mock.patch.object(db, "fetch_lastfm_history_between") as query:
+        assert duplicates.filter_new([play("d", T0)]) == [play("d", T0)]
+    query.assert_not_called()
+
+
+def test_lastfm_filter_is_not_built_without_seeded_scrobbles(db):
+    duplicates = LastFMDuplicateFilter(db, bucket=1801)
+    assert duplicates.filter_new([play("a", T0)]) == [play("a", T0)]
+    assert duplicates._bloom is None
+    assert db.load_duplicate_filter(DEFAULT_ACCOUNT_ID, duplicates.source) is None
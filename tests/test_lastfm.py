@@ -0,0 +1,85 @@
+import os
+import stat
+import tempfile
+from unittest import mock
+
+import pylast
+import pytest
+
+from ytm2lfm.lastfm import LastFMClient, SessionKeyCache
+
+
+@pytest.fixture
+def session_cache():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        yield SessionKeyCache(os.path.join(tmpdirname, "sessions", "lastfm_sessions.json"))
+
+
+@pytest.fixture
+def lastfm_api():
+    with (
+        mock.patch.object(pylast.SessionKeyGenerator, "get_session_key", side_effect=["sk1", "sk2"]) as auth,
+        mock.patch.object(pylast.LastFMNetwork, "scrobble_many") as scrobble_many,
+    ):
+        yield auth, scrobble_many
+
+
+def create_client(session_cache):
+    return LastFMClient("key", "secret", "user", "password", session_cache=session_cache)
+
+
+def test_authenticates_lazily_once_across_runs(session_cache, lastfm_api):
+    auth, scrobble_many = lastfm_api
+
+    client = create_client(session_cache)
+    auth.assert_not_called()
+    client.scrobble_many([{"artist": "a", "title": "t", "timestamp": 1}])
+    client.scrobble_many([{"artist": "a", "title": "t", "timestamp": 2}])
+    assert auth.call_count == 1
+    assert scrobble_many.call_count == 2
+
+    assert stat.S_IMODE(os.stat(session_cache.path).st_mode) == 0o600
+    assert session_cache.get("key", "user") == "sk1"
+
+    # the next run reuses the cached session key
+    client = create_client(session_cache)
+    assert client.session_key == "sk1"
+    client.scrobble_many([{"artist": "a", "title": "t", "timestamp": 3}])
+    assert auth.call_count == 1
+
+
+def test_authenticates_again_on_invalid_session(session_cache, lastfm_api):
+    auth, scrobble_many = lastfm_api
+    session_cache.set("key", "user", "expired")
+    scrobble_many.side_effect = [pylast.WSError(None, "9", "Invalid session key"), None]
+
+    client = create_client(session_cache)
+    client.scrobble_many([{"artist": "a", "title": "t", "timestamp": 1}])
+    assert auth.call_count == 1
+    assert scrobble_many.call_count == 2
+    assert session_cache.get("key", "user") == "sk1"
+
+
+def test_other_errors_do_not_authenticate_again(session_cache, lastfm_api):
+    auth, scrobble_many = lastfm_api
+    session_cache.set("key", "user", "sk0")
+    scrobble_many.side_effect = pylast.WSError(None, "29", "Rate limit exceeded")
+
+    with pytest.raises(pylast.WSError):
+        create_client(session_cache).scrobble_many([{"artist": "a", "title": "t", "timestamp": 1}])
+    auth.assert_not_called()
+    assert session_cache.get("key", "user") == "sk0"
+
+
+def test_get_recent_tracks(session_cache):
+    client = create_client(session_cache)
+    played = [
+        pylast.PlayedTrack(pylast.Track("Now", "Playing", client), "", "", None),
+        pylast.PlayedTrack(pylast.Track("Artist & Co", "Title", client), "", "", "1700000000"),
+        pylast.PlayedTrack(pylast.Track("Other", "Song", client), "", "", "1690000000"),
+    ]
+    with mock.patch.object(pylast.User, "get_recent_tracks", return_value=played) as get_recent_tracks:
+        scrobbles = client.get_recent_tracks(199, time_from=1680000000, time_to=1700000001)
+
+    assert scrobbles == [("Artist & Co", "Title", 1700000000), ("Other", "Song", 1690000000)]
+    get_recent_tracks.assert_called_once_with(limit=199, cacheable=False, time_from=1680000000, time_to=1700000001)
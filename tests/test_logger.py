@@ -0,0 +1,82 @@
+import atexit
+import io
+import json
+import logging
+
+import pytest
+
+from ytm2lfm.logger import ContextFilter, JSONFormatter, log_context, setup_logging
+
+
+@pytest.fixture
+def restore_logging():
+    logger = logging.getLogger("ytm2lfm")
+    handlers, propagate = logger.handlers[:], logger.propagate
+    yield
+    for handler in logger.handlers:
+        handler.close()
+    logger.handlers[:] = handlers
+    logger.propagate = propagate
+
+
+def make_record(msg, *args, **kwargs):
+    return logging.LogRecord("ytm2lfm.test", logging.INFO, __file__, 1, msg, args, None, **kwargs)
+
+
+def test_context_fields():
+    record = make_record("hello")
+    with log_context(account="alice"):
+        with log_context(run=2):
+            ContextFilter().filter(record)
+
+    assert record.account == "alice"
+    assert record.run == 2
+    assert record.context == "[account=alice] [run=2] "
+
+    ContextFilter().filter(record)
+    assert record.context == ""
+
+
+def test_json_formatter():
+    record = make_record("Scrobbled %s tracks", 3)
+    with log_context(account="alice"):
+        ContextFilter().filter(record)
+
+    entry = json.loads(JSONFormatter().format(record))
+
+    assert entry["message"] == "Scrobbled 3 tracks"
+    assert entry["level"] == "INFO"
+    assert entry["logger"] == "ytm2lfm.test"
+    assert entry["account"] == "alice"
+    assert "context" not in entry
+
+
+@pytest.mark.parametrize("queue", [True, False])
+def test_setup_logging(restore_logging, monkeypatch, queue):
+    stdout, stderr = io.StringIO(), io.StringIO()
+    monkeypatch.setattr("sys.stdout", stdout)
+    monkeypatch.setattr("sys.stderr", stderr)
+
+    listener = setup_logging(json_format=True, queue=queue)
+    logger = logging.getLogger("ytm2lfm.test")
+    args = ["tracks"]
+    with log_context(account="alice"):
+        logger.info("Scrobbled %s", args)
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            logger.error("Failed", exc_info=True)
+    # the message is rendered when the record is queued, not when the listener writes it
+    args.append("changed")
+    if queue:
+        assert listener is not None
+        listener.stop()
+        atexit.unregister(listener.stop)
+    else:
+        assert listener is None
+
+    info = json.loads(stdout.getvalue())
+    error = json.loads(stderr.getvalue())
+    assert (info["message"], info["account"]) == ("Scrobbled ['tracks']", "alice")
+    assert (error["message"], error["account"]) == ("Failed", "alice")
+    assert "ValueError: boom" in error["exception"]
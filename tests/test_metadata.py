@@ -0,0 +1,55 @@
+import pytest
+
+from ytm2lfm.metadata import TrackMetadataCache, history_duration, parse_duration, spaced_timestamps
+
+
+class FakeClock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_parse_duration():
+    assert parse_duration("3:25") == 205
+    assert parse_duration("1:02:03") == 3723
+    assert parse_duration("") is None
+    assert parse_duration("live") is None
+    assert history_duration({"duration_seconds": 42, "duration": "3:25"}) == 42
+    assert history_duration({"duration": "0:30"}) == 30
+    assert history_duration({}) is None
+
+
+def test_cache_persists_and_is_shared(db):
+    cache = TrackMetadataCache(db, capacity=1)
+    cache.put({"a": 100, "b": 200})
+    assert cache.get(["a", "b", "c"]) == {"a": 100, "b": 200}
+    assert TrackMetadataCache(db).get(["b", "a"]) == {"a": 100, "b": 200}
+
+
+def test_cache_entries_expire(db):
+    clock = FakeClock()
+    cache = TrackMetadataCache(db, ttl=60, clock=clock)
+    cache.put({"a": 100})
+    clock.now += 30
+    cache.put({"b": 200})
+
+    clock.now += 45
+    assert cache.get(["a", "b"]) == {"b": 200}
+    assert TrackMetadataCache(db, clock=clock).get(["a", "b"]) == {"b": 200}
+    assert cache.evict_expired() == 1
+    assert cache.evict_expired() == 0
+
+
+def test_spaced_timestamps():
+    assert spaced_timestamps([180, 200, 0], now=1000) == [820, 620, 619]
+    # squeezed after the latest scrobble, still strictly decreasing
+    assert spaced_timestamps([180, 200, 300], now=1000, floor=700) == [820, 702, 701]
+    # just enough room after the latest scrobble, never in the future
+    assert spaced_timestamps([180, 200, 300], now=1000, floor=997) == [1000, 999, 998]
+    # no room, the plays would collide with the latest scrobble
+    with pytest.raises(ValueError):
+        spaced_timestamps([180, 200, 300], now=1000, floor=999)
+    with pytest.raises(ValueError):
+        spaced_timestamps([180, 200], now=1000, floor=1005)
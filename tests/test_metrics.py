@@ -0,0 +1,100 @@
+import json
+import urllib.request
+
+import pytest
+
+from ytm2lfm.metrics import Metrics
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_disabled_records_nothing():
+    metrics = Metrics()
+
+    with metrics.span("get_history"):
+        pass
+    metrics.inc("batches")
+    metrics.set_gauge("database_bytes", 1024)
+
+    assert metrics.summary() == {"stages": {}, "counters": {}, "gauges": {}}
+    assert metrics.span("a") is metrics.span("b")
+
+
+def test_spans_and_timed():
+    clock = FakeClock()
+    metrics = Metrics(enabled=True, clock=clock)
+
+    @metrics.timed("db_insert")
+    def insert(seconds):
+        clock.now += seconds
+        return seconds
+
+    for seconds in (1.0, 3.0):
+        with metrics.span("get_history"):
+            clock.now += seconds
+    assert insert(0.5) == 0.5
+    with pytest.raises(ValueError):
+        with metrics.span("parse"):
+            clock.now += 2
+            raise ValueError()
+
+    assert metrics.summary()["stages"] == {
+        "db_insert": {"count": 1, "seconds": 0.5, "max_seconds": 0.5},
+        "get_history": {"count": 2, "seconds": 4.0, "max_seconds": 3.0},
+        "parse": {"count": 1, "seconds": 2.0, "max_seconds": 2.0},
+    }
+
+
+def test_render_prometheus():
+    metrics = Metrics(enabled=True, clock=FakeClock())
+    metrics.observe("scrobble_batch", 0.25)
+    metrics.inc("tracks_scrobbled", 50)
+    metrics.inc("retries", reason="rate_limit")
+    metrics.inc("retries", 2, reason="transient")
+    metrics.set_gauge("database_bytes", 12_345_678)
+
+    assert metrics.render_prometheus().splitlines() == [
+        "# TYPE ytm2lfm_stage_seconds summary",
+        'ytm2lfm_stage_seconds_sum{stage="scrobble_batch"} 0.250000',
+        'ytm2lfm_stage_seconds_count{stage="scrobble_batch"} 1',
+        "# TYPE ytm2lfm_stage_seconds_max gauge",
+        'ytm2lfm_stage_seconds_max{stage="scrobble_batch"} 0.250000',
+        "# TYPE ytm2lfm_retries_total counter",
+        'ytm2lfm_retries_total{reason="rate_limit"} 1',
+        'ytm2lfm_retries_total{reason="transient"} 2',
+        "# TYPE ytm2lfm_tracks_scrobbled_total counter",
+        "ytm2lfm_tracks_scrobbled_total 50",
+        "# TYPE ytm2lfm_database_bytes gauge",
+        "ytm2lfm_database_bytes 12345678",
+    ]
+
+
+def test_write_textfile_and_summary(tmp_path):
+    metrics = Metrics(enabled=True)
+    metrics.inc("runs")
+
+    metrics.write_textfile(str(tmp_path / "ytm2lfm.prom"))
+    metrics.write_summary(str(tmp_path / "summary.json"))
+
+    assert (tmp_path / "ytm2lfm.prom").read_text().endswith("ytm2lfm_runs_total 1\n")
+    assert json.loads((tmp_path / "summary.json").read_text())["counters"] == {"runs": 1}
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["summary.json", "ytm2lfm.prom"]
+
+
+def test_serve_http():
+    metrics = Metrics(enabled=True)
+    metrics.inc("batches", 3)
+
+    server = metrics.serve_http(0)
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.server_address[1]}/metrics") as response:
+            assert "ytm2lfm_batches_total 3" in response.read().decode()
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,160 @@
+import sqlite3
+
+import pytest
+
+from ytm2lfm.database import SQLite
+from ytm2lfm.migrations import SCHEMA_VERSION, get_schema_version
+from ytm2lfm.track import Track
+
+# lookup indexes of the synced window, rebuilt with it by migration 10
+WINDOW_INDEXES = {
+    "idx_scrobbles_account_id_video_id_timestamp",
+    "idx_scrobbles_account_id_timestamp",
+    "idx_scrobbles_account_id_artist_title",
+    "idx_scrobbles_id",
+}
+
+
+def _indexes(conn):
+    return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL")}
+
+
+def test_new_database_is_at_latest_version(temp_db_path):
+    db = SQLite(temp_db_path)
+    with db.transaction() as conn:
+        assert get_schema_version(conn) == SCHEMA_VERSION
+        assert WINDOW_INDEXES <= _indexes(conn)
+
+
+def test_unversioned_database_is_upgraded_in_place(temp_db_path):
+    conn = sqlite3.connect(temp_db_path)
+    conn.execute(
+        """
+        CREATE TABLE scrobbles (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            video_id TEXT NOT NULL,
+            title TEXT NOT NULL,
+            artist TEXT NOT NULL,
+            album TEXT,
+            played INTEGER NOT NULL
+        )
+        """
+    )
+    conn.execute("INSERT INTO scrobbles (video_id, title, artist, album, played) VALUES ('vid1', 't', 'a', '', 1)")
+    conn.commit()
+    conn.close()
+
+    db = SQLite(temp_db_path)
+    with db.transaction() as conn:
+        assert get_schema_version(conn) == SCHEMA_VERSION
+        assert WINDOW_INDEXES <= _indexes(conn)
+    assert [row.video_id for row in db.fetch_latest_scrobbles()] == ["vid1"]
+
+    # reopening does not apply the migrations again
+    SQLite(temp_db_path)
+
+
+def test_window_is_moved_to_a_ring_buffer(temp_db_path):
+    db = SQLite(temp_db_path)
+    with db.transaction() as conn:
+        conn.execute("PRAGMA user_version = 9")
+        conn.execute("DROP TABLE scrobbles")
+        conn.execute("DROP TABLE sync_windows")
+        conn.execute("DROP TABLE sequences")
+        conn.execute("DROP TABLE account_sequences")
+        conn.execute(
+            """
+            CREATE TABLE scrobbles (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                video_id TEXT NOT NULL,
+                title TEXT NOT NULL,
+                artist TEXT NOT NULL,
+                album TEXT,
+                played INTEGER NOT NULL,
+                timestamp INTEGER,
+                account_id INTEGER NOT NULL DEFAULT 1
+            )
+            """
+        )
+        conn.executemany(
+            "INSERT INTO scrobbles (video_id, title, artist, album, played, timestamp) VALUES (?, 't', 'a', '', 1, ?)",
+            [(f"vid{i}", 1704067200 + i) for i in range(4)],
+        )
+    db.close()
+
+    # the window takes the configured size on its next write, the older rows are archived
+    db = SQLite(temp_db_path, window_size=3)
+    with db.transaction() as conn:
+        assert WINDOW_INDEXES <= _indexes(conn)
+    assert [row.video_id for row in db.fetch_latest_scrobbles()] == ["vid3", "vid2", "vid1", "vid0"]
+    assert db.insert_tracks([Track("vid4", "t", "a", "", 1, 1704067204)]) == 1
+    assert [row.video_id for row in db.fetch_latest_scrobbles()] == ["vid4", "vid3", "vid2"]
+    assert [row.video_id for row in db.iter_archived_scrobbles()] == ["vid1", "vid0"]
+    assert db.get_first_synced_timestamp() == 1704067200
+    # ids keep following the previous ones
+    assert max(row[0] for row in db.iter_plays_after(0)) == 5
+
+
+def test_seeded_scrobbles_and_filters_are_keyed_by_source(temp_db_path):
+    db = SQLite(temp_db_path)
+    with db.transaction() as conn:
+        conn.execute("PRAGMA user_version = 10")
+        conn.execute("DROP TABLE lastfm_history")
+        conn.execute("DROP TABLE duplicate_filters")
+        conn.execute("DELETE FROM sequences WHERE name = 'lastfm_history'")
+        conn.execute("DROP TABLE account_sequences")
+        conn.execute("ALTER TABLE sync_windows DROP COLUMN first_timestamp")
+        conn.execute(
+            """
+            CREATE TABLE lastfm_history (
+                account_id INTEGER NOT NULL,
+                artist_key TEXT NOT NULL,
+                title_key TEXT NOT NULL,
+                timestamp INTEGER NOT NULL,
+                PRIMARY KEY (account_id, artist_key, title_key, timestamp)
+            ) WITHOUT ROWID
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE duplicate_filters (
+                account_id INTEGER PRIMARY KEY,
+                bucket INTEGER NOT NULL,
+                capacity INTEGER NOT NULL,
+                error_rate REAL NOT NULL,
+                count INTEGER NOT NULL,
+                watermark INTEGER NOT NULL,
+                bits BLOB NOT NULL
+            )
+            """
+        )
+        conn.executemany(
+            "INSERT INTO lastfm_history VALUES (1, 'artist', ?, ?)", [(f"title {i}", 1704067200 + i) for i in range(3)]
+        )
+        conn.execute("INSERT INTO duplicate_filters VALUES (1, 30, 100, 0.01, 0, 0, x'00')")
+    db.close()
+
+    db = SQLite(temp_db_path)
+    assert sorted(row[0] for row in db.iter_lastfm_history_after(0)) == [1, 2, 3]
+    assert db.load_duplicate_filter(source="plays")["bits"] == b"\0"
+    assert db.load_duplicate_filter(source="lastfm") is None
+    # new seeded scrobbles follow the migrated ones
+    assert db.insert_lastfm_history([("artist", "title 3", 1704067203)]) == 1
+    assert [row[0] for row in db.iter_lastfm_history_after(3)] == [4]
+
+
+def test_insert_skips_duplicates(temp_db_path):
+    db = SQLite(temp_db_path)
+    track = Track("vid1", "t", "a", "", 1, 100)
+    assert db.insert_tracks([track]) == 1
+    assert db.insert_tracks([track, track._replace(timestamp=200)]) == 1
+    assert len(db.fetch_latest_scrobbles()) == 2
+
+
+def test_newer_database_is_rejected(temp_db_path):
+    SQLite(temp_db_path)
+    conn = sqlite3.connect(temp_db_path)
+    conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION + 1}")
+    conn.close()
+    with pytest.raises(RuntimeError):
+        SQLite(temp_db_path)
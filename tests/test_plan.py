@@ -0,0 +1,43 @@
+import json
+import os
+import tempfile
+
+import pytest
+
+from ytm2lfm.plan import AccountPlan, read_plan, write_plan
+from ytm2lfm.track import Track
+
+
+@pytest.fixture
+def plan_path():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        yield os.path.join(tmpdirname, "run.plan")
+
+
+def test_write_and_read_plan(plan_path):
+    plans = [
+        AccountPlan(
+            account="alice",
+            fingerprint="f2",
+            last_processed="f1",
+            high_water_mark=42,
+            tracks=[
+                Track("vid2", "Song (Official Video)", "Artist - Topic", "", "Today"),
+                Track("vid1", "Café", "Åsa", "Album", "Yesterday"),
+            ],
+            durations={"vid2": 215},
+            names={("Artist - Topic", "Song (Official Video)", ""): ("Artist", "Song", "")},
+        ),
+        AccountPlan("bob", "f1", None, 0, [], {}, {}),
+    ]
+    write_plan(plan_path, plans)
+
+    assert read_plan(plan_path) == plans
+    assert not os.path.exists(plan_path + ".tmp")
+
+
+def test_read_plan_of_other_version(plan_path):
+    with open(plan_path, "w") as f:
+        json.dump({"version": 0, "accounts": []}, f)
+    with pytest.raises(ValueError):
+        read_plan(plan_path)
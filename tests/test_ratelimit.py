@@ -0,0 +1,106 @@
+import pytest
+
+from ytm2lfm.ratelimit import TokenBucket, call_with_retries
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class RateLimited(Exception):
+    pass
+
+
+class Transient(Exception):
+    pass
+
+
+def make_bucket(clock, **kwargs):
+    return TokenBucket(clock=clock, sleep=clock.sleep, **kwargs)
+
+
+def test_burst_then_paced():
+    clock = FakeClock()
+    bucket = make_bucket(clock, rate=2, burst=3)
+
+    assert [bucket.acquire() for _ in range(3)] == [0, 0, 0]
+    assert bucket.acquire() == pytest.approx(0.5)
+    assert bucket.acquire() == pytest.approx(0.5)
+    assert clock.now == pytest.approx(1.0)
+
+
+def test_aimd():
+    clock = FakeClock()
+    bucket = make_bucket(clock, rate=4, burst=1, min_rate=1, increase=0.5)
+
+    bucket.on_rate_limited()
+    assert bucket.rate == 2
+    bucket.on_rate_limited()
+    bucket.on_rate_limited()
+    assert bucket.rate == 1
+
+    for _ in range(10):
+        bucket.on_success()
+    assert bucket.rate == 4
+
+
+def test_invalid_bucket():
+    with pytest.raises(ValueError):
+        TokenBucket(rate=0, burst=1)
+
+
+def test_call_with_retries():
+    clock = FakeClock()
+    bucket = make_bucket(clock, rate=10, burst=10)
+    errors = [RateLimited(), Transient()]
+
+    def func():
+        if errors:
+            raise errors.pop(0)
+        return "ok"
+
+    result = call_with_retries(
+        func,
+        bucket,
+        is_rate_limited=lambda e: isinstance(e, RateLimited),
+        is_transient=lambda e: isinstance(e, Transient),
+        sleep=clock.sleep,
+    )
+    assert result == "ok"
+    assert bucket.rate == 5 + 0.1
+
+
+def test_call_with_retries_gives_up():
+    clock = FakeClock()
+    bucket = make_bucket(clock, rate=10, burst=10)
+    calls = []
+
+    def func():
+        calls.append(clock.now)
+        raise Transient()
+
+    with pytest.raises(Transient):
+        call_with_retries(
+            func,
+            bucket,
+            is_rate_limited=lambda e: False,
+            is_transient=lambda e: isinstance(e, Transient),
+            max_retries=3,
+            base_delay=1,
+            sleep=clock.sleep,
+        )
+    assert len(calls) == 4
+    # full jitter keeps each delay under the exponential bound
+    assert calls[-1] <= 1 + 2 + 4 + 0.3
+
+    calls.clear()
+    with pytest.raises(ValueError):
+        call_with_retries(lambda: calls.append(1) or int("x"), bucket, lambda e: False, lambda e: False)
+    assert len(calls) == 1
@@ -0,0 +1,52 @@
+import pytest
+
+from ytm2lfm.reconcile import HistoryChange, myers_diff, reconcile_history
+
+NEW, REPLAY, UNCHANGED = HistoryChange.NEW, HistoryChange.REPLAY, HistoryChange.UNCHANGED
+
+
+@pytest.mark.parametrize(
+    "old, new, expected",
+    [
+        ([], [], []),
+        (["a", "b"], [], []),
+        ([], ["a", "b"], []),
+        (["a", "b", "c"], ["a", "b", "c"], [(0, 0), (1, 1), (2, 2)]),
+        (["c", "b", "a"], ["e", "d", "c", "b"], [(0, 2), (1, 3)]),
+        (["a", "b", "c", "a", "b", "b", "a"], ["c", "b", "a", "b", "a", "c"], [(2, 0), (3, 2), (4, 3), (6, 4)]),
+    ],
+)
+def test_myers_diff(old, new, expected):
+    assert myers_diff(old, new) == expected
+
+
+def test_myers_diff_exceeding_max_cost():
+    assert myers_diff(["a", "b", "c"], ["d", "e", "f"], max_cost=5) is None
+    assert myers_diff(["a", "b", "c"], ["d", "e", "f"], max_cost=6) == []
+
+
+@pytest.mark.parametrize(
+    "history_list, snapshot_list, expected",
+    [
+        # two new tracks on top
+        (["f", "g", "e", "d", "c"], ["e", "d", "c", "b", "a"], [NEW, NEW, UNCHANGED, UNCHANGED, UNCHANGED]),
+        # "a" and "b" were played again and moved to the top
+        (["a", "b", "e", "d", "c"], ["e", "d", "c", "b", "a"], [REPLAY, REPLAY, UNCHANGED, UNCHANGED, UNCHANGED]),
+        # one new track and a replay
+        (["c", "f", "e", "d", "b"], ["e", "d", "c", "b", "a"], [REPLAY, NEW, UNCHANGED, UNCHANGED, UNCHANGED]),
+        # the second latest track was played again, not the latest one
+        (["s2", "s1", "s3", "s4"], ["s1", "s2", "s3", "s4"], [REPLAY, UNCHANGED, UNCHANGED, UNCHANGED]),
+        # nothing changed
+        (["e", "d", "c"], ["e", "d", "c"], [UNCHANGED, UNCHANGED, UNCHANGED]),
+        # history older than the stored snapshot is not scrobbled again
+        (["f", "e", "d", "x", "y"], ["e", "d"], [NEW, UNCHANGED, UNCHANGED, UNCHANGED, UNCHANGED]),
+        # empty snapshot, everything is new
+        (["b", "a"], [], [NEW, NEW]),
+    ],
+)
+def test_reconcile_history(history_list, snapshot_list, expected):
+    assert reconcile_history(history_list, snapshot_list) == expected
+
+
+def test_reconcile_history_exceeding_max_cost():
+    assert reconcile_history(["f", "g", "h"], ["e", "d", "c"], max_cost=2) is None
@@ -0,0 +1,223 @@
+import time
+from unittest import mock
+
+import pylast
+import pytest
+
+from ytm2lfm.metrics import metrics
+from ytm2lfm.scrobbler import Scrobbler
+
+
+class FakeLastFM:
+    def __init__(self, fail_on_call=None, errors=()):
+        self.calls = []
+        self.fail_on_call = fail_on_call
+        self.errors = list(errors)
+
+    def scrobble_many(self, tracks):
+        if len(self.calls) + 1 == self.fail_on_call:
+            self.fail_on_call = None
+            raise RuntimeError("Last.fm is down")
+        if self.errors:
+            raise self.errors.pop(0)
+        self.calls.append([track["title"] for track in tracks])
+
+
+class FakeYTMusic:
+    def __init__(self, video_ids, durations=None):
+        self.video_ids = video_ids
+        self.durations = durations or {}
+        self.lookups = []
+
+    def get_history(self):
+        return [
+            {
+                "videoId": video_id,
+                "title": video_id,
+                "artists": [{"name": f"artist {video_id}"}],
+                "album": {"name": "album"},
+                "played": "Today",
+                "duration": self.durations.get(video_id),
+            }
+            for video_id in self.video_ids
+        ]
+
+    def get_durations(self, video_ids):
+        self.lookups.append(list(video_ids))
+        return {video_id: 200 for video_id in video_ids}
+
+
+@pytest.fixture(autouse=True)
+def no_sleep():
+    with mock.patch("ytm2lfm.ratelimit.time.sleep"), mock.patch("ytm2lfm.ratelimit.random.uniform", return_value=0):
+        yield
+
+
+def test_interrupted_delivery_resumes_without_duplicates(db):
+    lastfm = FakeLastFM(fail_on_call=2)
+    scrobbler = Scrobbler(lastfm, FakeYTMusic(["e", "d", "c", "b", "a"]), db, min_overlap_length=2)
+
+    tracks = scrobbler.get_tracks_to_scrobble()
+    assert len(tracks) == 5
+    with pytest.raises(RuntimeError):
+        scrobbler.scrobble_tracks(tracks, batch_size=2)
+
+    assert lastfm.calls == [["a", "b"]]
+    assert db.count_pending_scrobbles() == 3
+    # the tracks were recorded when planned, so they are not detected as new again
+    assert scrobbler.get_tracks_to_scrobble() == []
+
+    assert scrobbler.deliver_pending(batch_size=2) == 3
+    assert lastfm.calls == [["a", "b"], ["c", "d"], ["e"]]
+    assert db.count_pending_scrobbles() == 0
+    assert scrobbler.deliver_pending(batch_size=2) == 0
+
+
+def test_sync_and_dry_run_do_not_scrobble(db):
+    lastfm = FakeLastFM()
+    scrobbler = Scrobbler(lastfm, FakeYTMusic(["c", "b", "a"]), db, min_overlap_length=2)
+
+    tracks = scrobbler.get_tracks_to_scrobble()
+    assert scrobbler.scrobble_tracks(tracks, dry_run=True) == 0
+    assert db.fetch_latest_scrobbles() == []
+
+    assert scrobbler.scrobble_tracks(tracks, sync=True) == 0
+    assert lastfm.calls == []
+    assert db.count_pending_scrobbles() == 0
+    assert len(db.fetch_latest_scrobbles()) == 3
+
+
+def test_delivery_retries_rate_limit_and_transient_errors(db):
+    lastfm = FakeLastFM(
+        errors=[
+            pylast.WSError(None, "29", "Rate limit exceeded"),
+            pylast.WSError(None, "16", "Temporarily unavailable"),
+        ]
+    )
+    scrobbler = Scrobbler(lastfm, FakeYTMusic(["b", "a"]), db, min_overlap_length=2)
+
+    assert scrobbler.scrobble_tracks(scrobbler.get_tracks_to_scrobble()) == 2
+    assert lastfm.calls == [["a", "b"]]
+    assert scrobbler.rate_limiter.rate < 5
+
+
+def test_delivery_does_not_retry_permanent_errors(db):
+    lastfm = FakeLastFM(errors=[pylast.WSError(None, "6", "Invalid parameters")])
+    scrobbler = Scrobbler(lastfm, FakeYTMusic(["b", "a"]), db, min_overlap_length=2)
+
+    with pytest.raises(pylast.WSError):
+        scrobbler.scrobble_tracks(scrobbler.get_tracks_to_scrobble())
+    assert lastfm.calls == []
+    assert db.count_pending_scrobbles() == 2
+
+
+def test_scrobbles_are_spaced_by_track_durations(db):
+    ytmusic = FakeYTMusic(["c", "b", "a"], durations={"c": "3:00", "a": "1:00:00"})
+    scrobbler = Scrobbler(FakeLastFM(), ytmusic, db, min_overlap_length=2)
+
+    with mock.patch("ytm2lfm.scrobbler.time.time", return_value=100_000):
+        scrobbler.enqueue_tracks(scrobbler.get_tracks_to_scrobble())
+
+    # c ends now, b was looked up (200s), a comes from the history (1h)
+    assert [(t.video_id, t.timestamp) for t in db.fetch_latest_scrobbles()] == [
+        ("c", 100_000 - 180),
+        ("b", 100_000 - 380),
+        ("a", 100_000 - 3980),
+    ]
+    assert ytmusic.lookups == [["b"]]
+
+    # durations are cached: a new run with the same tracks needs no lookup
+    scrobbler = Scrobbler(FakeLastFM(), FakeYTMusic(["c", "b", "a"]), db, min_overlap_length=2)
+    assert scrobbler.missing_durations(scrobbler.get_tracks_to_scrobble(history=ytmusic.get_history())) == []
+
+
+def test_spaced_scrobbles_stay_after_previous_ones(db):
+    scrobbler = Scrobbler(FakeLastFM(), FakeYTMusic(["b", "a"]), db, min_overlap_length=2, default_duration=600)
+
+    with mock.patch("ytm2lfm.scrobbler.time.time", return_value=100_000):
+        scrobbler.enqueue_tracks(scrobbler.get_tracks_to_scrobble())
+    scrobbler.ytmusic = FakeYTMusic(["d", "c", "b", "a"])
+    scrobbler.max_duration_lookups = 0
+    with mock.patch("ytm2lfm.scrobbler.time.time", return_value=100_060):
+        scrobbler.enqueue_tracks(scrobbler.get_tracks_to_scrobble())
+
+    timestamps = [t.timestamp for t in db.fetch_latest_scrobbles()]
+    assert timestamps == sorted(timestamps, reverse=True)
+    assert len(set(timestamps)) == 4
+
+
+def test_tracks_without_room_after_previous_ones_are_not_stored(db):
+    scrobbler = Scrobbler(FakeLastFM(), FakeYTMusic(["b", "a"]), db, min_overlap_length=2, default_duration=600)
+
+    with mock.patch("ytm2lfm.scrobbler.time.time", return_value=100_000):
+        scrobbler.enqueue_tracks(scrobbler.get_tracks_to_scrobble())
+    scrobbler.ytmusic = FakeYTMusic(["d", "c", "b", "a"])
+    scrobbler.max_duration_lookups = 0
+    # b started 600s before the first run, a single second is left after it for two plays
+    with mock.patch("ytm2lfm.scrobbler.time.time", return_value=100_000 - 600 + 1):
+        with pytest.raises(RuntimeError):
+            scrobbler.enqueue_tracks(scrobbler.get_tracks_to_scrobble())
+
+    assert [t.video_id for t in db.fetch_latest_scrobbles()] == ["b", "a"]
+    # the new tracks are detected again once there is room
+    assert [t.video_id for t in scrobbler.get_tracks_to_scrobble()] == ["d", "c"]
+
+
+def test_scrobbles_are_canonicalised(db):
+    lastfm = FakeLastFM()
+    ytmusic = FakeYTMusic(["b (Official Video)", "a"])
+    scrobbler = Scrobbler(lastfm, ytmusic, db, min_overlap_length=2)
+
+    scrobbler.scrobble_tracks(scrobbler.get_tracks_to_scrobble())
+
+    assert lastfm.calls == [["a", "b"]]
+    assert [t.title for t in db.fetch_latest_scrobbles()] == ["b", "a"]
+
+
+def test_stages_and_counters_are_measured(db):
+    lastfm = FakeLastFM(errors=[pylast.WSError(None, "16", "Temporarily unavailable")])
+    scrobbler = Scrobbler(lastfm, FakeYTMusic(["c", "b", "a"]), db, min_overlap_length=2)
+
+    with mock.patch("ytm2lfm.metrics.metrics.enabled", True):
+        metrics.reset()
+        scrobbler.scrobble_tracks(scrobbler.get_tracks_to_scrobble(), batch_size=2)
+        summary = metrics.summary()
+        metrics.reset()
+
+    assert {"get_history", "parse", "detect_new_tracks", "lookup_durations", "enqueue", "scrobble_batch"} <= set(
+        summary["stages"]
+    )
+    assert summary["stages"]["scrobble_batch"]["count"] == 2
+    assert summary["counters"] == {
+        "batches": 2,
+        "duration_lookups": 3,
+        "history_tracks": 3,
+        "new_tracks": 3,
+        'retries{reason="transient"}': 1,
+        "tracks_enqueued": 3,
+        "tracks_scrobbled": 3,
+    }
+
+
+def test_scrobbles_already_on_lastfm_are_skipped(db):
+    lastfm = FakeLastFM()
+    scrobbler = Scrobbler(lastfm, FakeYTMusic(["c", "b", "a"]), db, min_overlap_length=2, dedupe_window=1800)
+    db.insert_lastfm_history([("artist b", "b", int(time.time()) - 600), ("artist a", "a", int(time.time()) - 7200)])
+
+    with mock.patch.object(db, "fetch_lastfm_history_between", wraps=db.fetch_lastfm_history_between) as query:
+        assert scrobbler.enqueue_tracks(scrobbler.get_tracks_to_scrobble()) == 2
+    # a single range query for all the tracks
+    assert query.call_count == 1
+    assert scrobbler.deliver_pending() == 2
+    assert lastfm.calls == [["a", "c"]]
+    assert len(db.fetch_latest_scrobbles()) == 3
+
+
+def test_only_the_latest_tracks_are_scrobbled(db):
+    lastfm = FakeLastFM()
+    scrobbler = Scrobbler(lastfm, FakeYTMusic(["c", "b", "a"]), db, min_overlap_length=2)
+
+    assert scrobbler.enqueue_tracks(scrobbler.get_tracks_to_scrobble(), scrobble_latest=1) == 1
+    assert scrobbler.deliver_pending() == 1
+    assert lastfm.calls == [["c"]]
+    assert len(db.fetch_latest_scrobbles()) == 3
@@ -0,0 +1,77 @@
+import threading
+
+import pylast
+
+from ytm2lfm.ratelimit import TokenBucket
+from ytm2lfm.seed import LastFMSeeder
+from ytm2lfm.track import Track
+
+NOW = 1_700_000_000
+
+
+class FakeLastFM:
+    """Scrobbles of a user, latest first, served like pylast: at most limit of them, after time_from, up to time_to."""
+
+    def __init__(self, scrobbles, registered=NOW - 420, errors=()):
+        self.scrobbles = scrobbles
+        self.registered = registered
+        self.errors = list(errors)
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def get_registered(self):
+        return self.registered
+
+    def get_recent_tracks(self, limit=None, time_from=None, time_to=None):
+        with self._lock:
+            self.requests.append((time_from, time_to))
+            if self.errors:
+                raise self.errors.pop(0)
+        scrobbles = [
+            scrobble
+            for scrobble in self.scrobbles
+            if (time_from is None or scrobble[2] > time_from) and (time_to is None or scrobble[2] <= time_to)
+        ]
+        return scrobbles[:limit]
+
+
+def make_seeder(client, db, **kwargs):
+    return LastFMSeeder(client, db, rate_limiter=TokenBucket(rate=1000, burst=1000), clock=lambda: NOW, **kwargs)
+
+
+def test_seed_pages_each_window_once(db, monkeypatch):
+    monkeypatch.setattr("ytm2lfm.seed.PAGE_SIZE", 2)
+    scrobbles = [(f"Artist  {i % 3}", f"Title {i}", NOW - 60 * i) for i in range(7)]
+    client = FakeLastFM(scrobbles, errors=[pylast.WSError(None, "29", "Rate limit exceeded")])
+    seeder = make_seeder(client, db, max_in_flight=3, window=180)
+
+    assert seeder.seed() == 7
+    # three windows since the registration, a full page is followed by the next page of its window,
+    # and the rate limited request is retried
+    assert len(client.requests) == 8
+    assert set(client.requests) == {
+        (NOW - 420, NOW - 240),
+        (NOW - 420, NOW - 300),
+        (NOW - 420, NOW - 360),
+        (NOW - 240, NOW - 60),
+        (NOW - 240, NOW - 120),
+        (NOW - 240, NOW - 180),
+        (NOW - 60, NOW),
+    }
+    assert db.fetch_lastfm_history(2) == [("artist 0", "title 0", NOW), ("artist 1", "title 1", NOW - 60)]
+
+    # seeding again only adds the missing scrobbles
+    client.scrobbles = [("Artist 0", "New", NOW - 1)] + scrobbles
+    assert seeder.seed(since=NOW - 60) == 1
+
+
+def test_count_unscrobbled(db):
+    history = [Track(f"v{i}", f"Title {i}", "Artist", "", "Today") for i in range(8)]
+    seeder = make_seeder(FakeLastFM([]), db)
+    assert seeder.count_unscrobbled(history, 3) == 8
+
+    # the 3 latest plays are missing from Last.fm, which also has plays from another player
+    db.insert_lastfm_history(
+        [("artist", f"title {i}", NOW - 60 * i) for i in range(3, 8)] + [("other", "song", NOW - 90)]
+    )
+    assert seeder.count_unscrobbled(history, 3) == 3
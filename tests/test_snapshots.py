@@ -0,0 +1,39 @@
+import os
+import tempfile
+
+import pytest
+
+from ytm2lfm.snapshots import HistorySnapshots
+
+
+@pytest.fixture
+def snapshots():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        yield HistorySnapshots(tmpdirname, keep=2)
+
+
+def test_save_and_load_latest(snapshots):
+    assert snapshots.load_latest("alice") is None
+
+    snapshots.save("alice", "f1", [{"videoId": "a"}])
+    snapshots.save("alice", "f2", [{"videoId": "b"}, {"videoId": "a"}])
+    assert snapshots.load_latest("alice") == ("f2", [{"videoId": "b"}, {"videoId": "a"}])
+    assert snapshots.load_latest("bob") is None
+
+
+def test_same_history_is_stored_once_and_old_snapshots_are_pruned(snapshots):
+    first = snapshots.save("alice", "f1", [])
+    assert snapshots.save("alice", "f1", []) == first
+
+    snapshots.save("alice", "f2", [])
+    snapshots.save("alice", "f3", [])
+    assert [fingerprint for _, fingerprint, _ in snapshots._list("alice")] == ["f2", "f3"]
+    assert not os.path.exists(first)
+
+
+def test_processed_fingerprint(snapshots):
+    assert snapshots.last_processed("a/b") is None
+    snapshots.mark_processed("a/b", "f1")
+    snapshots.mark_processed("a/b", "f2")
+    assert snapshots.last_processed("a/b") == "f2"
+    assert os.listdir(snapshots.directory) == ["a_b"]
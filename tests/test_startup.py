@@ -0,0 +1,61 @@
+import os
+import subprocess
+import sys
+import tempfile
+from typing import Dict
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, "src"))
+CLI_PATH = os.path.join(SRC_DIR, "cli.py")
+
+# Top-level packages that must not be loaded until a command actually needs them
+HEAVY_PACKAGES = {
+    "asyncio",
+    "concurrent",
+    "httpx",
+    "httpx2",
+    "pydantic",
+    "pydantic_core",
+    "pydantic_settings",
+    "pylast",
+    "requests",
+    "sqlite3",
+    "ytmusicapi",
+}
+
+# Self import time of the modules loaded by `cli.py --help` on top of a bare interpreter, in microseconds.
+# A few milliseconds in practice, the margin absorbs slow CI machines.
+IMPORT_BUDGET_US = 50_000
+
+
+def import_times(*args: str) -> Dict[str, int]:
+    """Run python -X importtime with args in an empty directory and environment, return self times by module."""
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", *args],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=tmpdirname,
+            env={"PYTHONPATH": SRC_DIR, "PATH": os.environ.get("PATH", "")},
+        )
+
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line[len("import time:") :].split("|")
+        times[name.strip()] = int(self_us)
+    return times
+
+
+def test_help_imports_no_heavy_module():
+    baseline = import_times("-c", "pass")
+    startup = {name: us for name, us in import_times(CLI_PATH, "--help").items() if name not in baseline}
+
+    assert sorted(name for name in startup if name.split(".")[0] in HEAVY_PACKAGES) == []
+    assert sum(startup.values()) < IMPORT_BUDGET_US, sorted(startup.items(), key=lambda item: -item[1])[:10]
+
+
+def test_importing_config_loads_no_settings():
+    # no environment variables nor .env file: loading the settings would fail
+    assert "ytm2lfm.config" in import_times("-c", "import ytm2lfm.config")
@@ -0,0 +1,181 @@
+import io
+import json
+import os
+import tempfile
+from datetime import datetime, timezone
+
+import pytest
+
+from ytm2lfm.canonical import Canonicalizer
+from ytm2lfm.database import SQLite
+from ytm2lfm.takeout import TakeoutImporter, iter_json_array, parse_entry
+from ytm2lfm.track import Track
+
+NOW = datetime(2024, 3, 1, tzinfo=timezone.utc).timestamp()
+
+
+def make_entry(i, time, header="YouTube Music"):
+    return {
+        "header": header,
+        "title": f"Watched title {i} (Official Video)",
+        "titleUrl": f"https://music.youtube.com/watch?v=vid{i}",
+        "subtitles": [{"name": f"artist {i} - Topic", "url": "https://www.youtube.com/channel/x"}],
+        "time": time,
+        "products": ["YouTube"],
+    }
+
+
+def write_history(path, entries):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(entries, f, indent=2, ensure_ascii=False)
+
+
+@pytest.fixture
+def tmpdir():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        yield tmpdirname
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 1 << 16])
+def test_iter_json_array_resumes_at_yielded_offsets(chunk_size):
+    items = [{"title": "é" * i, "n": i} for i in range(20)]
+    data = json.dumps(items, indent=1, ensure_ascii=False).encode()
+
+    streamed = list(iter_json_array(io.BytesIO(data), chunk_size=chunk_size))
+    assert [item for item, _ in streamed] == items
+
+    offset = streamed[9][1]
+    assert [item for item, _ in iter_json_array(io.BytesIO(data), offset, chunk_size=chunk_size)] == items[10:]
+    assert list(iter_json_array(io.BytesIO(data), streamed[-1][1], chunk_size=chunk_size)) == []
+
+
+def test_iter_json_array_rejects_truncated_files():
+    with pytest.raises(ValueError):
+        list(iter_json_array(io.BytesIO(b'[{"a": 1}, {"b"')))
+    with pytest.raises(ValueError):
+        list(iter_json_array(io.BytesIO(b'{"a": 1}')))
+
+
+def test_parse_entry():
+    assert parse_entry(make_entry(1, "2024-01-02T03:04:05.678Z")) == Track(
+        "vid1",
+        "title 1 (Official Video)",
+        "artist 1 - Topic",
+        "",
+        "2024-01-02T03:04:05.678Z",
+        int(datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc).timestamp()),
+    )
+    assert parse_entry(make_entry(1, "2024-01-02T03:04:05Z", header="YouTube")) is None
+    # removed videos
+    removed = {**make_entry(1, "2024-01-02T03:04:05Z"), "title": "Watched https://music.youtube.com/watch?v=vid1"}
+    del removed["subtitles"]
+    assert parse_entry(removed) is None
+
+
+def test_import_archives_and_scrobbles_recent_plays(tmpdir):
+    db = SQLite(os.path.join(tmpdir, "scrobbles.db"))
+    path = os.path.join(tmpdir, "watch-history.json")
+    # latest first, as in Takeout: two plays of the last two weeks, one in January and a YouTube video
+    write_history(
+        path,
+        [
+            make_entry(1, "2024-02-28T10:00:00Z"),
+            make_entry(2, "2024-02-27T10:00:00.5Z"),
+            make_entry(3, "2024-02-27T09:00:00Z", header="YouTube"),
+            make_entry(4, "2024-01-15T10:00:00Z"),
+        ],
+    )
+    importer = TakeoutImporter(db, Canonicalizer(db), chunk_size=2, clock=lambda: NOW)
+
+    assert importer.import_file(path) == (3, 3, 2)
+
+    archived = list(db.iter_archived_scrobbles())
+    assert [(track.video_id, track.artist, track.title) for track in archived] == [
+        ("vid1", "artist 1", "title 1"),
+        ("vid2", "artist 2", "title 2"),
+        ("vid4", "artist 4", "title 4"),
+    ]
+    assert [pending.track.video_id for pending in db.fetch_pending_scrobbles(10)] == ["vid2", "vid1"]
+    # the synced window is left alone
+    assert db.fetch_latest_scrobbles() == []
+
+    # a completed import has nothing left to do, a restarted one skips the plays already archived
+    assert importer.import_file(path) == (0, 0, 0)
+    assert importer.import_file(path, restart=True, scrobble=False) == (3, 0, 0)
+
+
+def test_interrupted_import_resumes_after_the_last_chunk(tmpdir):
+    db = SQLite(os.path.join(tmpdir, "scrobbles.db"))
+    path = os.path.join(tmpdir, "watch-history.json")
+    write_history(path, [make_entry(i, f"2023-0{9 - i}-01T00:00:00Z") for i in range(1, 6)])
+
+    importer = TakeoutImporter(db, Canonicalizer(db), chunk_size=2, clock=lambda: NOW)
+    archive_tracks = db.archive_tracks
+    calls = []
+
+    def failing_archive_tracks(tracks, account_id):
+        calls.append(len(tracks))
+        if len(calls) == 2:
+            raise RuntimeError("interrupted")
+        return archive_tracks(tracks, account_id)
+
+    db.archive_tracks = failing_archive_tracks
+    with pytest.raises(RuntimeError):
+        importer.import_file(path)
+    db.archive_tracks = archive_tracks
+
+    assert importer.import_file(path) == (3, 3, 0)
+    assert sorted(track.video_id for track in db.iter_archived_scrobbles()) == [f"vid{i}" for i in range(1, 6)]
+
+
+def test_import_only_keeps_plays_older_than_the_synced_window(tmpdir):
+    db = SQLite(os.path.join(tmpdir, "scrobbles.db"))
+    synced = int(datetime(2024, 2, 1, tzinfo=timezone.utc).timestamp())
+    db.insert_tracks([Track("vid9", "title", "artist", "", "Today", synced)])
+    path = os.path.join(tmpdir, "watch-history.json")
+    write_history(path, [make_entry(1, "2024-02-02T00:00:00Z"), make_entry(2, "2024-01-31T00:00:00Z")])
+
+    importer = TakeoutImporter(db, Canonicalizer(db), clock=lambda: NOW)
+
+    assert importer.import_file(path, scrobble=False) == (2, 1, 0)
+    assert [track.video_id for track in db.iter_archived_scrobbles()] == ["vid2"]
+
+
+def test_overlapping_imports_do_not_scrobble_twice(tmpdir):
+    db = SQLite(os.path.join(tmpdir, "scrobbles.db"))
+    first, second = os.path.join(tmpdir, "first.json"), os.path.join(tmpdir, "second.json")
+    write_history(first, [make_entry(2, "2024-02-27T10:00:00Z"), make_entry(3, "2024-02-26T10:00:00Z")])
+    # a later export, with one more play
+    write_history(
+        second,
+        [
+            make_entry(1, "2024-02-28T10:00:00Z"),
+            make_entry(2, "2024-02-27T10:00:00Z"),
+            make_entry(3, "2024-02-26T10:00:00Z"),
+        ],
+    )
+
+    assert TakeoutImporter(db, Canonicalizer(db), clock=lambda: NOW).import_file(first) == (2, 2, 2)
+    assert TakeoutImporter(db, Canonicalizer(db), clock=lambda: NOW).import_file(second) == (3, 1, 1)
+    assert [pending.track.video_id for pending in db.fetch_pending_scrobbles(10)] == ["vid3", "vid2", "vid1"]
+
+
+def test_import_does_not_scrobble_plays_the_runs_scrobbled(tmpdir):
+    db = SQLite(os.path.join(tmpdir, "scrobbles.db"), window_size=1)
+    first_run = int(datetime(2024, 2, 25, 10, 5, tzinfo=timezone.utc).timestamp())
+    # the runs scrobbled vid2 and vid3 with their own timestamps, vid2 since moved to the archive
+    db.insert_tracks([Track("vid2", "title 2", "artist 2", "", "Today", first_run)])
+    db.insert_tracks([Track("vid3", "title 3", "artist 3", "", "Today", first_run + 86400 * 3)])
+    path = os.path.join(tmpdir, "watch-history.json")
+    write_history(
+        path,
+        [
+            make_entry(2, "2024-02-26T09:00:00Z"),
+            make_entry(1, "2024-02-25T10:00:00Z"),
+            make_entry(4, "2024-01-15T10:00:00Z"),
+        ],
+    )
+
+    importer = TakeoutImporter(db, Canonicalizer(db), clock=lambda: NOW)
+    assert importer.import_file(path) == (3, 3, 1)
+    assert [pending.track.video_id for pending in db.fetch_pending_scrobbles(10)] == ["vid1"]
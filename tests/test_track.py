@@ -0,0 +1,34 @@
+from ytm2lfm.track import Track
+
+
+def test_from_history():
+    item = {
+        "videoId": "".join(["vid", "1"]),
+        "title": "title",
+        "artists": [{"name": "artist1"}, {"name": "artist2"}, {"name": "1.2M views"}],
+        "album": None,
+        "played": "Today",
+    }
+
+    track = Track.from_history(item)
+    assert track == Track("vid1", "title", "artist1, artist2", "", "Today")
+    assert track.video_id is Track.from_history(dict(item, videoId="".join(["vid", "1"]))).video_id
+    assert Track.from_history(dict(item, album={"name": "album"})).album == "album"
+
+
+def test_from_history_skips_incomplete_entries():
+    assert Track.from_history({"videoId": "vid1", "title": "title", "artists": None, "played": "Today"}) is None
+    assert Track.from_history({"videoId": "vid1", "artists": [], "played": "Today"}) is None
+
+
+def test_to_lastfm():
+    track = Track("vid1", "title", "artist", "album", "Today", 100)
+    assert track.to_lastfm() == {"artist": "artist", "title": "title", "timestamp": 100, "album": "album"}
+
+
+def test_stamped():
+    track = Track("vid1", "Title", "Artist", "Album", "Today")
+    stamped = track.stamped(100)
+    assert stamped == track._replace(timestamp=100)
+    assert type(stamped) is Track
+    assert track.timestamp is None
@@ -1,6 +1,6 @@
 import pytest
 
-from ytm2lfm.utils import find_overlap_start_index
+from ytm2lfm.utils import find_overlap_start_index, history_fingerprint
 
 
 @pytest.mark.parametrize(
@@ -27,7 +27,37 @@ from ytm2lfm.utils import find_overlap_start_index
         (["e", "d"], [], 3, None),
         ([], ["f", "g"], 3, None),
         (["c", "e", "d", "b", "a"], ["e", "d", "c", "b", "a"], 0, None),
+        # scrobbled list runs out before the overlap is long enough
+        (["a", "b", "c"], ["a"], 2, None),
+        # integer-interned ids behave like strings
+        ([3, 5, 4, 2, 1], [5, 4, 3, 2, 1], 2, 1),
+        # duplicated ids in the database only count once
+        (["f", "e", "d", "c"], ["e", "e", "d", "c"], 3, 1),
     ],
 )
 def test_find_overlap_start_index(history_list, scrobbled_list, min_overlap_length, expected):
     assert find_overlap_start_index(history_list, scrobbled_list, min_overlap_length) == expected
+
+
+def test_find_overlap_start_index_consumes_scrobbled_lazily():
+    consumed = []
+
+    def scrobbled():
+        for track in ["e", "d", "c", "b", "a"]:
+            consumed.append(track)
+            yield track
+
+    assert find_overlap_start_index(["f", "e", "d", "c", "b"], scrobbled(), 2) == 1
+    assert consumed == ["e", "d"]
+
+
+def test_history_fingerprint():
+    history = [
+        {"videoId": "b", "played": "Today", "feedbackToken": "x"},
+        {"videoId": "a", "played": "Yesterday", "feedbackToken": "y"},
+    ]
+
+    assert history_fingerprint(history) == history_fingerprint([track | {"feedbackToken": "z"} for track in history])
+    assert history_fingerprint(history) != history_fingerprint(history[::-1])
+    assert history_fingerprint(history) != history_fingerprint([{"videoId": "c", "played": "Today"}] + history)
+    assert history_fingerprint(history) != history_fingerprint([history[0] | {"played": "Yesterday"}, history[1]])